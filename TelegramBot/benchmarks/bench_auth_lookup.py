@@ -0,0 +1,90 @@
+"""
+Замер пропускной способности и p99 проверки пользователя на апдейт:
+по одному GET /users/{chat_id} на апдейт против пакетного загрузчика (и кэша поверх него).
+
+Запуск:
+    cd TelegramBot && PYTHONPATH=.. python -m benchmarks.bench_auth_lookup --updates 5000 --chats 2000
+"""
+import argparse
+import asyncio
+import logging
+import random
+import statistics
+import time
+
+from benchmarks.fake_auth_service import FakeAuthService, start_fake_auth_service
+from src.api.client import AuthServiceClient
+from src.api.user_cache import UserCache
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run_mode(mode: str, base_url: str, service: FakeAuthService, chat_ids, concurrency: int) -> dict:
+    client = AuthServiceClient()
+    client.base_url = base_url
+    cache = UserCache()
+    service.requests = 0
+
+    if mode == "per-update":
+        lookup = client.get_user_by_chat_id
+    elif mode == "batched":
+        lookup = client.load_user
+    else:
+        async def lookup(chat_id):
+            return await cache.get(chat_id, client.load_user)
+
+    latencies = []
+    queue = asyncio.Queue()
+    for chat_id in chat_ids:
+        queue.put_nowait(chat_id)
+
+    async def worker():
+        while not queue.empty():
+            chat_id = queue.get_nowait()
+            started = time.perf_counter()
+            await lookup(chat_id)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    await client.close()
+
+    return {
+        "mode": mode,
+        "updates/s": len(chat_ids) / elapsed,
+        "p50, ms": statistics.median(latencies) * 1000,
+        "p99, ms": percentile(latencies, 99) * 1000,
+        "backend requests": service.requests,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--chats", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.02, help="Задержка fake-сервиса, с")
+    parser.add_argument("--no-bulk", action="store_true", help="Сервис без bulk-эндпоинта (fan-out)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    random.seed(42)
+    chat_ids = [random.randrange(args.chats) for _ in range(args.updates)]
+
+    service = FakeAuthService(latency=args.latency, bulk=not args.no_bulk)
+    runner, base_url = await start_fake_auth_service(service)
+    try:
+        for mode in ("per-update", "batched", "batched+cache"):
+            row = await run_mode(mode, base_url, service, chat_ids, args.concurrency)
+            print(" | ".join(f"{k}: {v:.1f}" if isinstance(v, float) else f"{k}: {v}" for k, v in row.items()))
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
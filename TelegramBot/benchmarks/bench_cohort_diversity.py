@@ -0,0 +1,125 @@
+"""
+Разнообразие когорты на синтетических данных: образцы с разреженными наборами признаков
+(распространённость признаков убывает по закону Ципфа). Печатает время построения матрицы,
+альфа-разнообразия и матриц Брэя-Кёртиса и Жаккара; с --dense - для сравнения плотный
+scipy.spatial.distance.pdist и максимальное расхождение с ним; с --added N - пересборку когорты
+через кэш когорт после добавления N новых задач (холодный и тёплый кэш); с --asv-features K -
+строки расстояний для добавленного ASV-образца с K признаками (каждая уникальная последовательность -
+признак, почти все встречаются только в нём): время и пик памяти distance_rows.
+
+Запуск:
+    cd TelegramBot && PYTHONPATH=.. python -m benchmarks.bench_cohort_diversity --samples 3000 --features 20000
+"""
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from src.pipeline.cohort_cache import CohortCache
+from src.pipeline.diversity import (
+    alpha_diversity, bray_curtis_distance, build_feature_table, distance_rows, jaccard_distance,
+)
+
+
+def make_cohort(samples: int, features: int, per_sample: int, seed: int):
+    rng = np.random.default_rng(seed)
+    prevalence = 1.0 / np.arange(1, features + 1) ** 0.8
+    prevalence /= prevalence.sum()
+    ids = rng.permutation(features).astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+    cohort = []
+    for s in range(samples):
+        k = max(1, int(rng.poisson(per_sample)))
+        chosen = np.unique(rng.choice(features, size=k, p=prevalence))
+        counts = rng.zipf(1.8, size=len(chosen)).clip(max=100000)
+        cohort.append((f"sample{s}", ids[chosen], counts))
+    return cohort
+
+
+def make_asv_sample(cohort, features: int, seed: int):
+    """ASV-образец: общие признаки когорты (первые 300 распространённых) плюс features собственных последовательностей"""
+    rng = np.random.default_rng(seed)
+    common = np.unique(np.concatenate([ids for _, ids, _ in cohort[:50]]))[:300]
+    own = rng.integers(1, 2 ** 63, size=features, dtype=np.uint64)
+    ids = np.unique(np.concatenate([common, own]))
+    return "asv", ids, rng.zipf(1.8, size=len(ids)).clip(max=100000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--samples", type=int, default=3000)
+    parser.add_argument("--features", type=int, default=20000)
+    parser.add_argument("--per-sample", type=int, default=300)
+    parser.add_argument("--dense", action="store_true", help="сравнить с плотным pdist (долго на больших когортах)")
+    parser.add_argument("--added", type=int, default=0, help="новых задач при пересборке когорты через кэш")
+    parser.add_argument("--asv-features", type=int, default=0, help="признаков у добавленного ASV-образца")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    cohort = make_cohort(args.samples, args.features, args.per_sample, args.seed)
+
+    timings = {}
+    started = time.perf_counter()
+    table = build_feature_table(cohort)
+    timings["feature table"] = time.perf_counter() - started
+    for name, fn in (("alpha", alpha_diversity), ("bray-curtis", bray_curtis_distance), ("jaccard", jaccard_distance)):
+        started = time.perf_counter()
+        result = fn(table)
+        timings[name] = time.perf_counter() - started
+        if name == "bray-curtis":
+            bray_curtis = result
+
+    print(f"samples: {table.shape[0]:,} | features: {table.shape[1]:,} | non-zero: {table.counts.nnz:,}")
+    for name, seconds in timings.items():
+        print(f"{name}: {seconds:.2f} s")
+
+    if args.dense:
+        from scipy.spatial.distance import pdist, squareform
+
+        dense = table.counts.toarray().astype(np.float64)
+        dense /= dense.sum(axis=1, keepdims=True)
+        started = time.perf_counter()
+        reference = squareform(pdist(dense, "braycurtis"))
+        print(f"dense pdist bray-curtis: {time.perf_counter() - started:.2f} s | "
+              f"max difference: {np.abs(reference - bray_curtis).max():.2e}")
+
+    if args.added:
+        with tempfile.TemporaryDirectory() as tmp:
+            samples = []
+            for name, ids, counts in cohort:
+                path = os.path.join(tmp, f"{name}.npz")
+                np.savez(path, ids=ids, counts=counts)
+                samples.append((name, hashlib.sha256(name.encode()).hexdigest(), path))
+            cache = CohortCache(root=os.path.join(tmp, "cache"))
+            started = time.perf_counter()
+            cache.diversity(samples[:-args.added])
+            cold = time.perf_counter() - started
+            started = time.perf_counter()
+            result = cache.diversity(samples)
+            warm = time.perf_counter() - started
+            cache.close()
+        stats = result["cache"]
+        print(f"cohort cache: cold {cold:.2f} s | +{args.added} tasks {warm:.2f} s "
+              f"({stats['cached_pairs']:,} of {stats['total_pairs']:,} pairs reused, "
+              f"{stats['computed_rows']} rows computed) | "
+              f"max difference: {np.abs(result['bray_curtis'] - bray_curtis).max():.1e}")
+
+    if args.asv_features:
+        asv_table = build_feature_table(cohort + [make_asv_sample(cohort, args.asv_features, args.seed)])
+        tracemalloc.start()
+        started = time.perf_counter()
+        rows_bc, rows_jaccard = distance_rows(asv_table, [asv_table.shape[0] - 1])
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        dense_block = asv_table.shape[0] * (args.asv_features + 300) * 8
+        print(f"asv sample: {args.asv_features:,} features | distance rows {elapsed:.2f} s | "
+              f"peak {peak / 2 ** 20:.0f} MiB (dense block would be {dense_block / 2 ** 30:.1f} GiB) | "
+              f"bray-curtis min {rows_bc.min():.3f}, jaccard min {rows_jaccard.min():.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Пиковая память (RSS) когортного отчёта в зависимости от размера когорты. Каждый замер - в отдельном процессе:
+синтетические таблицы признаков (как в bench_cohort_diversity), кэш когорт во временном каталоге,
+render_cohort_report в файл. Отдельно печатается прирост пика только на записи страниц:
+потоковый StreamingCanvas против reportlab canvas в BytesIO (как было до потоковой записи).
+
+Запуск:
+    cd TelegramBot && PYTHONPATH=.. python -m benchmarks.bench_cohort_report_rss --sizes 500,1000,2000,4000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+
+def _rss_kb(field: str) -> int:
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+def _reset_peak():
+    # Сброс VmHWM до текущего RSS (Linux 4.0+)
+    with open("/proc/self/clear_refs", "w") as refs:
+        refs.write("5")
+
+
+def child(size: int, writer: str):
+    from io import BytesIO
+
+    import numpy as np
+
+    from benchmarks.bench_cohort_diversity import make_cohort
+    from src.pipeline.cohort_cache import get_cohort_cache
+    from src.utils.pdf_stream import StreamingCanvas
+    from src.utils.report_render import _draw_cohort_samples, render_cohort_report
+
+    tmp = os.environ["COHORT_CACHE_DIR"]
+    specs = []
+    for name, ids, counts in make_cohort(size, 20000, 300, seed=1):
+        path = os.path.join(tmp, f"{name}.npz")
+        np.savez(path, ids=ids, counts=counts)
+        specs.append({"task_id": name, "features_digest": name.rjust(64, "0"), "features_path": path})
+
+    result = {"size": size}
+    before = _rss_kb("VmRSS")
+    _reset_peak()
+    stats = render_cohort_report(specs, os.path.join(tmp, "report.pdf"))
+    result.update(pages=stats["pages"], pdf_bytes=stats["size"], render_peak_kb=_rss_kb("VmHWM") - before)
+
+    # Только запись страниц по уже посчитанному (из кэша) разнообразию
+    diversity = get_cohort_cache().diversity([(s["task_id"], s["features_digest"], s["features_path"]) for s in specs])
+    before = _rss_kb("VmRSS")
+    _reset_peak()
+    if writer == "reportlab":
+        from reportlab.lib.pagesizes import letter
+        from reportlab.pdfgen import canvas
+
+        buffer = BytesIO()
+        c = canvas.Canvas(buffer, pagesize=letter)
+        _draw_cohort_samples(c, diversity["table"].samples, diversity)
+        c.save()
+    else:
+        c = StreamingCanvas(os.path.join(tmp, "pages.pdf"))
+        _draw_cohort_samples(c, diversity["table"].samples, diversity)
+        c.save()
+    result["writer_peak_kb"] = _rss_kb("VmHWM") - before
+    print(json.dumps(result))
+
+
+def measure(size: int, writer: str) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, COHORT_CACHE_DIR=tmp)
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_cohort_report_rss", "--child", str(size), "--writer", writer],
+            env=env, check=True, capture_output=True, text=True
+        ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="500,1000,2000,4000")
+    parser.add_argument("--writer", choices=("stream", "reportlab", "both"), default="both")
+    parser.add_argument("--child", type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.writer)
+        return
+
+    writers = ("stream", "reportlab") if args.writer == "both" else (args.writer,)
+    for size in (int(s) for s in args.sizes.split(",")):
+        for writer in writers:
+            r = measure(size, writer)
+            print(f"{size:>6} samples | {r['pages']:>5} pages, {r['pdf_bytes'] / 1e6:.1f} MB | "
+                  f"report peak +{r['render_peak_kb'] / 1024:.0f} MB | "
+                  f"{writer} page writing peak +{r['writer_peak_kb'] / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
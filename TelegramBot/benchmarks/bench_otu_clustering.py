@@ -0,0 +1,90 @@
+"""
+Жадная OTU-кластеризация на синтетических ампликонах: истинные OTU - случайные последовательности,
+риды - их варианты с заданной долей замен и инделов, численности по закону Ципфа.
+Печатает скорость (риды и уникальные последовательности в секунду), число проверенных
+центроид на уникальную последовательность и сравнение с полным перебором центроид.
+
+Запуск:
+    cd TelegramBot && PYTHONPATH=.. python -m benchmarks.bench_otu_clustering --otus 300 --reads 200000
+"""
+import argparse
+import io
+import time
+
+import numpy as np
+
+from src.pipeline.derep import ALPHABET, dereplicate_stream
+from src.pipeline.otu import GreedyOTUClusterer
+
+
+def mutate(rng: np.random.Generator, seq: np.ndarray, rate: float) -> np.ndarray:
+    n_edits = rng.binomial(len(seq), rate)
+    seq = seq.copy()
+    for _ in range(n_edits):
+        pos = int(rng.integers(len(seq)))
+        op = rng.random()
+        if op < 0.8:
+            seq[pos] = (seq[pos] + rng.integers(1, 4)) % 4
+        elif op < 0.9:
+            seq = np.insert(seq, pos, rng.integers(4))
+        else:
+            seq = np.delete(seq, pos)
+    return seq
+
+
+def make_fastq(otus: int, reads: int, length: int, variants: int, error_rate: float, seed: int) -> bytes:
+    rng = np.random.default_rng(seed)
+    truth = rng.integers(0, 4, size=(otus, length)).astype(np.uint8)
+    # Для каждой OTU - набор вариантов (ошибки секвенирования), численность OTU и вариантов - Ципф
+    pool = []
+    for otu in truth:
+        pool.append(otu)
+        pool.extend(mutate(rng, otu, error_rate) for _ in range(variants))
+    weights = 1.0 / np.arange(1, len(pool) + 1) ** 1.1
+    picks = rng.choice(len(pool), size=reads, p=weights / weights.sum())
+    out = io.BytesIO()
+    for i, idx in enumerate(picks):
+        seq = ALPHABET[pool[idx]].tobytes()
+        out.write(b"@r%d\n%s\n+\n%s\n" % (i, seq, b"I" * len(seq)))
+    return out.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--otus", type=int, default=300)
+    parser.add_argument("--reads", type=int, default=200000)
+    parser.add_argument("--length", type=int, default=250)
+    parser.add_argument("--variants", type=int, default=20)
+    parser.add_argument("--error-rate", type=float, default=0.01)
+    parser.add_argument("--identity", type=float, default=0.97)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    data = make_fastq(args.otus, args.reads, args.length, args.variants, args.error_rate, args.seed)
+
+    started = time.perf_counter()
+    derep = dereplicate_stream(io.BytesIO(data))
+    derep_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    result = GreedyOTUClusterer(identity=args.identity, min_size=1).cluster(derep)
+    cluster_time = time.perf_counter() - started
+
+    stats = result.stats
+    uniques = stats["clustered_uniques"]
+    # Без индекса каждая уникальная последовательность сравнивалась бы со всеми центроидами, найденными до неё
+    is_centroid = np.zeros(len(derep), dtype=bool)
+    is_centroid[result.centroids] = True
+    naive = int((np.cumsum(is_centroid) - is_centroid).sum())
+
+    print(f"reads: {args.reads:,} | uniques: {len(derep):,} | true OTUs: {args.otus} | found OTUs: {stats['otus']}")
+    print(f"dereplication: {derep_time:.2f} s ({args.reads / derep_time:,.0f} reads/s)")
+    print(f"clustering: {cluster_time:.2f} s ({args.reads / cluster_time:,.0f} reads/s, "
+          f"{uniques / cluster_time:,.0f} uniques/s)")
+    print(f"centroids checked per unique: {stats['checked_per_unique']:.2f} "
+          f"(aligned: {stats['aligned_candidates']:,}, accepted by Hamming: {stats['hamming_accepts']:,}) | "
+          f"exhaustive search would check {naive / max(uniques, 1):.1f}")
+
+
+if __name__ == "__main__":
+    main()
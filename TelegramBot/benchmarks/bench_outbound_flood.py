@@ -0,0 +1,167 @@
+"""
+Всплеск исходящих сообщений: много задач завершились одновременно. Локальный fake Bot API ограничивает
+частоту как Telegram (общий лимит бота и лимит на чат, token bucket) и отвечает 429 с retry_after.
+Уведомления (--notifications в --chats чатов, часть чатов получает по несколько) отправляются
+одновременно, как пачка NotificationRelay; пока они идут, --interactive ответов на команды
+уходят в случайные чаты раз в --interactive-interval секунд.
+
+Режимы: direct - без мидлвари (ошибки 429 достаются вызывающему), outbound - через OutboundDispatcher
+(уведомления в полосе bulk). Печатает доставленные, 429 от API, ошибки у вызывающих, время всплеска
+и задержку интерактивных ответов (p50/p99).
+
+Запуск:
+    cd TelegramBot && PYTHONPATH=.. python -m benchmarks.bench_outbound_flood --notifications 600 --chats 200
+"""
+import argparse
+import asyncio
+import logging
+import random
+import time
+from typing import Dict, List
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramRetryAfter
+from aiohttp import web
+
+from src.middlewares.outbound import OutboundDispatcher, bulk_lane
+from benchmarks.bench_webhook_replay import free_port
+
+TOKEN = "123456:bench"
+
+
+class Limit:
+    """Token bucket на стороне fake Bot API"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.perf_counter()
+
+    def try_take(self) -> bool:
+        now = time.perf_counter()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class FakeBotAPI:
+    """sendMessage с лимитами: при превышении - 429 и retry_after (секунды, как у Telegram - целые)"""
+
+    def __init__(self, latency: float, global_rate: float, chat_rate: float, chat_burst: float):
+        self.latency = latency
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.global_limit = Limit(global_rate, global_rate)
+        self.chat_limits: Dict[int, Limit] = {}
+        self.delivered = 0
+        self.rejected = 0
+
+    def reset(self):
+        self.global_limit = Limit(self.global_limit.rate, self.global_limit.burst)
+        self.chat_limits = {}
+        self.delivered = 0
+        self.rejected = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        data = await request.post()
+        await asyncio.sleep(self.latency)
+        chat_id = int(data["chat_id"])
+        chat_limit = self.chat_limits.setdefault(chat_id, Limit(self.chat_rate, self.chat_burst))
+        if not chat_limit.try_take() or not self.global_limit.try_take():
+            self.rejected += 1
+            return web.json_response({"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                                      "parameters": {"retry_after": 1}})
+        self.delivered += 1
+        return web.json_response({"ok": True, "result": {
+            "message_id": self.delivered, "date": int(time.time()), "text": data.get("text", ""),
+            "chat": {"id": chat_id, "type": "private"}}})
+
+    async def start(self, port: int) -> web.AppRunner:
+        app = web.Application()
+        app.router.add_post("/bot{token}/sendMessage", self.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        return runner
+
+
+async def run(mode: str, api: FakeBotAPI, api_url: str, args) -> dict:
+    api.reset()
+    session = AiohttpSession(api=TelegramAPIServer.from_base(api_url), limit=200)
+    dispatcher = None
+    if mode == "outbound":
+        dispatcher = OutboundDispatcher()
+        session.middleware(dispatcher)
+    bot = Bot(token=TOKEN, session=session)
+    rng = random.Random(1)
+    chats = [1000 + rng.randrange(args.chats) for _ in range(args.notifications)]
+    errors = 0
+    latencies: List[float] = []
+
+    async def notify(chat_id: int, index: int):
+        nonlocal errors
+        try:
+            with bulk_lane():
+                await bot.send_message(chat_id, f"Задача {index} завершена")
+        except TelegramRetryAfter:
+            errors += 1
+
+    async def interactive():
+        nonlocal errors
+        for _ in range(args.interactive):
+            await asyncio.sleep(args.interactive_interval)
+            started = time.perf_counter()
+            try:
+                await bot.send_message(1000 + rng.randrange(args.chats), "pong")
+                latencies.append(time.perf_counter() - started)
+            except TelegramRetryAfter:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(interactive(), *(notify(chat_id, i) for i, chat_id in enumerate(chats)))
+    elapsed = time.perf_counter() - started
+    if dispatcher is not None:
+        await dispatcher.close()
+    await bot.session.close()
+
+    ordered = sorted(latencies) or [0.0]
+    return {"mode": mode, "delivered": api.delivered, "429": api.rejected, "errors": errors, "seconds": elapsed,
+            "interactive p50 ms": ordered[len(ordered) // 2] * 1000,
+            "interactive p99 ms": ordered[int(0.99 * (len(ordered) - 1))] * 1000}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--notifications", type=int, default=600)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--interactive", type=int, default=50)
+    parser.add_argument("--interactive-interval", type=float, default=0.2)
+    parser.add_argument("--api-latency", type=float, default=0.03, help="задержка ответа Bot API, секунды")
+    parser.add_argument("--global-rate", type=float, default=30, help="лимит fake Bot API, сообщений в секунду")
+    parser.add_argument("--chat-rate", type=float, default=1, help="лимит на чат, сообщений в секунду")
+    parser.add_argument("--chat-burst", type=float, default=3, help="сообщений в чат подряд без ожидания")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    port = free_port()
+    api = FakeBotAPI(args.api_latency, args.global_rate, args.chat_rate, args.chat_burst)
+    runner = await api.start(port)
+    api_url = f"http://127.0.0.1:{port}"
+    results = [await run("direct", api, api_url, args), await run("outbound", api, api_url, args)]
+    await runner.cleanup()
+
+    print(f"notifications: {args.notifications:,} in {args.chats} chats | interactive: {args.interactive} | "
+          f"limits: {args.global_rate:g}/s, {args.chat_rate:g}/s per chat")
+    for result in results:
+        print(" | ".join(f"{key}: {value:.2f}" if isinstance(value, float) else f"{key}: {value}"
+                         for key, value in result.items()))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
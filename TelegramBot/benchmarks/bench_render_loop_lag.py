@@ -0,0 +1,94 @@
+"""
+Задержка event loop во время рендеринга когортных PDF: прямо в event loop (как раньше)
+против пула процессов рендеринга.
+
+Запуск:
+    cd TelegramBot && PYTHONPATH=.. python -m benchmarks.bench_render_loop_lag --pages 500 --reports 4
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from src.utils.render_executor import RenderExecutor
+from src.utils.report_render import render_cohort_report
+
+
+class LagProbe:
+    """Периодически засыпает на interval и замеряет, насколько позже event loop его разбудил"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.lags = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(time.perf_counter() - started - self.interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    def summary(self) -> str:
+        ordered = sorted(self.lags) or [0.0]
+        p99 = ordered[min(len(ordered) - 1, int(0.99 * (len(ordered) - 1)))]
+        return f"max lag: {ordered[-1] * 1000:.1f} ms | p99 lag: {p99 * 1000:.1f} ms | ticks: {len(self.lags)}"
+
+
+def make_specs(pages: int):
+    return [
+        {"task_id": f"task-{i:05d}", "filename": f"sample_{i}.fastq.gz",
+         "params": {"instrument": "QIIME2", "reference": "SILVA", "clustering": "ASV"}}
+        for i in range(pages)
+    ]
+
+
+async def inline(specs, reports: int, out_dir: str):
+    for i in range(reports):
+        render_cohort_report(specs, os.path.join(out_dir, f"inline_{i}.pdf"))
+        await asyncio.sleep(0)
+
+
+async def pooled(executor: RenderExecutor, specs, reports: int, out_dir: str):
+    await asyncio.gather(*(executor.render(render_cohort_report, specs, os.path.join(out_dir, f"pooled_{i}.pdf"))
+                           for i in range(reports)))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--reports", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    specs = make_specs(args.pages)
+    executor = RenderExecutor(workers=args.workers)
+    out_dir = tempfile.mkdtemp(prefix="render-lag-")
+    # Прогрев пула, чтобы в замер не попал запуск процессов
+    await executor.render(render_cohort_report, specs[:1], os.path.join(out_dir, "warmup.pdf"))
+
+    for name, run in (("inline", lambda: inline(specs, args.reports, out_dir)),
+                      ("process pool", lambda: pooled(executor, specs, args.reports, out_dir))):
+        probe = LagProbe()
+        probe.start()
+        started = time.perf_counter()
+        await run()
+        elapsed = time.perf_counter() - started
+        await probe.stop()
+        print(f"{name}: {elapsed:.2f} s | {probe.summary()}")
+
+    executor.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
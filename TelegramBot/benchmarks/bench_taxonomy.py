@@ -0,0 +1,102 @@
+"""
+Наивный байесовский k-мерный классификатор на синтетическом референсе: дерево таксонов, где
+последовательности каждого уровня - мутации предка. Обучает индекс во временном каталоге,
+классифицирует мутированные варианты референсных последовательностей и печатает скорость обучения
+и классификации, точность на уровне рода и долю назначенных до рода запросов.
+
+Запуск:
+    cd TelegramBot && PYTHONPATH=.. python -m benchmarks.bench_taxonomy --genera 500 --queries 5000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from src.pipeline.derep import ALPHABET
+from src.pipeline.taxonomy import NaiveBayesClassifier, TaxonomyIndex, train_index
+
+RANKS = ("k", "p", "c", "o", "f", "g")
+
+
+def mutate(rng: np.random.Generator, seq: np.ndarray, rate: float) -> np.ndarray:
+    seq = seq.copy()
+    positions = rng.random(len(seq)) < rate
+    seq[positions] = (seq[positions] + rng.integers(1, 4, size=int(positions.sum()))) % 4
+    return seq
+
+
+def make_reference(genera: int, per_genus: int, length: int, seed: int):
+    """Референс: {(линия): [последовательности]}; ветвление одинаково на всех уровнях"""
+    rng = np.random.default_rng(seed)
+    branching = max(2, int(round(genera ** (1 / len(RANKS)))))
+    taxa = {(): rng.integers(0, 4, size=length).astype(np.uint8)}
+    for depth, rank in enumerate(RANKS):
+        # Глубже - меньше отличий от предка, как в настоящих 16S
+        rate = 0.08 / (depth + 1)
+        taxa = {
+            parent + (f"{rank}__{rank.upper()}{p * branching + i}",): mutate(rng, seq, rate)
+            for p, (parent, seq) in enumerate(taxa.items()) for i in range(branching)
+        }
+    lineages = list(taxa)[:genera]
+    return {lineage: [mutate(rng, taxa[lineage], 0.01) for _ in range(per_genus)] for lineage in lineages}
+
+
+def write_reference(reference, directory: str):
+    fasta = os.path.join(directory, "ref.fasta")
+    tsv = os.path.join(directory, "ref_taxonomy.tsv")
+    with open(fasta, "wb") as f, open(tsv, "w") as t:
+        t.write("Feature ID\tTaxon\n")
+        n = 0
+        for lineage, sequences in reference.items():
+            for seq in sequences:
+                f.write(b">seq%d\n%s\n" % (n, ALPHABET[seq].tobytes()))
+                t.write(f"seq{n}\t{'; '.join(lineage)}\n")
+                n += 1
+    return fasta, tsv
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--genera", type=int, default=500)
+    parser.add_argument("--per-genus", type=int, default=3)
+    parser.add_argument("--length", type=int, default=250)
+    parser.add_argument("--queries", type=int, default=5000)
+    parser.add_argument("--error-rate", type=float, default=0.02)
+    parser.add_argument("--bootstraps", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    reference = make_reference(args.genera, args.per_genus, args.length, args.seed)
+    rng = np.random.default_rng(args.seed + 1)
+    lineages = list(reference)
+    truth = rng.integers(len(lineages), size=args.queries)
+    queries = [mutate(rng, reference[lineages[t]][0], args.error_rate) for t in truth.tolist()]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fasta, tsv = write_reference(reference, tmp)
+        started = time.perf_counter()
+        meta = train_index(fasta, tsv, os.path.join(tmp, "index"), name="synthetic")
+        train_time = time.perf_counter() - started
+
+        index = TaxonomyIndex(os.path.join(tmp, "index"))
+        classifier = NaiveBayesClassifier(index, bootstraps=args.bootstraps)
+        started = time.perf_counter()
+        result = classifier.classify(queries)
+        classify_time = time.perf_counter() - started
+        size_mb = os.path.getsize(os.path.join(tmp, "index", "kmer_logp.npy")) / 2 ** 20
+
+    expected = ["; ".join(lineages[t]) for t in truth.tolist()]
+    correct = sum(index.lineages[b] == e for b, e in zip(result.taxon.tolist(), expected))
+    to_genus = int(np.count_nonzero(result.depth == len(RANKS)))
+    print(f"reference: {meta['sequences']:,} sequences, {len(meta['lineages']):,} genera, index {size_mb:.0f} MB")
+    print(f"training: {train_time:.2f} s")
+    print(f"classification ({args.bootstraps} bootstraps): {classify_time:.2f} s "
+          f"({args.queries / classify_time:,.0f} queries/s)")
+    print(f"genus accuracy (best hit): {correct / args.queries:.1%} | "
+          f"assigned to genus at confidence {classifier.threshold}: {to_genus / args.queries:.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""
+Проигрывание записанных апдейтов: long polling против webhook. Локальный fake Bot API отдаёт апдейты
+через getUpdates (polling) и отвечает на sendMessage с искусственной задержкой; в режиме webhook
+те же апдейты отправляются POST-запросами на WebhookServer по --connections соединениям
+(как Telegram с max_connections). Обработчик на каждый апдейт отвечает сообщением.
+Печатает апдейты в секунду, задержку от появления апдейта до конца обработки (p50/p99; с --rate
+апдейты появляются постепенно), 503 из-за заполненной очереди и проверку секрета.
+
+Апдейты - JSON по одному на строку (--updates-file, например записанные из реального бота),
+без него генерируются синтетические сообщения; --save сохраняет их для повторного проигрывания.
+
+Запуск:
+    cd TelegramBot && PYTHONPATH=.. python -m benchmarks.bench_webhook_replay --updates 5000 --api-latency 0.03
+"""
+import argparse
+import asyncio
+import json
+import logging
+import socket
+import time
+from typing import List
+
+from aiogram import Bot, Dispatcher, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Message, Update
+from aiohttp import ClientSession, TCPConnector, web
+
+from src.webhook import SECRET_HEADER, WebhookServer
+
+TOKEN = "123456:bench"
+SECRET = "bench-secret"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def make_updates(count: int, chats: int) -> List[dict]:
+    now = int(time.time())
+    return [
+        {"update_id": i + 1,
+         "message": {"message_id": i + 1, "date": now, "text": f"ping {i}",
+                     "chat": {"id": 1000 + i % chats, "type": "private"},
+                     "from": {"id": 1000 + i % chats, "is_bot": False, "first_name": "User"}}}
+        for i in range(count)
+    ]
+
+
+class FakeBotAPI:
+    """
+    Bot API в памяти: getUpdates по offset, sendMessage и прочие методы - ok после задержки.
+    С rate апдейты появляются постепенно (i-й через i / rate секунд после begin), getUpdates
+    ждёт следующий апдейт как настоящий long polling
+    """
+
+    def __init__(self, updates: List[dict], latency: float, rate: float = 0.0):
+        self.updates = updates
+        self.latency = latency
+        self.rate = rate
+        self.started = 0.0
+        self.calls = 0
+
+    def begin(self):
+        self.started = time.perf_counter()
+
+    def release_time(self, index: int) -> float:
+        return self.started + (index / self.rate if self.rate else 0.0)
+
+    def released(self) -> int:
+        if not self.rate:
+            return len(self.updates)
+        return min(len(self.updates), int((time.perf_counter() - self.started) * self.rate) + 1)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.calls += 1
+        method = request.match_info["method"]
+        data = await request.post()
+        await asyncio.sleep(self.latency)
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif method == "getUpdates":
+            start = max(0, int(data.get("offset") or 0) - 1)
+            limit = int(data.get("limit") or 100)
+            deadline = time.perf_counter() + float(data.get("timeout") or 0)
+            while self.released() <= start and start < len(self.updates) and time.perf_counter() < deadline:
+                await asyncio.sleep(max(0.0, min(deadline, self.release_time(start)) - time.perf_counter()))
+            result = self.updates[start:min(start + limit, self.released())]
+            if not result and start >= len(self.updates):
+                await asyncio.sleep(min(float(data.get("timeout") or 0), 0.2))
+        elif method == "sendMessage":
+            chat_id = int(data["chat_id"])
+            result = {"message_id": 1, "date": int(time.time()), "text": data.get("text", ""),
+                      "chat": {"id": chat_id, "type": "private"}}
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self, port: int) -> web.AppRunner:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        return runner
+
+
+def make_bot_and_dispatcher(api: FakeBotAPI, api_url: str, updates: List[dict]):
+    bot = Bot(token=TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(api_url)))
+    dp = Dispatcher()
+    done = asyncio.Event()
+    index = {update["update_id"]: i for i, update in enumerate(updates)}
+    latencies: List[float] = []
+
+    @dp.message(F.text)
+    async def reply(message: Message, event_update: Update):
+        await message.answer("pong")
+        # Задержка от появления апдейта в Bot API до конца обработки
+        latencies.append(time.perf_counter() - api.release_time(index[event_update.update_id]))
+        if len(latencies) >= len(updates):
+            done.set()
+
+    return bot, dp, done, latencies
+
+
+def summary(mode: str, latencies: List[float], elapsed: float) -> dict:
+    ordered = sorted(latencies)
+    return {"mode": mode, "updates/s": len(latencies) / elapsed, "seconds": elapsed,
+            "p50 ms": ordered[len(ordered) // 2] * 1000, "p99 ms": ordered[int(0.99 * (len(ordered) - 1))] * 1000}
+
+
+async def run_polling(api: FakeBotAPI, api_url: str, updates: List[dict]) -> dict:
+    bot, dp, done, latencies = make_bot_and_dispatcher(api, api_url, updates)
+    api.begin()
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, polling_timeout=10))
+    await done.wait()
+    elapsed = time.perf_counter() - api.started
+    await dp.stop_polling()
+    await polling
+    return summary("polling", latencies, elapsed)
+
+
+async def run_webhook(api: FakeBotAPI, api_url: str, updates: List[dict], connections: int,
+                      queue_size: int, workers: int) -> dict:
+    bot, dp, done, latencies = make_bot_and_dispatcher(api, api_url, updates)
+    port = free_port()
+    server = WebhookServer(dp, bot, secret=SECRET, path="/webhook", host="127.0.0.1", port=port,
+                           queue_size=queue_size, workers=workers)
+    await server.start()
+    url = f"http://127.0.0.1:{port}/webhook"
+    pending = asyncio.Queue()
+    for i in range(len(updates)):
+        pending.put_nowait(i)
+    retries = 0
+
+    async with ClientSession(connector=TCPConnector(limit=connections)) as session:
+        async with session.post(url, json=updates[0], headers={SECRET_HEADER: "wrong"}) as response:
+            unauthorized = response.status
+
+        async def deliver():
+            # Как Telegram: по одному апдейту на соединение, повтор после ошибки
+            nonlocal retries
+            while not pending.empty():
+                i = pending.get_nowait()
+                await asyncio.sleep(max(0.0, api.release_time(i) - time.perf_counter()))
+                while True:
+                    async with session.post(url, json=updates[i], headers={SECRET_HEADER: SECRET}) as response:
+                        if response.status == 200:
+                            break
+                    retries += 1
+                    await asyncio.sleep(0.05)
+
+        api.begin()
+        await asyncio.gather(*(deliver() for _ in range(connections)))
+        await done.wait()
+        elapsed = time.perf_counter() - api.started
+
+    await server.stop()
+    await bot.session.close()
+    return {**summary("webhook", latencies, elapsed), "503 retries": retries,
+            "max queue depth": server.max_depth, "wrong secret status": unauthorized}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--chats", type=int, default=500)
+    parser.add_argument("--updates-file", help="записанные апдейты, JSON по одному на строку")
+    parser.add_argument("--save", help="сохранить проигрываемые апдейты в файл")
+    parser.add_argument("--api-latency", type=float, default=0.03, help="задержка ответа Bot API, секунды")
+    parser.add_argument("--rate", type=float, default=0.0,
+                        help="апдейтов в секунду (0 - все доступны сразу, замер пропускной способности)")
+    parser.add_argument("--connections", type=int, default=40)
+    parser.add_argument("--queue-size", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=32)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.updates_file:
+        with open(args.updates_file) as f:
+            updates = [json.loads(line) for line in f if line.strip()]
+    else:
+        updates = make_updates(args.updates, args.chats)
+    if args.save:
+        with open(args.save, "w") as f:
+            f.writelines(json.dumps(update) + "\n" for update in updates)
+
+    api_port = free_port()
+    api = FakeBotAPI(updates, args.api_latency, args.rate)
+    runner = await api.start(api_port)
+    api_url = f"http://127.0.0.1:{api_port}"
+
+    results = [await run_polling(api, api_url, updates),
+               await run_webhook(api, api_url, updates, args.connections, args.queue_size, args.workers)]
+    await runner.cleanup()
+
+    print(f"updates: {len(updates):,} | Bot API latency: {args.api_latency * 1000:.0f} ms | "
+          f"rate: {args.rate or 'all at once'}")
+    for result in results:
+        print(" | ".join(f"{key}: {value:.2f}" if isinstance(value, float) else f"{key}: {value}"
+                         for key, value in result.items()))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
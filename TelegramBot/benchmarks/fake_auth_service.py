@@ -0,0 +1,95 @@
+"""
+Локальный fake сервиса авторизации для нагрузочных замеров.
+
+Запуск:
+    cd TelegramBot && PYTHONPATH=.. python -m benchmarks.fake_auth_service --port 8000 --latency 0.02
+"""
+import argparse
+import asyncio
+
+from aiohttp import web
+
+
+class FakeAuthService:
+    """Сервис авторизации в памяти с искусственной задержкой ответа"""
+
+    def __init__(self, latency: float = 0.02, bulk: bool = True, registered_ratio: float = 0.9):
+        self.latency = latency
+        self.bulk = bulk
+        self.registered_ratio = registered_ratio
+        self.users = {}
+        self.requests = 0
+
+    def _is_registered(self, chat_id: int) -> bool:
+        return chat_id in self.users or (chat_id % 100) < self.registered_ratio * 100
+
+    def _user(self, chat_id: int) -> dict:
+        return self.users.get(chat_id) or {
+            "id": chat_id,
+            "chat_id": chat_id,
+            "name": f"User_{chat_id}",
+            "username": f"user_{chat_id}",
+            "telegram_username": None,
+            "is_deleted": False,
+        }
+
+    async def get_user(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        chat_id = int(request.match_info["chat_id"])
+        if not self._is_registered(chat_id):
+            return web.json_response({"detail": "Пользователь не найден"}, status=404)
+        return web.json_response(self._user(chat_id))
+
+    async def get_users_bulk(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        if not self.bulk:
+            return web.json_response({"detail": "Not Found"}, status=404)
+        await asyncio.sleep(self.latency)
+        payload = await request.json()
+        users = [self._user(chat_id) for chat_id in payload.get("chat_ids", []) if self._is_registered(chat_id)]
+        return web.json_response(users)
+
+    async def create_user(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        payload = await request.json()
+        chat_id = int(payload["chat_id"])
+        if chat_id in self.users:
+            return web.json_response({"detail": "Пользователь уже существует"}, status=400)
+        self.users[chat_id] = {**self._user(chat_id), **payload, "id": chat_id}
+        return web.json_response(self.users[chat_id], status=201)
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/users/bulk", self.get_users_bulk)
+        app.router.add_get("/users/{chat_id}", self.get_user)
+        app.router.add_post("/users/", self.create_user)
+        return app
+
+
+async def start_fake_auth_service(service: FakeAuthService, host: str = "127.0.0.1", port: int = 0):
+    """Запускает сервис в текущем event loop, возвращает (runner, base_url)"""
+    runner = web.AppRunner(service.make_app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    sockets = site._server.sockets
+    actual_port = sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{actual_port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake auth service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--no-bulk", action="store_true", help="Отвечать 404 на bulk-эндпоинт")
+    args = parser.parse_args()
+
+    service = FakeAuthService(latency=args.latency, bulk=not args.no_bulk)
+    web.run_app(service.make_app(), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -12,4 +12,140 @@ API_TIMEOUT = 30.0
 
 # Повторные попытки при ошибках сети
 API_RETRY_ATTEMPTS = 3
-API_RETRY_DELAY = 1.0
\ No newline at end of file
+API_RETRY_DELAY = 1.0
+
+# Кэш пользователей сервиса авторизации
+USER_CACHE_MAX_SIZE = int(os.getenv("USER_CACHE_MAX_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+USER_CACHE_NEGATIVE_TTL = float(os.getenv("USER_CACHE_NEGATIVE_TTL", "30"))
+
+# Пакетная загрузка пользователей (окно сбора chat_id и bulk-эндпоинт сервиса авторизации)
+AUTH_BATCH_WINDOW = float(os.getenv("AUTH_BATCH_WINDOW", "0.005"))
+AUTH_BATCH_MAX_SIZE = int(os.getenv("AUTH_BATCH_MAX_SIZE", "100"))
+AUTH_BULK_ENDPOINT = os.getenv("AUTH_BULK_ENDPOINT", "/users/bulk")
+AUTH_FANOUT_CONCURRENCY = int(os.getenv("AUTH_FANOUT_CONCURRENCY", "20"))
+
+# Хранилище задач (SQLite)
+TASK_DB_PATH = os.getenv("TASK_DB_PATH", "data/tasks.sqlite3")
+TASK_CACHE_SIZE = int(os.getenv("TASK_CACHE_SIZE", "2000"))
+TASK_WRITE_BATCH_SIZE = int(os.getenv("TASK_WRITE_BATCH_SIZE", "64"))
+TASK_FLUSH_INTERVAL = float(os.getenv("TASK_FLUSH_INTERVAL", "0.5"))
+
+# FSM-хранилище диалогов: "sqlite" (общий файл для нескольких процессов бота), "redis" (нужен пакет redis,
+# для реплик на разных машинах) или "memory" (один процесс, состояние теряется при перезапуске).
+# TTL брошенного диалога (секунды), кэш чтения, запись пачками (размер пачки и интервал) и период очистки истёкших
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite")
+FSM_DB_PATH = os.getenv("FSM_DB_PATH", "data/fsm.sqlite3")
+FSM_REDIS_URL = os.getenv("FSM_REDIS_URL", "redis://localhost:6379/0")
+FSM_TTL = int(os.getenv("FSM_TTL", str(24 * 3600)))
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+FSM_WRITE_BATCH_SIZE = int(os.getenv("FSM_WRITE_BATCH_SIZE", "100"))
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "0.05"))
+FSM_PURGE_INTERVAL = float(os.getenv("FSM_PURGE_INTERVAL", "600"))
+
+# Размер страницы /list_analyses
+LIST_PAGE_SIZE = int(os.getenv("LIST_PAGE_SIZE", "20"))
+
+# Хранилище отчётов на диске и кэш недавних отчётов в памяти
+BLOB_STORE_DIR = os.getenv("BLOB_STORE_DIR", "data/blobs")
+REPORT_CACHE_MAX_BYTES = int(os.getenv("REPORT_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+REPORT_CACHE_MAX_ITEM_BYTES = int(os.getenv("REPORT_CACHE_MAX_ITEM_BYTES", str(4 * 1024 * 1024)))
+
+# Пул процессов для рендеринга PDF (вне event loop)
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "2"))
+RENDER_QUEUE_SIZE = int(os.getenv("RENDER_QUEUE_SIZE", "16"))
+RENDER_QUEUE_TIMEOUT = float(os.getenv("RENDER_QUEUE_TIMEOUT", "10"))
+
+# Контроль качества FASTQ
+QC_CHUNK_SIZE = int(os.getenv("QC_CHUNK_SIZE", str(4 * 1024 * 1024)))
+QC_MAX_POSITIONS = int(os.getenv("QC_MAX_POSITIONS", "500"))
+QC_DUP_SKETCH_SIZE = int(os.getenv("QC_DUP_SKETCH_SIZE", "16384"))
+# Число процессов для параллельного контроля качества (куски файла и образцы архива)
+QC_WORKERS = int(os.getenv("QC_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Дерепликация ридов: бюджет памяти таблиц подсчёта и число разделов при сбросе на диск
+DEREP_MEMORY_BUDGET_MB = int(os.getenv("DEREP_MEMORY_BUDGET_MB", "256"))
+DEREP_SPILL_PARTITIONS = int(os.getenv("DEREP_SPILL_PARTITIONS", "16"))
+
+# Жадная кластеризация в OTU: порог идентичности, длина k-мера индекса, число выравниваемых кандидатов,
+# минимальная численность уникальной последовательности
+OTU_IDENTITY = float(os.getenv("OTU_IDENTITY", "0.97"))
+OTU_KMER_SIZE = int(os.getenv("OTU_KMER_SIZE", "8"))
+OTU_MAX_REJECTS = int(os.getenv("OTU_MAX_REJECTS", "16"))
+OTU_MIN_SIZE = int(os.getenv("OTU_MIN_SIZE", "1"))
+
+# Таксономическая классификация: каталог обученных индексов (по подкаталогу на референс - SILVA, Greengenes),
+# длина k-мера, число уровней линии (6 - до рода), порог достоверности и число повторов бутстрэпа
+TAXONOMY_INDEX_DIR = os.getenv("TAXONOMY_INDEX_DIR", "data/references")
+TAXONOMY_KMER_SIZE = int(os.getenv("TAXONOMY_KMER_SIZE", "8"))
+TAXONOMY_DEPTH = int(os.getenv("TAXONOMY_DEPTH", "6"))
+TAXONOMY_CONFIDENCE = float(os.getenv("TAXONOMY_CONFIDENCE", "0.8"))
+TAXONOMY_BOOTSTRAPS = int(os.getenv("TAXONOMY_BOOTSTRAPS", "100"))
+
+# Реестр референсов: какие индексы бот загружает при запуске, как часто проверять новые версии (секунды, 0 - не проверять)
+# и сколько версий каждого референса хранить на диске, включая текущую
+REFERENCE_PRELOAD = [name for name in os.getenv("REFERENCE_PRELOAD", "SILVA,Greengenes").split(",") if name]
+REFERENCE_CHECK_INTERVAL = float(os.getenv("REFERENCE_CHECK_INTERVAL", "60"))
+REFERENCE_KEEP_VERSIONS = int(os.getenv("REFERENCE_KEEP_VERSIONS", "2"))
+
+# Кэш когортного анализа: каталог, размер плитки матрицы расстояний (слотов) и доля задач без посчитанных пар,
+# начиная с которой матрица пересчитывается целиком, а не по строкам
+COHORT_CACHE_DIR = os.getenv("COHORT_CACHE_DIR", "data/cohort_cache")
+COHORT_CACHE_TILE = int(os.getenv("COHORT_CACHE_TILE", "256"))
+COHORT_FULL_RECOMPUTE_FRACTION = float(os.getenv("COHORT_FULL_RECOMPUTE_FRACTION", "0.25"))
+
+# Очередь анализов (SQLite, общая для бота и процессов worker.py): файл очереди, параллельных анализов на воркер,
+# воркер внутри процесса бота (0 - анализы выполняют только отдельные worker.py), аренда задания и период heartbeat
+# (секунды), попыток после потери аренды, оценка длительности для ETA, период опроса очереди воркером
+# и период проверки уведомлений ботом
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", "data/jobs.sqlite3")
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "4"))
+JOB_EMBEDDED_WORKER = os.getenv("JOB_EMBEDDED_WORKER", "1") == "1"
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", "15"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_DEFAULT_SECONDS = float(os.getenv("JOB_DEFAULT_SECONDS", "60"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))
+JOB_NOTIFY_INTERVAL = float(os.getenv("JOB_NOTIFY_INTERVAL", "0.2"))
+# Сколько заданий пользователя может ждать в очереди с обычным приоритетом: следующие ставятся с пониженным
+# и выполняются после обычных заданий всех пользователей (массовая постановка не занимает воркеры)
+JOB_LOW_PRIORITY_AFTER = int(os.getenv("JOB_LOW_PRIORITY_AFTER", "5"))
+
+# Сообщение о ходе анализа: не чаще одной правки на чат за PROGRESS_EDIT_INTERVAL секунд
+# (промежуточные этапы между правками пропускаются, показывается последний)
+PROGRESS_EDIT_INTERVAL = float(os.getenv("PROGRESS_EDIT_INTERVAL", "3"))
+
+# Исходящие сообщения: общий лимит бота (сообщений в секунду), лимит на чат (в секунду и запас подряд)
+# и число повторов после 429 (ожидание - retry_after из ответа Telegram)
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "30"))
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", "1"))
+OUTBOUND_CHAT_BURST = float(os.getenv("OUTBOUND_CHAT_BURST", "3"))
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))
+
+# Выполнение пайплайна в отдельном процессе: таймаут, лимит памяти (0 - без лимита),
+# время на корректное завершение после SIGTERM и каталог для промежуточных файлов
+PIPELINE_TIMEOUT = int(os.getenv("PIPELINE_TIMEOUT", "3600"))
+PIPELINE_MEMORY_LIMIT_MB = int(os.getenv("PIPELINE_MEMORY_LIMIT_MB", "4096"))
+PIPELINE_KILL_GRACE = float(os.getenv("PIPELINE_KILL_GRACE", "5"))
+PIPELINE_WORK_DIR = os.getenv("PIPELINE_WORK_DIR", "data/work")
+
+# Загруженные FASTQ: контентно-адресуемое хранилище; файлы без ссылок из задач удаляются спустя UPLOAD_RETENTION секунд
+UPLOAD_STORE_DIR = os.getenv("UPLOAD_STORE_DIR", "uploads/blobs")
+UPLOAD_RETENTION = int(os.getenv("UPLOAD_RETENTION", str(7 * 24 * 3600)))
+
+# Кэш результатов анализа (одинаковый файл и параметры): максимальное число записей
+RESULT_MEMO_MAX_ENTRIES = int(os.getenv("RESULT_MEMO_MAX_ENTRIES", "10000"))
+
+# Получение апдейтов: "polling" (long polling) или "webhook" (HTTP-сервер aiohttp).
+# Для webhook: публичный URL без пути, путь и адрес локального сервера, секрет (заголовок
+# X-Telegram-Bot-Api-Secret-Token), размер очереди апдейтов, число обработчиков очереди
+# и сколько параллельных соединений разрешить Telegram
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "32"))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
@@ -3,13 +3,20 @@ import logging
 import signal
 import sys
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
 
-from TelegramBot.config import TOKEN
+from TelegramBot.config import (
+    TOKEN, REFERENCE_PRELOAD, JOB_EMBEDDED_WORKER, BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_MAX_CONNECTIONS,
+)
 from src.handlers import register_all_handlers
-from src.middlewares import register_middlewares
+from src.middlewares import register_middlewares, OutboundDispatcher
 from src.task_manage import TaskManager
 from src.api.client import get_auth_client
+from src.utils.render_executor import get_render_executor
+from src.pipeline.references import get_reference_registry
+from src.webhook import WebhookServer
+from src.storage.fsm_storage import make_fsm_storage
+from src.analysis_worker import AnalysisWorker
+from src.utils.notification_relay import NotificationRelay
 
 logging.basicConfig(
     level=logging.INFO,
@@ -18,10 +25,28 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-async def on_startup():
+async def on_startup(dp: Dispatcher, bot: Bot):
     """Действия при запуске бота"""
     logger.info("Starting bot...")
 
+    removed = TaskManager().collect_uploads()
+    if removed:
+        logger.info(f"Удалено неиспользуемых загрузок: {removed}")
+
+    # Индексы референсов читаются в страничный кэш один раз; процессы пайплайна отображают те же страницы
+    registry = get_reference_registry()
+    await asyncio.to_thread(registry.preload, REFERENCE_PRELOAD)
+    registry.start_watching()
+
+    # Уведомления от воркеров анализов (в том числе из отдельных процессов worker.py)
+    relay = NotificationRelay(bot)
+    relay.start()
+    dp["notification_relay"] = relay
+    if JOB_EMBEDDED_WORKER:
+        worker = AnalysisWorker()
+        worker.start()
+        dp["analysis_worker"] = worker
+
     # Проверяем подключение к сервису авторизации
     try:
         auth_client = await get_auth_client()
@@ -40,37 +65,63 @@ async def on_shutdown(dp: Dispatcher, bot: Bot):
     logger.info("Завершение работы бота...")
 
     task_manager = TaskManager()
-    logger.info(f"Отмена фоновых задач... Всего задач: {len(task_manager._bg_tasks)}")
+    # Выполняющиеся во встроенном воркере анализы возвращаются в очередь: их продолжит другой воркер
+    # или этот процесс после перезапуска
+    worker = dp.workflow_data.pop("analysis_worker", None)
+    if worker is not None:
+        await worker.stop()
+    relay = dp.workflow_data.pop("notification_relay", None)
+    if relay is not None:
+        await relay.stop()
+        logger.info(f"Уведомлений отправлено: {relay.sent}, не доставлено: {relay.dropped}, "
+                    f"правок хода анализа: {relay.edits}")
+    logger.info(f"Очередь анализов: {task_manager.jobs.stats()}")
+
+    get_render_executor().shutdown()
+
+    registry = get_reference_registry()
+    await registry.stop_watching()
+    logger.info(f"Референсы: {registry.stats()}, переключений версий: {registry.swaps}")
+
+    logger.info(f"Кэш результатов: {task_manager.memo_stats()}")
 
-    for task_id, bg_task in task_manager._bg_tasks.items():
-        if not bg_task.done():
-            bg_task.cancel()
-            logger.info(f"Отменена задача: {task_id}")
-
-    if task_manager._bg_tasks:
-        await asyncio.gather(*task_manager._bg_tasks.values(), return_exceptions=True)
+    try:
+        task_manager.close()
+        logger.info("Task store flushed")
+    except Exception as e:
+        logger.error(f"Error closing task store: {e}")
 
     try:
         auth_client = await get_auth_client()
-        await auth_client.client.aclose()
+        await auth_client.close()
         logger.info("Auth client closed")
     except Exception as e:
         logger.error(f"Error closing auth client: {e}")
 
+    outbound = dp.workflow_data.pop("outbound", None)
+    if outbound is not None:
+        logger.info(f"Исходящие сообщения: {outbound.stats()}")
+        await outbound.close()
+
     await bot.session.close()
     logger.info("Бот завершил работу")
 
 
 async def main():
     bot = Bot(token=TOKEN)
-    storage = MemoryStorage()
+    # Все исходящие сообщения - через одну очередь с лимитами Telegram (общим и на чат) и повтором после 429
+    outbound = OutboundDispatcher()
+    bot.session.middleware(outbound)
+    # Состояния диалогов переживают перезапуск и общие для нескольких процессов бота
+    storage = make_fsm_storage()
     dp = Dispatcher(storage=storage)
+    dp["outbound"] = outbound
 
     await register_middlewares(dp)
 
     register_all_handlers(dp)
 
-    await on_startup()
+    await on_startup(dp, bot)
 
     def signal_handler():
         logger.info("Получен сигнал завершения")
@@ -80,12 +131,37 @@ async def main():
     signal.signal(signal.SIGINT, lambda s, f: signal_handler())
     signal.signal(signal.SIGTERM, lambda s, f: signal_handler())
 
-    logger.info("Bot started")
+    logger.info(f"Bot started ({BOT_MODE})")
     try:
-        await dp.start_polling(bot)
+        if BOT_MODE == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            # Long polling не работает, пока установлен webhook (например, после запуска в режиме webhook)
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
     finally:
         await on_shutdown(dp, bot)
 
 
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    """Приём апдейтов HTTP-сервером: Telegram доставляет их сам, без цикла getUpdates"""
+    server = WebhookServer(dp, bot)
+    await dp.emit_startup(bot=bot)
+    await server.start()
+    await bot.set_webhook(
+        url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+    )
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+        logger.info(f"Webhook: {server.stats()}")
+        # Как в конце start_polling: закрывает FSM-хранилище (с записью накопленных изменений)
+        await dp.emit_shutdown(bot=bot)
+
+
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
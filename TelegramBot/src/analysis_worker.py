@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Dict, Optional
+
+from TelegramBot.config import JOB_WORKER_CONCURRENCY, JOB_HEARTBEAT_INTERVAL, JOB_POLL_INTERVAL
+from .storage.job_queue import JobQueue, Job, CANCELED, DONE, FAILED
+from .task_manage import TaskManager, TaskStatus
+from .utils.analysis_simulator import run_analysis
+
+logger = logging.getLogger(__name__)
+
+# Почему воркер остановил анализ
+_CANCELED = "canceled"
+_LOST = "lost"
+_SHUTDOWN = "shutdown"
+
+
+class AnalysisWorker:
+    """
+    Воркер очереди анализов: берёт задания в аренду (не больше concurrency одновременно), выполняет
+    run_analysis и продлевает аренду heartbeat'ами. Отменённые пользователем задания и задания,
+    аренду которых перехватил другой воркер, останавливаются; при штатной остановке воркера
+    выполняющиеся задания возвращаются в очередь. Записи лога выполняющихся задач уходят в очередь
+    как этапы для сообщения о ходе анализа. Работает в процессе бота или в отдельном worker.py
+    """
+
+    def __init__(self, queue: Optional[JobQueue] = None, worker_id: Optional[str] = None,
+                 concurrency: int = JOB_WORKER_CONCURRENCY, heartbeat_interval: float = JOB_HEARTBEAT_INTERVAL,
+                 poll_interval: float = JOB_POLL_INTERVAL):
+        # Своё соединение с очередью: data_version не меняется от коммитов собственного соединения,
+        # поэтому по нему видны только задания, поставленные другими (ботом)
+        self.queue = queue or JobQueue()
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.concurrency = concurrency
+        self.heartbeat_interval = heartbeat_interval
+        self.poll_interval = poll_interval
+        self._running: Dict[str, asyncio.Task] = {}
+        self._stop_reasons: Dict[str, str] = {}
+        self._wakeup = asyncio.Event()
+        self._loop_task: Optional[asyncio.Task] = None
+        self.completed = 0
+
+    def start(self):
+        TaskManager().add_log_listener(self._on_log)
+        self._loop_task = asyncio.create_task(self.run())
+
+    async def run(self):
+        logger.info(f"Воркер анализов {self.worker_id} запущен (параллельно: {self.concurrency})")
+        seen_version = None
+        next_heartbeat = 0.0
+        while True:
+            now = time.monotonic()
+            if now >= next_heartbeat:
+                await self._heartbeat()
+                next_heartbeat = now + self.heartbeat_interval
+                seen_version = None
+
+            version = self.queue.data_version()
+            if version != seen_version:
+                # Кто-то изменил очередь: новые задания или отмена выполняющихся
+                seen_version = version
+                self._check_canceled()
+                while len(self._running) < self.concurrency:
+                    job = self.queue.lease(self.worker_id)
+                    if job is None:
+                        break
+                    self._start_job(job)
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                # Освободился слот - очередь перечитывается, даже если других изменений не было
+                seen_version = None
+            except asyncio.TimeoutError:
+                pass
+
+    async def _heartbeat(self):
+        for task_id in self.queue.reclaim_expired():
+            self._fail_abandoned(task_id)
+        lost = self.queue.heartbeat(self.worker_id, list(self._running), self.concurrency)
+        for task_id in lost:
+            reason = _CANCELED if self.queue.state(task_id) == CANCELED else _LOST
+            self._stop(task_id, reason)
+
+    def _check_canceled(self):
+        if not self._running:
+            return
+        for task_id, state in self.queue.states(list(self._running)).items():
+            if state == CANCELED:
+                self._stop(task_id, _CANCELED)
+
+    def _stop(self, task_id: str, reason: str):
+        task = self._running.get(task_id)
+        if task is not None and not task.done():
+            self._stop_reasons[task_id] = reason
+            task.cancel()
+
+    def _start_job(self, job: Job):
+        task = asyncio.create_task(self._run_job(job))
+        self._running[job.task_id] = task
+        task.add_done_callback(lambda _, task_id=job.task_id: self._on_done(task_id))
+
+    def _on_done(self, task_id: str):
+        self._running.pop(task_id, None)
+        self._wakeup.set()
+
+    async def _run_job(self, job: Job):
+        task_manager = TaskManager()
+        if job.attempts > 1:
+            task_manager.add_log(job.task_id, f"Повторный запуск после потери воркера (попытка {job.attempts}).")
+        try:
+            await run_analysis(job.task_id, self._notify)
+        except asyncio.CancelledError:
+            reason = self._stop_reasons.pop(job.task_id, _SHUTDOWN)
+            if reason == _CANCELED:
+                task_manager.add_log(job.task_id, "Задача отменена пользователем.")
+                task_manager.set_status(job.task_id, TaskStatus.CANCELED)
+                logger.info(f"Задача {job.task_id} была корректно отменена")
+            elif reason == _LOST:
+                logger.warning(f"Аренда задачи {job.task_id} потеряна, выполнение остановлено")
+            else:
+                self.queue.release(job.task_id, self.worker_id)
+                task_manager.add_log(job.task_id, "Воркер остановлен, задача возвращена в очередь.")
+                task_manager.set_status(job.task_id, TaskStatus.PENDING)
+            return
+        t = task_manager.get(job.task_id)
+        self.queue.finish(job.task_id, self.worker_id,
+                          DONE if t and t.status == TaskStatus.COMPLETED else FAILED)
+        self.completed += 1
+
+    def _on_log(self, task_id: str, message: str):
+        if task_id in self._running:
+            self.queue.report_progress(task_id, message)
+
+    def _notify(self, chat_id: int, text: str):
+        # Уведомление не должно опередить запись статуса: бот прочитает задачу по команде из него
+        TaskManager().flush()
+        self.queue.notify(chat_id, text)
+
+    def _fail_abandoned(self, task_id: str):
+        """Задание исчерпало попытки: воркеры, бравшие его, пропали (например, падали на этом файле)"""
+        task_manager = TaskManager()
+        t = task_manager.get(task_id)
+        if not t:
+            return
+        task_manager.add_log(task_id, "Анализ прерван: воркер не отвечал, попытки исчерпаны.")
+        task_manager.set_status(task_id, TaskStatus.FAILED)
+        self._notify(int(t.owner_id),
+                     f"Задача {task_id} завершилась с ошибкой. Используйте /status {task_id} для деталей.")
+
+    async def stop(self):
+        """Останавливает выдачу заданий; выполняющиеся возвращаются в очередь"""
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            await asyncio.gather(self._loop_task, return_exceptions=True)
+            self._loop_task = None
+        running = list(self._running.values())
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+        TaskManager().remove_log_listener(self._on_log)
+        self.queue.unregister_worker(self.worker_id)
+        logger.info(f"Воркер анализов {self.worker_id} остановлен, выполнено заданий: {self.completed}")
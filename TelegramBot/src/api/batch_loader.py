@@ -0,0 +1,97 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+from TelegramBot.config import AUTH_BATCH_WINDOW, AUTH_BATCH_MAX_SIZE
+from ..api.models import UserResponse
+
+logger = logging.getLogger(__name__)
+
+
+BatchFetcher = Callable[[List[int]], Awaitable[Dict[int, Optional[UserResponse]]]]
+
+
+class UserBatchLoader:
+    """
+    DataLoader для пользователей: собирает chat_id за короткое окно
+    и разрешает их одним пакетным вызовом batch_fetch.
+    batch_fetch возвращает None для ненайденных chat_id и не включает в ответ те, что не удалось загрузить
+    """
+
+    def __init__(
+            self,
+            batch_fetch: BatchFetcher,
+            window: float = AUTH_BATCH_WINDOW,
+            max_batch_size: int = AUTH_BATCH_MAX_SIZE
+    ):
+        self.batch_fetch = batch_fetch
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # Сильные ссылки на выполняющиеся пакеты: цикл событий хранит задачи только по слабым ссылкам
+        self._tasks: Set[asyncio.Task] = set()
+        self.batches = 0
+        self.keys_loaded = 0
+
+    async def load(self, chat_id: int) -> Optional[UserResponse]:
+        future = self._pending.get(chat_id)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._pending[chat_id] = future
+
+            if len(self._pending) >= self.max_batch_size:
+                self._dispatch()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.window, self._dispatch)
+
+        return await asyncio.shield(future)
+
+    async def load_many(self, chat_ids: Iterable[int]) -> List[Optional[UserResponse]]:
+        return list(await asyncio.gather(*(self.load(chat_id) for chat_id in chat_ids)))
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+
+        batch, self._pending = self._pending, {}
+        task = asyncio.ensure_future(self._resolve(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._on_batch_done)
+
+    def _on_batch_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Ошибка пакетной загрузки пользователей", exc_info=task.exception())
+
+    async def close(self):
+        """Отправляет накопленные chat_id и дожидается выполняющихся пакетов"""
+        self._dispatch()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _resolve(self, batch: Dict[int, asyncio.Future]):
+        self.batches += 1
+        self.keys_loaded += len(batch)
+        try:
+            users = await self.batch_fetch(list(batch))
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+                    # исключение доставляется ожидающим, само future может остаться без читателя
+                    future.exception()
+            return
+
+        for chat_id, future in batch.items():
+            if future.done():
+                continue
+            if chat_id in users:
+                future.set_result(users[chat_id])
+            else:
+                future.set_exception(LookupError(f"User {chat_id} was not resolved by batch"))
+                future.exception()
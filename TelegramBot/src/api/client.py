@@ -2,9 +2,13 @@ import asyncio
 import logging
 import httpx
 import json
-from typing import Optional, Dict, Any
-from TelegramBot.config import AUTH_SERVICE_URL, API_TIMEOUT, API_RETRY_ATTEMPTS, API_RETRY_DELAY
+from typing import Optional, Dict, Any, List
+from TelegramBot.config import (
+    AUTH_SERVICE_URL, API_TIMEOUT, API_RETRY_ATTEMPTS, API_RETRY_DELAY,
+    AUTH_BULK_ENDPOINT, AUTH_FANOUT_CONCURRENCY
+)
 from ..api.models import UserCreate, UserResponse, ErrorResponse
+from ..api.batch_loader import UserBatchLoader
 
 logger = logging.getLogger(__name__)
 
@@ -31,11 +35,20 @@ class AuthServiceClient:
                 "User-Agent": "TelegramBot/1.0"
             }
         )
+        # None - ещё не проверяли, поддерживает ли сервис пакетный эндпоинт
+        self._bulk_supported: Optional[bool] = None if AUTH_BULK_ENDPOINT else False
+        self._fanout_semaphore = asyncio.Semaphore(AUTH_FANOUT_CONCURRENCY)
+        self.loader = UserBatchLoader(self.fetch_users_by_chat_ids)
 
     async def __aenter__(self):
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def close(self):
+        """Дожидается пакетных загрузок пользователей и закрывает HTTP-клиент"""
+        await self.loader.close()
         await self.client.aclose()
 
     async def _make_request(
@@ -58,26 +71,106 @@ class AuthServiceClient:
                 logger.warning(f"Attempt {attempt + 1} failed, retrying in {API_RETRY_DELAY}s...")
                 await asyncio.sleep(API_RETRY_DELAY)
 
-    async def get_user_by_chat_id(self, chat_id: int) -> Optional[UserResponse]:
+    async def fetch_user_by_chat_id(self, chat_id: int) -> Optional[UserResponse]:
+        """
+        Получает пользователя по chat_id.
+        Возвращает None только если сервис ответил 404, при прочих ошибках бросает AuthServiceError
+        """
+        logger.debug(f"GET request to /users/{chat_id}")
         try:
-            logger.info(f"GET request to /users/{chat_id}")
             response = await self._make_request("GET", f"/users/{chat_id}")
-            logger.info(f"Response status for user {chat_id}: {response.status_code}")
+        except httpx.HTTPError as e:
+            raise AuthServiceError(f"HTTP error while getting user {chat_id}: {e}")
 
-            if response.status_code == 200:
-                data = response.json()
-                logger.info(f"User data received for {chat_id}: {data}")
-                return UserResponse(**data)
-            elif response.status_code == 404:
-                logger.info(f"User {chat_id} not found (404)")
-                return None
-            else:
-                error_data = response.json() if response.text else {}
-                logger.error(f"Unexpected status for user {chat_id}: {response.status_code}, Error: {error_data}")
-                return None
+        logger.debug(f"Response status for user {chat_id}: {response.status_code}")
 
+        if response.status_code == 200:
+            try:
+                return UserResponse(**response.json())
+            except (json.JSONDecodeError, ValueError) as e:
+                raise AuthServiceError(f"Некорректный ответ от сервера авторизации: {e}")
+        elif response.status_code == 404:
+            logger.debug(f"User {chat_id} not found (404)")
+            return None
+        else:
+            raise AuthServiceError(
+                f"Unexpected status for user {chat_id}: {response.status_code}, Error: {response.text}"
+            )
+
+    async def fetch_users_by_chat_ids(self, chat_ids: List[int]) -> Dict[int, Optional[UserResponse]]:
+        """
+        Получает пользователей пачкой: одним запросом к bulk-эндпоинту,
+        а если сервис его не поддерживает - параллельными GET /users/{chat_id}
+        """
+        if self._bulk_supported is not False:
+            users = await self._fetch_users_bulk(chat_ids)
+            if users is not None:
+                return users
+
+        async def fetch_one(chat_id: int) -> Optional[UserResponse]:
+            async with self._fanout_semaphore:
+                return await self.fetch_user_by_chat_id(chat_id)
+
+        results = await asyncio.gather(*(fetch_one(chat_id) for chat_id in chat_ids), return_exceptions=True)
+        users: Dict[int, Optional[UserResponse]] = {}
+        for chat_id, result in zip(chat_ids, results):
+            if isinstance(result, BaseException):
+                # Ошибка по одному chat_id не должна ронять всю пачку
+                logger.error(f"Auth service error while getting user {chat_id}: {result}")
+                continue
+            users[chat_id] = result
+
+        missing = [chat_id for chat_id in chat_ids if chat_id not in users]
+        if len(missing) == len(chat_ids):
+            raise AuthServiceError(f"Cannot resolve users {missing}")
+        return users
+
+    async def _fetch_users_bulk(self, chat_ids: List[int]) -> Optional[Dict[int, Optional[UserResponse]]]:
+        """Пакетный запрос пользователей. Возвращает None, если эндпоинт не поддерживается"""
+        try:
+            response = await self._make_request("POST", AUTH_BULK_ENDPOINT, json={"chat_ids": chat_ids})
         except httpx.HTTPError as e:
-            logger.error(f"HTTP error while getting user {chat_id}: {e}")
+            raise AuthServiceError(f"HTTP error while getting users in bulk: {e}")
+
+        if response.status_code in (404, 405, 501):
+            if self._bulk_supported is None:
+                logger.info(f"Bulk endpoint {AUTH_BULK_ENDPOINT} is not supported, falling back to per-user requests")
+            self._bulk_supported = False
+            return None
+        if response.status_code != 200:
+            raise AuthServiceError(f"Unexpected status for bulk users request: {response.status_code}")
+
+        try:
+            data = response.json()
+            items = data.get("users", []) if isinstance(data, dict) else data
+            found = [UserResponse(**item) for item in items]
+        except (json.JSONDecodeError, ValueError, AttributeError, TypeError) as e:
+            raise AuthServiceError(f"Некорректный ответ от сервера авторизации: {e}")
+
+        self._bulk_supported = True
+        users: Dict[int, Optional[UserResponse]] = {chat_id: None for chat_id in chat_ids}
+        for user in found:
+            users[user.chat_id] = user
+        return users
+
+    async def load_user(self, chat_id: int) -> Optional[UserResponse]:
+        """Получает пользователя через пакетный загрузчик (запросы разных чатов объединяются)"""
+        try:
+            return await self.loader.load(chat_id)
+        except LookupError as e:
+            raise AuthServiceError(str(e))
+
+    async def get_user_by_chat_id(self, chat_id: int) -> Optional[UserResponse]:
+        try:
+            user = await self.fetch_user_by_chat_id(chat_id)
+            if user is not None:
+                logger.info(f"User data received for {chat_id}: {user}")
+            else:
+                logger.info(f"User {chat_id} not found (404)")
+            return user
+
+        except AuthServiceError as e:
+            logger.error(f"Auth service error while getting user {chat_id}: {e}")
             return None
         except Exception as e:
             logger.exception(f"Unexpected error getting user {chat_id}: {e}")
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Optional
+
+from TelegramBot.config import USER_CACHE_MAX_SIZE, USER_CACHE_TTL, USER_CACHE_NEGATIVE_TTL
+from ..api.models import UserResponse
+
+logger = logging.getLogger(__name__)
+
+
+UserLoader = Callable[[int], Awaitable[Optional[UserResponse]]]
+
+
+@dataclass
+class _CacheEntry:
+    user: Optional[UserResponse]
+    expires_at: float
+
+
+class UserCache:
+    """
+    LRU-кэш пользователей сервиса авторизации.
+    Найденные и ненайденные пользователи живут с разными TTL,
+    параллельные запросы одного chat_id объединяются в один HTTP-запрос
+    """
+
+    def __init__(
+            self,
+            max_size: int = USER_CACHE_MAX_SIZE,
+            ttl: float = USER_CACHE_TTL,
+            negative_ttl: float = USER_CACHE_NEGATIVE_TTL
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries: "OrderedDict[int, _CacheEntry]" = OrderedDict()
+        self._inflight: Dict[int, asyncio.Future] = {}
+        # Поколения ключей: инвалидация во время запроса не даёт записать устаревший ответ
+        self._generations: Dict[int, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _lookup(self, chat_id: int) -> Optional[_CacheEntry]:
+        entry = self._entries.get(chat_id)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            del self._entries[chat_id]
+            return None
+        self._entries.move_to_end(chat_id)
+        return entry
+
+    def _store(self, chat_id: int, user: Optional[UserResponse]):
+        ttl = self.ttl if user is not None else self.negative_ttl
+        if ttl <= 0:
+            return
+        self._entries[chat_id] = _CacheEntry(user=user, expires_at=time.monotonic() + ttl)
+        self._entries.move_to_end(chat_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def get(self, chat_id: int, loader: UserLoader) -> Optional[UserResponse]:
+        """Возвращает пользователя из кэша или загружает его через loader"""
+        entry = self._lookup(chat_id)
+        if entry is not None:
+            self.hits += 1
+            return entry.user
+
+        self.misses += 1
+        future = self._inflight.get(chat_id)
+        if future is None:
+            future = asyncio.ensure_future(self._load(chat_id, loader))
+            self._inflight[chat_id] = future
+            future.add_done_callback(lambda f: self._forget_inflight(chat_id, f))
+
+        # shield: отмена одного ожидающего апдейта не отменяет общий запрос
+        return await asyncio.shield(future)
+
+    def _forget_inflight(self, chat_id: int, future: asyncio.Future):
+        if self._inflight.get(chat_id) is future:
+            del self._inflight[chat_id]
+        if not future.cancelled():
+            # Помечаем исключение как полученное, даже если все ожидающие уже отменены
+            future.exception()
+
+    async def _load(self, chat_id: int, loader: UserLoader) -> Optional[UserResponse]:
+        generation = self._generations.get(chat_id, 0)
+        user = await loader(chat_id)
+        if self._generations.get(chat_id, 0) == generation:
+            self._store(chat_id, user)
+        return user
+
+    def set(self, chat_id: int, user: UserResponse):
+        """Кладёт в кэш заведомо актуального пользователя (например, после регистрации)"""
+        self.invalidate(chat_id)
+        self._store(chat_id, user)
+
+    def invalidate(self, chat_id: int):
+        """Удаляет запись о пользователе, в т.ч. отрицательную"""
+        self._entries.pop(chat_id, None)
+        self._generations[chat_id] = self._generations.get(chat_id, 0) + 1
+        self._inflight.pop(chat_id, None)
+        if not self._inflight and len(self._generations) > self.max_size:
+            self._generations.clear()
+
+    def clear(self):
+        self._entries.clear()
+        self._inflight.clear()
+        self._generations.clear()
+
+
+# Singleton для удобного использования
+_user_cache_instance: Optional[UserCache] = None
+
+
+def get_user_cache() -> UserCache:
+    """Получает экземпляр UserCache (singleton)"""
+    global _user_cache_instance
+
+    if _user_cache_instance is None:
+        _user_cache_instance = UserCache()
+
+    return _user_cache_instance
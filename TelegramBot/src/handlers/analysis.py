@@ -1,4 +1,3 @@
-import asyncio
 import logging
 from typing import Optional
 from aiogram import Dispatcher, F, types, Bot
@@ -7,8 +6,9 @@ from aiogram.fsm.context import FSMContext
 
 from ..states import RunAnalysisStates
 from ..task_manage import TaskManager
+from ..storage.blob_store import get_upload_store
 from ..keyboards import tool_kb, reference_kb, clustering_kb, confirm_kb
-from ..utils.analysis_simulator import simulate_analysis_and_generate_report
+from .monitoring import format_queue_status
 from ..api.models import UserResponse
 
 logger = logging.getLogger(__name__)
@@ -31,7 +31,8 @@ async def cmd_run_analysis(message: types.Message, state: FSMContext, db_user: O
     )
 
 
-async def handle_fastq_upload(message: types.Message, state: FSMContext, db_user: Optional[UserResponse] = None):
+async def handle_fastq_upload(message: types.Message, bot: Bot, state: FSMContext,
+                             db_user: Optional[UserResponse] = None):
     """Обработка загрузки FASTQ файла"""
     if not db_user:
         await message.answer("❌ Пользователь не авторизован.")
@@ -42,17 +43,29 @@ async def handle_fastq_upload(message: types.Message, state: FSMContext, db_user
         return
 
     doc = message.document
-    try:
-        local_path = f"uploads/user_{db_user.id}_{doc.file_name}"
-        await message.document.download(destination_file=local_path)
-    except Exception as e:
-        logger.exception("Ошибка при сохранении файла")
-        await message.answer("Не удалось сохранить файл. Попробуйте ещё раз.")
-        return
-
-    await state.update_data(uploaded_file=local_path, filename=doc.file_name)
+    task_manager = TaskManager()
+    # Тот же файл Telegram уже скачивался - повторно не загружаем
+    digest = task_manager.find_upload(doc.file_unique_id)
+    reused = digest is not None
+    if not reused:
+        writer = get_upload_store().writer()
+        try:
+            await bot.download(doc, destination=writer, seek=False)
+            digest, size = writer.commit()
+        except Exception:
+            writer.abort()
+            logger.exception("Ошибка при сохранении файла")
+            await message.answer("Не удалось сохранить файл. Попробуйте ещё раз.")
+            return
+        task_manager.register_upload(digest, size, doc.file_unique_id)
+
+    await state.update_data(upload_digest=digest, filename=doc.file_name)
     await state.set_state(RunAnalysisStates.waiting_tool)
-    await message.answer("Файл принят. Выберите инструмент анализа:", reply_markup=tool_kb())
+    await message.answer(
+        ("Этот файл уже загружался ранее, используем сохранённую копию.\n" if reused else "")
+        + "Файл принят. Выберите инструмент анализа:",
+        reply_markup=tool_kb()
+    )
 
 
 async def callback_tool_ref_cluster(callback_query: types.CallbackQuery, state: FSMContext,
@@ -121,10 +134,10 @@ async def callback_confirm_run(callback_query: types.CallbackQuery, bot: Bot, st
         "instrument": data_all.get("instrument"),
         "reference": data_all.get("reference"),
         "clustering": data_all.get("clustering"),
-        "user_id": db_user.id
+        "user_id": db_user.id,
+        "db_user_id": db_user.id
     }
 
-    file_path = data_all.get("uploaded_file")
     filename = data_all.get("filename", "uploaded.fastq")
 
     task_manager = TaskManager()
@@ -132,24 +145,33 @@ async def callback_confirm_run(callback_query: types.CallbackQuery, bot: Bot, st
         owner_id=str(callback_query.from_user.id),
         filename=filename,
         params=params,
-        file_path=file_path
+        upload_digest=data_all.get("upload_digest")
     )
 
-    task_meta = task_manager.get(task_id)
-    if task_meta:
-        task_meta.params["db_user_id"] = db_user.id
-
     task_manager.add_log(task_id, f"Задача создана пользователем {db_user.id}.")
 
+    if task_manager.complete_from_memo(task_id):
+        await callback_query.message.edit_text(
+            f"Задача создана. Task ID: {task_id}\n"
+            "Этот файл уже анализировался с теми же параметрами - отчёт готов.\n"
+            f"Используйте /get_report {task_id} чтобы скачать отчёт."
+        )
+        await callback_query.answer()
+        await state.clear()
+        return
+
+    # Анализ выполнит воркер очереди (в процессе бота или отдельный worker.py), уведомление придёт через бота
+    task_manager.submit(task_id)
+
     await callback_query.message.edit_text(
         f"Задача создана. Task ID: {task_id}\n"
         f"Пользователь: {db_user.name or db_user.telegram_username or 'Unknown'}\n"
-        f"Статус: pending. Вам придёт уведомление по завершению."
+        f"Статус: {format_queue_status(task_manager, task_id)}. Вам придёт уведомление по завершению.\n"
+        "Это сообщение будет обновляться по мере выполнения анализа."
     )
+    # Этапы анализа (записи лога задачи) бот показывает правками этого сообщения
+    task_manager.track_progress(task_id, callback_query.message.chat.id, callback_query.message.message_id)
     await callback_query.answer()
-
-    bg = asyncio.create_task(simulate_analysis_and_generate_report(task_id, bot, dp=None))
-    task_manager.store_bg_task(task_id, bg)
     await state.clear()
 
 
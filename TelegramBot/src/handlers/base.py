@@ -8,6 +8,7 @@ from aiogram.fsm.context import FSMContext
 from ..keyboards import start_kb, registration_kb
 from ..api.models import UserResponse, UserCreate
 from ..api.client import get_auth_client, AuthServiceError
+from ..api.user_cache import get_user_cache
 
 logger = logging.getLogger(__name__)
 
@@ -64,6 +65,8 @@ async def cmd_registration(message: Message, state: FSMContext):
 
         # Отправляем POST запрос на создание пользователя
         new_user = await auth_client.create_user(user_data)
+        # Сбрасываем отрицательную запись кэша, иначе мидлварь ещё negative_ttl считает пользователя незарегистрированным
+        get_user_cache().set(user.id, new_user)
 
         logger.info(f"User created successfully: {new_user}")
 
@@ -84,6 +87,7 @@ async def cmd_registration(message: Message, state: FSMContext):
 
         # Проверяем, не зарегистрирован ли пользователь уже
         if "уже существует" in error_msg.lower() or "already exists" in error_msg.lower():
+            get_user_cache().invalidate(user.id)
             await message.answer(
                 "ℹ️ Вы уже зарегистрированы!\n"
                 "Используйте /start для начала работы."
@@ -112,7 +116,7 @@ async def cmd_help(message: Message, db_user: Optional[UserResponse] = None):
         "/run_analysis — запустить новый анализ (бот попросит загрузить FASTQ и выбрать параметры)\n"
         "/create_cohort — создать когортный отчёт из 10+ завершённых задач\n"
         "/status <task_id> — посмотреть статус задачи и логи\n"
-        "/list_analyses [фильтры] — список ваших задач. Пример фильтра: /list_analyses instrument=QIIME2\n"
+        "/list_analyses [фильтры] — список ваших задач. Пример фильтра: /list_analyses instrument=QIIME2 status=completed from=2024-01-01\n"
         "/get_report <task_id> — скачать PDF/отчёт по задаче\n"
         "/cancel <task_id> — отменить задачу, если она в pending или running\n\n"
     )
@@ -147,6 +151,7 @@ async def callback_registration_confirm(callback_query: CallbackQuery):
             logger.info(f"Creating user via callback: {user_data.dict()}")
 
             new_user = await auth_client.create_user(user_data)
+            get_user_cache().set(user.id, new_user)
 
             await callback_query.message.edit_text(
                 f"✅ Регистрация прошла успешно!\n\n"
@@ -158,6 +163,7 @@ async def callback_registration_confirm(callback_query: CallbackQuery):
             logger.error(f"Registration error in callback: {error_msg}")
 
             if "уже существует" in error_msg.lower() or "already exists" in error_msg.lower():
+                get_user_cache().invalidate(user.id)
                 await callback_query.message.edit_text(
                     "ℹ️ Вы уже зарегистрированы!\n"
                     "Используйте /start для начала работы."
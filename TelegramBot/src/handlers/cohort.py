@@ -1,17 +1,25 @@
 import logging
+import os
+import tempfile
 from datetime import datetime
-from io import BytesIO
-from typing import Optional
+from typing import List, Optional, Tuple
 from aiogram import Dispatcher, F, types, Bot
 from aiogram.filters.command import Command
 from aiogram.fsm.context import FSMContext
 
+from TelegramBot.config import PIPELINE_WORK_DIR
 from ..states import CreateCohortStates
 from ..task_manage import TaskManager, TaskStatus
 from ..api.models import UserResponse
+from ..utils.report_delivery import send_cached_document, cohort_file_key
+from ..utils.render_executor import render_interactive, RenderQueueFull
+from ..utils.report_render import render_cohort_report
 
 logger = logging.getLogger(__name__)
 
+# Максимальная длина текстового сообщения Telegram
+MESSAGE_LIMIT = 4096
+
 
 async def cmd_create_cohort(message: types.Message, state: FSMContext, db_user: Optional[UserResponse] = None):
     """Начало создания когорты"""
@@ -37,53 +45,78 @@ async def handle_cohort_task_list(message: types.Message, state: FSMContext, bot
         return
 
     raw = message.text.strip()
-    ids = [s.strip() for s in raw.split(",") if s.strip()]
+    ids = list(dict.fromkeys(s.strip() for s in raw.split(",") if s.strip()))
 
     if len(ids) < 10:
         await message.answer("Нужно выбрать минимум 10 задач для когорты.")
         await state.clear()
         return
 
+    # Все id проверяются одним проходом по хранилищу, в ответе - все проблемные задачи сразу
     task_manager = TaskManager()
-    tasks = []
-    for tid in ids:
-        t = task_manager.get(tid)
-        if not t:
-            await message.answer(f"Задача {tid} не найдена. Отмена создания когорты.")
-            await state.clear()
-            return
-        if t.status != TaskStatus.COMPLETED:
-            await message.answer(
-                f"Задача {tid} не завершена (статус {t.status}). Когорта требует завершённых задач. Отмена.")
-            await state.clear()
-            return
-        tasks.append(t)
-
-    # генерация объединённого отчёта
-    combined = BytesIO()
-    try:
-        from reportlab.pdfgen import canvas
-        from reportlab.lib.pagesizes import letter
-        c = canvas.Canvas(combined, pagesize=letter)
-        for t in tasks:
-            c.setFont("Helvetica", 12)
-            c.drawString(72, 720, f"Cohort report - Task {t.id}")
-            c.drawString(72, 700, f"Sample file: {t.filename}")
-            c.drawString(72, 680, f"Params: {t.params}")
-            c.drawString(72, 640, "Aggregated metrics (simulated)")
-            c.showPage()
-        c.save()
-        combined.seek(0)
+    found = task_manager.get_many(ids)
+    not_found = [tid for tid in ids if tid not in found]
+    incomplete = [(tid, found[tid].status) for tid in ids
+                  if tid in found and found[tid].status != TaskStatus.COMPLETED]
+    if not_found or incomplete:
+        await report_invalid_tasks(message, not_found, incomplete)
+        await state.clear()
+        return
+    tasks = [found[tid] for tid in ids]
+
+    # генерация объединённого отчёта: страницы пишутся во временный файл, он отправляется потоком и удаляется
+    os.makedirs(PIPELINE_WORK_DIR, exist_ok=True)
+    fd, report_path = tempfile.mkstemp(prefix="cohort-", suffix=".pdf", dir=PIPELINE_WORK_DIR)
+    os.close(fd)
+
+    async def make_document() -> types.InputFile:
+        specs = [
+            {"task_id": t.id, "filename": t.filename, "params": dict(t.params),
+             "features_digest": (t.metrics.get("features") or {}).get("digest"),
+             "features_path": task_manager.features_path(t)}
+            for t in tasks
+        ]
+        await render_interactive(render_cohort_report, specs, report_path)
         filename = f"cohort_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-        await bot.send_document(chat_id=message.chat.id, document=types.InputFile(combined, filename=filename))
+        return types.FSInputFile(report_path, filename=filename)
+
+    try:
+        # Тот же набор задач уже отправлялся - повторно используется file_id без рендеринга и загрузки
+        await send_cached_document(bot, message.chat.id, cohort_file_key(ids), make_document)
         await message.answer("Когортный отчёт создан и отправлен.")
+    except RenderQueueFull:
+        await message.answer("Сервис отчётов сейчас перегружен. Попробуйте создать когорту чуть позже.")
     except Exception as e:
         logger.exception("Ошибка при создании когортного отчёта")
-        await message.answer("Не удалось создать PDF-отчёт (не установлен reportlab).")
+        await message.answer("Не удалось создать PDF-отчёт.")
+    finally:
+        try:
+            os.remove(report_path)
+        except OSError:
+            pass
 
     await state.clear()
 
 
+async def report_invalid_tasks(message: types.Message, not_found: List[str],
+                               incomplete: List[Tuple[str, TaskStatus]]):
+    """Одно сообщение со всеми ненайденными и незавершёнными задачами; длинный список - файлом"""
+    lines = []
+    if not_found:
+        lines += [f"Не найдены ({len(not_found)}):"] + not_found
+    if incomplete:
+        lines += [f"Не завершены ({len(incomplete)}):"] + [f"{tid} - {status.value}" for tid, status in incomplete]
+    text = "Когорта требует существующих завершённых задач. Отмена.\n" + "\n".join(lines)
+    if len(text) <= MESSAGE_LIMIT:
+        await message.answer(text)
+        return
+    await message.answer_document(
+        types.BufferedInputFile("\n".join(lines).encode("utf-8"), filename="cohort_invalid_tasks.txt"),
+        caption=f"Когорта требует существующих завершённых задач. Отмена. "
+                f"Не найдено: {len(not_found)}, не завершено: {len(incomplete)} - список в файле."
+    )
+
+
 def register_cohort_handlers(dp: Dispatcher):
     """Регистрация хэндлеров когорт"""
     dp.message.register(cmd_create_cohort, Command(commands=["create_cohort"]))
@@ -1,12 +1,33 @@
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 from aiogram import Dispatcher, F
 from aiogram.filters.command import Command
-from aiogram.types import Message
+from aiogram.fsm.context import FSMContext
+from aiogram.types import Message, CallbackQuery
 
+from TelegramBot.config import LIST_PAGE_SIZE
 from ..task_manage import TaskManager, TaskStatus
+from ..keyboards import list_page_kb
 from ..api.models import UserResponse
 
 
+def format_queue_status(task_manager: TaskManager, task_id: str) -> str:
+    """Статус задачи; для ожидающих в очереди - позиция и примерное время до запуска"""
+    t = task_manager.get(task_id)
+    queued = task_manager.queue_position(task_id)
+    if t.status != TaskStatus.PENDING or queued is None:
+        return t.status.value
+    position, eta = queued
+    if eta is None:
+        # Задание уже берёт воркер
+        return f"{t.status.value} (запускается)"
+    if eta < 60:
+        wait = "меньше минуты"
+    else:
+        wait = f"~{round(eta / 60)} мин"
+    return f"{t.status.value} (в очереди: {position}, до запуска {wait})"
+
+
 async def cmd_status(message: Message, db_user: Optional[UserResponse] = None):
     """Проверка статуса задачи"""
     if not db_user:
@@ -31,7 +52,7 @@ async def cmd_status(message: Message, db_user: Optional[UserResponse] = None):
 
     text = (
         f"Task ID: {t.id}\n"
-        f"Статус: {t.status.value}\n"
+        f"Статус: {format_queue_status(task_manager, t.id)}\n"
         f"Файл: {t.filename}\n"
         f"Параметры: instrument={t.params.get('instrument')}, reference={t.params.get('reference')}, clustering={t.params.get('clustering')}\n"
         f"Создана: {t.created_at.isoformat()}\n"
@@ -49,8 +70,62 @@ async def cmd_status(message: Message, db_user: Optional[UserResponse] = None):
     await message.answer(text)
 
 
-async def cmd_list_analyses(message: Message, db_user: Optional[UserResponse] = None):
-    """Список задач с фильтрацией"""
+LIST_USAGE = (
+    "Использование: /list_analyses [фильтры]\n"
+    "Фильтры: instrument=QIIME2 reference=SILVA clustering=OTU status=completed,failed "
+    "from=2024-01-01 to=2024-01-31"
+)
+
+
+def _parse_list_query(raw: str) -> dict:
+    """Разбирает фильтры /list_analyses; бросает ValueError при некорректном значении"""
+    query = {"filters": {}, "statuses": [], "from": None, "to": None}
+    for part in raw.split():
+        if "=" not in part:
+            continue
+        k, v = part.split("=", 1)
+        if k == "status":
+            query["statuses"] = [TaskStatus(s.strip().lower()).value for s in v.split(",") if s.strip()]
+        elif k in ("from", "to"):
+            datetime.strptime(v, "%Y-%m-%d")
+            query[k] = v
+        else:
+            query["filters"][k] = v
+    return query
+
+
+def _render_list_page(owner: str, query: dict, cursor: Optional[str] = None, backward: bool = False):
+    created_from = created_to = None
+    if query.get("from"):
+        created_from = datetime.strptime(query["from"], "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    if query.get("to"):
+        # дата "to" включительно
+        created_to = datetime.strptime(query["to"], "%Y-%m-%d").replace(tzinfo=timezone.utc) + timedelta(days=1)
+
+    page = TaskManager().query_for_user(
+        owner,
+        filters=query.get("filters"),
+        statuses=[TaskStatus(s) for s in query.get("statuses", [])],
+        created_from=created_from,
+        created_to=created_to,
+        cursor=cursor,
+        backward=backward,
+        limit=LIST_PAGE_SIZE
+    )
+    if not page.items:
+        return None, None
+
+    lines = []
+    for t in page.items:
+        lines.append(
+            f"{t.id[:8]}... | {t.created_at.strftime('%Y-%m-%d %H:%M')} | {t.filename} | "
+            f"{t.params.get('instrument')} | {t.status.value}"
+        )
+    return "Ваши задачи:\n" + "\n".join(lines), list_page_kb(page.prev_cursor, page.next_cursor)
+
+
+async def cmd_list_analyses(message: Message, state: FSMContext, db_user: Optional[UserResponse] = None):
+    """Список задач с фильтрацией и постраничным просмотром"""
     if not db_user:
         await message.answer(
             "❌ Для просмотра списка задач необходимо зарегистрироваться.\n"
@@ -59,28 +134,45 @@ async def cmd_list_analyses(message: Message, db_user: Optional[UserResponse] =
         return
 
     args = message.text.split(maxsplit=1)
-    filters = {}
-
-    if len(args) > 1:
-        raw = args[1]
-        for part in raw.split():
-            if "=" in part:
-                k, v = part.split("=", 1)
-                filters[k] = v
+    try:
+        query = _parse_list_query(args[1] if len(args) > 1 else "")
+    except ValueError:
+        await message.answer(LIST_USAGE)
+        return
 
     owner = str(message.from_user.id)
-    task_manager = TaskManager()
-    tasks = task_manager.list_for_user(owner, filters=filters)
+    text, kb = _render_list_page(owner, query)
 
-    if not tasks:
+    if not text:
         await message.answer("У вас нет задач, соответствующих фильтру.")
         return
 
-    lines = []
-    for t in sorted(tasks, key=lambda x: x.created_at, reverse=True)[:50]:
-        lines.append(f"{t.id[:8]}... | {t.filename} | {t.params.get('instrument')} | {t.status.value}")
+    # Фильтры нужны для перелистывания: в callback_data помещается только курсор
+    await state.update_data(list_query=query)
+    await message.answer(text, reply_markup=kb)
+
+
+async def callback_list_page(callback_query: CallbackQuery, state: FSMContext,
+                             db_user: Optional[UserResponse] = None):
+    """Перелистывание списка задач"""
+    if not db_user:
+        await callback_query.answer("❌ Пользователь не авторизован.", show_alert=True)
+        return
+
+    _, direction, cursor = callback_query.data.split(":", 2)
+    query = (await state.get_data()).get("list_query")
+    if query is None:
+        await callback_query.answer("Список устарел, выполните /list_analyses ещё раз.", show_alert=True)
+        return
+
+    owner = str(callback_query.from_user.id)
+    text, kb = _render_list_page(owner, query, cursor=cursor, backward=direction == "p")
+    if not text:
+        await callback_query.answer("Больше задач нет.")
+        return
 
-    await message.answer("Ваши задачи:\n" + "\n".join(lines))
+    await callback_query.message.edit_text(text, reply_markup=kb)
+    await callback_query.answer()
 
 
 async def cmd_cancel(message: Message, db_user: Optional[UserResponse] = None):
@@ -116,4 +208,5 @@ def register_monitoring_handlers(dp: Dispatcher):
     """Регистрация хэндлеров мониторинга"""
     dp.message.register(cmd_status, Command(commands=["status"]))
     dp.message.register(cmd_list_analyses, Command(commands=["list_analyses"]))
-    dp.message.register(cmd_cancel, Command(commands=["cancel"]))
\ No newline at end of file
+    dp.message.register(cmd_cancel, Command(commands=["cancel"]))
+    dp.callback_query.register(callback_list_page, F.data.startswith("lst:"))
\ No newline at end of file
@@ -1,13 +1,16 @@
-import types
-from io import BytesIO
+import logging
 from typing import Optional
 from aiogram import Dispatcher, F, Bot
 from aiogram.filters.command import Command
 from aiogram.types import Message
 
 from ..task_manage import TaskManager, TaskStatus
+from ..storage.blob_store import get_blob_store
+from ..utils.report_delivery import send_task_report, report_file_key
 from ..api.models import UserResponse
 
+logger = logging.getLogger(__name__)
+
 
 async def cmd_get_report(message: Message, bot: Bot, db_user: Optional[UserResponse] = None):
     """Получение отчёта по задаче"""
@@ -36,13 +39,16 @@ async def cmd_get_report(message: Message, bot: Bot, db_user: Optional[UserRespo
         return
 
     result = t.result
-    bio = BytesIO(result.bytes)
-    bio.seek(0)
-    filename = result.filename
-    await bot.send_document(
-        chat_id=message.chat.id,
-        document=types.InputFile(bio, filename=filename)
-    )
+    if not get_blob_store().exists(result.digest) and not task_manager.get_file_id(report_file_key(result)):
+        await message.answer(f"Файл отчёта по задаче {task_id} не найден в хранилище.")
+        return
+
+    try:
+        await send_task_report(bot, message.chat.id, result)
+    except FileNotFoundError:
+        # Был только file_id, и Telegram его больше не принимает
+        logger.warning(f"Файл отчёта задачи {task_id} отсутствует в хранилище")
+        await message.answer(f"Файл отчёта по задаче {task_id} не найден.")
 
 
 def register_report_handlers(dp: Dispatcher):
@@ -44,4 +44,14 @@ def confirm_kb():
         [InlineKeyboardButton("Запустить анализ", callback_data="confirm_run")],
         [InlineKeyboardButton("Отменить", callback_data="run_cancel")]
     ])
-    return kb
\ No newline at end of file
+    return kb
+
+def list_page_kb(prev_cursor=None, next_cursor=None):
+    row = []
+    if prev_cursor:
+        row.append(InlineKeyboardButton(text="⬅️ Новее", callback_data=f"lst:p:{prev_cursor}"))
+    if next_cursor:
+        row.append(InlineKeyboardButton(text="Старее ➡️", callback_data=f"lst:n:{next_cursor}"))
+    if not row:
+        return None
+    return InlineKeyboardMarkup(inline_keyboard=[row])
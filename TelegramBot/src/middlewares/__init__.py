@@ -1,4 +1,5 @@
 from .auth import AuthMiddleware
+from .outbound import OutboundDispatcher, bulk_lane
 
 async def register_middlewares(dp):
     """Регистрация всех мидлварей"""
@@ -4,6 +4,7 @@ from aiogram.types import TelegramObject, Update, Message, CallbackQuery
 import logging
 
 from ..api.client import get_auth_client, AuthServiceError
+from ..api.user_cache import get_user_cache
 from ..api.models import UserResponse
 
 logger = logging.getLogger(__name__)
@@ -39,8 +40,8 @@ class AuthMiddleware(BaseMiddleware):
             auth_client = await get_auth_client()
             logger.info(f"Auth client initialized, checking user {user.id}")
 
-            # Пытаемся получить пользователя по chat_id
-            db_user = await auth_client.get_user_by_chat_id(user.id)
+            # Пытаемся получить пользователя по chat_id (через кэш)
+            db_user = await get_user_cache().get(user.id, auth_client.load_user)
 
             if db_user:
                 data['db_user'] = db_user
@@ -0,0 +1,221 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Optional, Union
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+
+from TelegramBot.config import (
+    OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST, OUTBOUND_MAX_RETRIES,
+)
+
+logger = logging.getLogger(__name__)
+
+# Полосы приоритета: ответы пользователю раньше массовых уведомлений
+LANE_INTERACTIVE = 0
+LANE_BULK = 1
+_LANE_NAMES = {LANE_INTERACTIVE: "interactive", LANE_BULK: "bulk"}
+
+# Методы, которые пишут в чат и попадают под лимиты Telegram; остальные (getUpdates, answerCallbackQuery,
+# getFile, setWebhook...) идут напрямую
+_LIMITED_PREFIXES = ("send", "edit", "copy", "forward")
+
+_lane: ContextVar[int] = ContextVar("outbound_lane", default=LANE_INTERACTIVE)
+
+ChatId = Union[int, str]
+
+
+@contextmanager
+def bulk_lane():
+    """Запросы внутри блока (в той же задаче asyncio) идут в полосе массовых уведомлений"""
+    token = _lane.set(LANE_BULK)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+class TokenBucket:
+    """rate токенов в секунду, в запасе не больше burst; после 429 чат приостановлен до paused_until"""
+
+    __slots__ = ("rate", "burst", "tokens", "updated", "paused_until")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def ready_at(self, now: float) -> float:
+        """Когда будет доступен токен (now - уже доступен)"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        ready = now if self.tokens >= 1 else now + (1 - self.tokens) / self.rate
+        return max(ready, self.paused_until)
+
+    def take(self):
+        self.tokens -= 1
+
+
+class OutboundDispatcher(BaseRequestMiddleware):
+    """
+    Мидлварь сессии бота: все исходящие сообщения проходят через одну очередь.
+    - Общий token bucket (лимит бота) и bucket на каждый чат; запрос ждёт токены обоих
+    - Полосы: interactive (по умолчанию - ответы в хэндлерах) всегда раньше bulk (блок bulk_lane(),
+      уведомления и сообщения о ходе анализа). Внутри полосы чаты обслуживаются по кругу,
+      в чате - по порядку, поэтому чат без токенов не задерживает остальные
+    - 429: чат приостанавливается на retry_after, запрос повторяется первым в своём чате
+      (до max_retries раз, затем TelegramRetryAfter уходит вызывающему)
+    - stats(): глубина полос, отправлено, повторы, ошибки, максимальное ожидание
+    """
+
+    def __init__(self, global_rate: float = OUTBOUND_GLOBAL_RATE, chat_rate: float = OUTBOUND_CHAT_RATE,
+                 chat_burst: float = OUTBOUND_CHAT_BURST, max_retries: int = OUTBOUND_MAX_RETRIES):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: Dict[ChatId, TokenBucket] = {}
+        # Полоса -> чат -> ожидающие запросы чата; порядок чатов - очередь обслуживания
+        self._lanes: Dict[int, "OrderedDict[ChatId, Deque[asyncio.Future]]"] = {
+            LANE_INTERACTIVE: OrderedDict(), LANE_BULK: OrderedDict()
+        }
+        self._depth = {LANE_INTERACTIVE: 0, LANE_BULK: 0}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._pump: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.max_wait = 0.0
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod) -> Any:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or not method.__api_method__.startswith(_LIMITED_PREFIXES):
+            return await make_request(bot, method)
+
+        lane = _lane.get()
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(chat_id, lane, retry=attempt > 0)
+            try:
+                result = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self._bucket(chat_id).paused_until = time.monotonic() + e.retry_after
+                if attempt == self.max_retries:
+                    self.failed += 1
+                    logger.warning(f"{method.__api_method__} в чат {chat_id}: лимит Telegram, попытки исчерпаны")
+                    raise
+                self.retried += 1
+                logger.info(f"{method.__api_method__} в чат {chat_id}: 429, повтор через {e.retry_after} с")
+                continue
+            self.sent += 1
+            return result
+
+    def _bucket(self, chat_id: ChatId) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _acquire(self, chat_id: ChatId, lane: int, retry: bool = False):
+        """Ждёт своей очереди и токенов; повтор после 429 встаёт первым в своём чате"""
+        if self._pump is None or self._pump.done():
+            self._wakeup = asyncio.Event()
+            self._pump = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        waiters = self._lanes[lane].get(chat_id)
+        if waiters is None:
+            waiters = self._lanes[lane][chat_id] = deque()
+        if retry:
+            waiters.appendleft(future)
+        else:
+            waiters.append(future)
+        self._depth[lane] += 1
+        self._wakeup.set()
+        started = time.monotonic()
+        try:
+            await future
+        finally:
+            if not future.done():
+                # Вызывающего отменили в ожидании - насос пропустит запрос
+                future.cancel()
+        self.max_wait = max(self.max_wait, time.monotonic() - started)
+
+    def _grant(self, now: float) -> Optional[float]:
+        """Выдаёт токены одному запросу; иначе возвращает, когда появится следующий токен (None - ждать некого)"""
+        if not any(self._depth.values()):
+            return None
+        ready = self._global.ready_at(now)
+        if ready > now:
+            return ready
+        next_at = None
+        for lane, chats in self._lanes.items():
+            for chat_id in list(chats):
+                waiters = chats[chat_id]
+                while waiters and waiters[0].done():
+                    waiters.popleft()
+                    self._depth[lane] -= 1
+                if not waiters:
+                    del chats[chat_id]
+                    continue
+                bucket = self._bucket(chat_id)
+                chat_ready = bucket.ready_at(now)
+                if chat_ready > now:
+                    next_at = chat_ready if next_at is None else min(next_at, chat_ready)
+                    continue
+                self._global.take()
+                bucket.take()
+                waiters.popleft().set_result(None)
+                self._depth[lane] -= 1
+                # Следующий запрос этого чата - после остальных чатов полосы
+                chats.move_to_end(chat_id)
+                if not waiters:
+                    del chats[chat_id]
+                return now
+        return next_at
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            next_at = self._grant(now)
+            if next_at == now:
+                continue
+            self._wakeup.clear()
+            timeout = None if next_at is None else next_at - now
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._prune(time.monotonic())
+
+    def _prune(self, now: float):
+        """Бакеты чатов без ожидающих запросов, успевшие заполниться, не отличаются от новых"""
+        if len(self._chats) < 1024:
+            return
+        waiting = set()
+        for chats in self._lanes.values():
+            waiting.update(chats)
+        for chat_id in [c for c, b in self._chats.items() if c not in waiting and b.ready_at(now) == now
+                        and b.tokens >= b.burst]:
+            del self._chats[chat_id]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **{f"queued_{_LANE_NAMES[lane]}": depth for lane, depth in self._depth.items()},
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+            "max_wait": round(self.max_wait, 3),
+        }
+
+    async def close(self):
+        if self._pump is not None:
+            self._pump.cancel()
+            await asyncio.gather(self._pump, return_exceptions=True)
+            self._pump = None
@@ -0,0 +1,155 @@
+"""
+Входные данные задачи: один FASTQ (обычный или gzip) либо архив zip / tar(.gz) с несколькими образцами.
+Архив читается потоково, по одному члену за раз, без распаковки на диск
+"""
+import gzip
+import multiprocessing
+import os
+import tarfile
+import zipfile
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import BinaryIO, Callable, Dict, Iterator, Optional, Tuple
+
+from TelegramBot.config import QC_CHUNK_SIZE, QC_WORKERS
+from .qc import GZIP_MAGIC, FastqFormatError, QCAccumulator, QCReport, iter_record_chunks, open_fastq, qc_chunk
+
+ZIP_MAGIC = b"PK\x03\x04"
+FASTQ_SUFFIXES = (".fastq", ".fq", ".fastq.gz", ".fq.gz")
+
+
+def is_fastq_name(name: str) -> bool:
+    return name.lower().endswith(FASTQ_SUFFIXES)
+
+
+def _maybe_gunzip(stream) -> BinaryIO:
+    """Члены архива тоже могут быть сжаты gzip (sample.fastq.gz внутри tar)"""
+    if stream.peek(2)[:2] == GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=stream)
+    return stream
+
+
+def iter_samples(path: str, default_name: str = "sample") -> Iterator[Tuple[str, BinaryIO]]:
+    """
+    Образцы входного файла: (имя, поток FASTQ). Потоки нужно читать по порядку -
+    для tar следующий член доступен только после текущего
+    """
+    with open(path, "rb") as f:
+        magic = f.read(4)
+
+    if magic == ZIP_MAGIC:
+        with zipfile.ZipFile(path) as zf:
+            for info in zf.infolist():
+                if info.is_dir() or not is_fastq_name(info.filename):
+                    continue
+                with zf.open(info) as member:
+                    yield info.filename, _maybe_gunzip(member)
+        return
+
+    if tarfile.is_tarfile(path):
+        # "r|*" - потоковый режим: архив читается один раз от начала до конца
+        with tarfile.open(path, "r|*") as tf:
+            for member in tf:
+                if not member.isfile() or not is_fastq_name(member.name):
+                    continue
+                yield member.name, _maybe_gunzip(tf.extractfile(member))
+        return
+
+    with open_fastq(path) as stream:
+        yield default_name, stream
+
+
+class _InlineExecutor:
+    """Один процесс: куски считаются на месте, без передачи данных в пул"""
+
+    def submit(self, fn, *args) -> Future:
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def _make_pool(workers: int):
+    if workers <= 1:
+        return _InlineExecutor()
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def run_qc_samples(
+    path: str,
+    default_name: str = "sample",
+    workers: int = QC_WORKERS,
+    chunk_size: int = QC_CHUNK_SIZE,
+    on_sample: Optional[Callable[[str, QCReport], None]] = None,
+) -> Tuple[QCReport, Dict[str, QCReport]]:
+    """
+    Контроль качества всех образцов: (метрики по всем ридам, метрики по образцам).
+    Поток каждого образца режется на выровненные куски, куски обрабатываются
+    параллельно в пуле процессов, метрики собираются по образцам.
+    В работе держится не больше 2 * workers кусков, так что память ограничена
+    """
+    total = QCAccumulator()
+    accumulators: Dict[str, QCAccumulator] = {}
+    pending: Dict[str, int] = {}
+    reports: Dict[str, QCReport] = {}
+
+    def finish_sample(name: str):
+        reports[name] = accumulators.pop(name).result()
+        if on_sample:
+            on_sample(name, reports[name])
+
+    def collect(inflight: deque):
+        name, future = inflight.popleft()
+        try:
+            acc = future.result()
+        except FastqFormatError as e:
+            raise FastqFormatError(f"{name}: {e}") from e
+        accumulators[name].merge(acc)
+        total.merge(acc)
+        pending[name] -= 1
+        if pending[name] == 0 and name not in reading:
+            del pending[name]
+            finish_sample(name)
+
+    reading = set()
+    with _make_pool(workers) as pool:
+        inflight: deque = deque()
+        for name, stream in iter_samples(path, default_name):
+            # Одинаковые имена в архиве (разные каталоги с одним именем файла) не должны смешиваться
+            base = name
+            suffix = 1
+            while name in reports or name in accumulators:
+                suffix += 1
+                name = f"{base}#{suffix}"
+            accumulators[name] = QCAccumulator()
+            pending[name] = 0
+            reading.add(name)
+            for chunk in iter_record_chunks(stream, chunk_size):
+                while len(inflight) >= 2 * workers:
+                    collect(inflight)
+                inflight.append((name, pool.submit(qc_chunk, chunk)))
+                pending[name] += 1
+            reading.discard(name)
+            if pending[name] == 0:
+                del pending[name]
+                finish_sample(name)
+        while inflight:
+            collect(inflight)
+    return total.result(), reports
+
+
+def sample_name(filename: Optional[str]) -> str:
+    """Имя образца для одиночного FASTQ - имя загруженного файла без расширения"""
+    name = os.path.basename(filename or "sample")
+    for suffix in FASTQ_SUFFIXES:
+        if name.lower().endswith(suffix):
+            return name[:-len(suffix)]
+    return name
@@ -0,0 +1,266 @@
+"""
+Кэш когортного анализа на диске, общий для процессов пула рендеринга.
+- Векторы признаков задач: отсортированные идентификаторы, численности, доли и альфа-разнообразие,
+  по файлу на таблицу признаков (ключ - SHA-256 blob'а features, одинаковые таблицы делят запись).
+- Попарные расстояния: каждой таблице признаков выдаётся номер слота, матрицы Брэя-Кёртиса и Жаккара
+  по слотам хранятся плитками TILE × TILE (.npy, NaN - пара ещё не считалась), плитки создаются
+  только для встречавшихся пар. Новая когорта читает известные пары из плиток и считает только
+  строки задач, для которых пар не хватает
+"""
+import fcntl
+import os
+import sqlite3
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from TelegramBot.config import COHORT_CACHE_DIR, COHORT_CACHE_TILE, COHORT_FULL_RECOMPUTE_FRACTION
+from .diversity import (
+    FeatureTable, alpha_diversity, bray_curtis_distance, build_feature_table, distance_rows, jaccard_distance,
+    load_features,
+)
+
+ALPHA_METRICS = ("reads", "observed", "shannon", "simpson", "chao1")
+# Слов заголовка файла вектора: альфа-метрики и число признаков
+_VECTOR_HEADER = len(ALPHA_METRICS) + 1
+
+SLOTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS slots (
+    digest TEXT PRIMARY KEY,
+    slot INTEGER NOT NULL UNIQUE
+);
+"""
+
+
+class CohortCache:
+    def __init__(self, root: str = COHORT_CACHE_DIR, tile: int = COHORT_CACHE_TILE,
+                 full_recompute_fraction: float = COHORT_FULL_RECOMPUTE_FRACTION):
+        self.root = root
+        self.tile = tile
+        self.full_recompute_fraction = full_recompute_fraction
+        os.makedirs(os.path.join(root, "vectors"), exist_ok=True)
+        os.makedirs(os.path.join(root, "tiles"), exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(root, "slots.sqlite"), timeout=30, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SLOTS_SCHEMA)
+
+    @contextmanager
+    def _locked(self):
+        """Запись плиток - под эксклюзивной блокировкой: процессы пула могут дописывать одни и те же плитки"""
+        with open(os.path.join(self.root, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    # ---- векторы признаков ----
+
+    def _vector_path(self, digest: str) -> str:
+        return os.path.join(self.root, "vectors", digest[:2], f"{digest}.vec")
+
+    def vector(self, digest: str, features_path: str) -> Dict[str, np.ndarray]:
+        """
+        Нормированный вектор признаков задачи и её альфа-разнообразие; при промахе считается и сохраняется.
+        Файл - один массив 8-байтных слов (альфа-метрики, k, идентификаторы, численности, доли):
+        чтение одним np.fromfile, без разбора заголовков .npz на каждую задачу когорты
+        """
+        path = self._vector_path(digest)
+        try:
+            raw = np.fromfile(path, dtype=np.uint64)
+        except FileNotFoundError:
+            raw = None
+        if raw is not None and len(raw) >= _VECTOR_HEADER:
+            header = raw[:_VECTOR_HEADER].view(np.float64)
+            k = int(header[-1])
+            if len(raw) == _VECTOR_HEADER + 3 * k:
+                body = raw[_VECTOR_HEADER:]
+                return {
+                    "ids": body[:k],
+                    "counts": body[k:2 * k].view(np.int64),
+                    "proportions": body[2 * k:].view(np.float64),
+                    **{f"alpha_{key}": header[i] for i, key in enumerate(ALPHA_METRICS)},
+                }
+
+        ids, counts = load_features(features_path)
+        table = build_feature_table([(digest, ids, counts)])
+        alpha = alpha_diversity(table)
+        row = table.counts
+        ids = table.feature_ids[row.indices].astype(np.uint64)
+        counts = row.data.astype(np.int64)
+        proportions = counts / max(counts.sum(), 1)
+        header = np.array([alpha[key][0] for key in ALPHA_METRICS] + [len(ids)], dtype=np.float64)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        np.concatenate([header.view(np.uint64), ids, counts.view(np.uint64), proportions.view(np.uint64)]).tofile(tmp)
+        os.replace(tmp, path)
+        return {
+            "ids": ids,
+            "counts": counts,
+            "proportions": proportions,
+            **{f"alpha_{key}": header[i] for i, key in enumerate(ALPHA_METRICS)},
+        }
+
+    # ---- попарные расстояния ----
+
+    def slots(self, digests: Sequence[str]) -> np.ndarray:
+        """Номера слотов таблиц признаков; новым таблицам выдаются следующие свободные номера"""
+        unique = list(dict.fromkeys(digests))
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            known: Dict[str, int] = {}
+            for start in range(0, len(unique), 500):
+                part = unique[start:start + 500]
+                rows = self._db.execute(
+                    f"SELECT digest, slot FROM slots WHERE digest IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                known.update(rows)
+            next_slot = self._db.execute("SELECT COALESCE(MAX(slot) + 1, 0) FROM slots").fetchone()[0]
+            for digest in unique:
+                if digest not in known:
+                    known[digest] = next_slot
+                    self._db.execute("INSERT INTO slots (digest, slot) VALUES (?, ?)", (digest, next_slot))
+                    next_slot += 1
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        return np.array([known[digest] for digest in digests], dtype=np.int64)
+
+    def _tile_path(self, ti: int, tj: int) -> str:
+        return os.path.join(self.root, "tiles", f"{ti}_{tj}.npy")
+
+    def _tile_groups(self, slots: np.ndarray) -> List[Tuple[int, np.ndarray]]:
+        """Позиции когорты, сгруппированные по номеру плитки слота"""
+        tiles = slots // self.tile
+        return [(int(t), np.flatnonzero(tiles == t)) for t in np.unique(tiles)]
+
+    def lookup(self, slots: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Известные расстояния между слотами (NaN - неизвестно): Брэй-Кёртис и Жаккар"""
+        n = len(slots)
+        distances = np.full((2, n, n), np.nan, dtype=np.float32)
+        groups = self._tile_groups(slots)
+        for ti, rows in groups:
+            for tj, cols in groups:
+                try:
+                    tile = np.load(self._tile_path(ti, tj), mmap_mode="r")
+                except FileNotFoundError:
+                    continue
+                local_rows = slots[rows] % self.tile
+                local_cols = slots[cols] % self.tile
+                distances[:, rows[:, None], cols[None, :]] = tile[:, local_rows[:, None], local_cols[None, :]]
+        # Одинаковые таблицы признаков в когорте (задачи из кэша результатов) - расстояние 0
+        same = slots[:, None] == slots[None, :]
+        distances[:, same] = 0.0
+        return distances[0], distances[1]
+
+    def store(self, slots: np.ndarray, rows: np.ndarray, bray_curtis: np.ndarray, jaccard: np.ndarray):
+        """Записывает строки rows матриц когорты (и симметричные им столбцы) в плитки"""
+        if not len(rows):
+            return
+        groups = self._tile_groups(slots)
+        row_groups = self._tile_groups(slots[rows])
+        with self._locked():
+            for ti, local in row_groups:
+                positions = rows[local]
+                for tj, cols in groups:
+                    block = np.stack([bray_curtis[positions[:, None], cols[None, :]],
+                                      jaccard[positions[:, None], cols[None, :]]]).astype(np.float32)
+                    a = slots[positions] % self.tile
+                    b = slots[cols] % self.tile
+                    # Пара (i, j) пишется в обе плитки (ti, tj) и (tj, ti)
+                    self._write_tile(ti, tj, a, b, block)
+                    self._write_tile(tj, ti, b, a, block.transpose(0, 2, 1))
+
+    def _write_tile(self, ti: int, tj: int, rows: np.ndarray, cols: np.ndarray, block: np.ndarray):
+        path = self._tile_path(ti, tj)
+        if not os.path.exists(path):
+            tmp = f"{path}.{os.getpid()}.tmp"
+            tile = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.float32, shape=(2, self.tile, self.tile))
+            tile[:] = np.nan
+            tile.flush()
+            del tile
+            os.replace(tmp, path)
+        tile = np.lib.format.open_memmap(path, mode="r+")
+        tile[:, rows[:, None], cols[None, :]] = block
+        tile.flush()
+
+    # ---- когорта ----
+
+    def diversity(self, samples: Sequence[Tuple[str, str, str]]) -> Dict[str, object]:
+        """
+        samples: (имя, digest таблицы признаков, путь к ней). Результат как у cohort_diversity
+        и статистика кэша: сколько пар взято готовыми, сколько строк посчитано
+        """
+        names = [name for name, _, _ in samples]
+        digests = [digest for _, digest, _ in samples]
+        vectors = [self.vector(digest, path) for _, digest, path in samples]
+        table: FeatureTable = build_feature_table([(name, v["ids"], v["counts"]) for name, v in zip(names, vectors)])
+        alpha = {key: np.array([v[f"alpha_{key}"] for v in vectors]) for key in ALPHA_METRICS}
+        alpha["reads"] = alpha["reads"].astype(np.int64)
+        alpha["observed"] = alpha["observed"].astype(np.int64)
+
+        n = len(samples)
+        slots = self.slots(digests)
+        # Матрицы когорты - float32, как в плитках: на тысячах задач это половина памяти отчёта
+        bray_curtis, jaccard = self.lookup(slots)
+        unknown = np.isnan(bray_curtis) | np.isnan(jaccard)
+        cached_pairs = int((n * n - np.count_nonzero(unknown) - n) // 2) if n else 0
+
+        # Строки, которые нужно досчитать: жадно берётся строка с наибольшим числом неизвестных пар
+        # (обычно это ровно новые задачи), счётчики остальных строк уменьшаются на её столбец - O(n) на шаг.
+        # Когда строк набирается больше доли full_recompute_fraction, полный пересчёт дешевле построчного
+        remaining = unknown.copy()
+        pending = remaining.sum(axis=1)
+        missing: List[int] = []
+        limit = self.full_recompute_fraction * n
+        while len(missing) <= limit:
+            row = int(pending.argmax()) if n else 0
+            if not n or not pending[row]:
+                break
+            missing.append(row)
+            pending -= remaining[:, row]
+            pending[row] = 0
+            remaining[:, row] = False
+            remaining[row, :] = False
+        if len(missing) > limit:
+            missing = list(range(n))
+
+        if len(missing) == n and n:
+            bray_curtis = bray_curtis_distance(table).astype(np.float32)
+            jaccard = jaccard_distance(table).astype(np.float32)
+        elif missing:
+            rows = np.array(missing)
+            bc_rows, jac_rows = distance_rows(table, rows)
+            bray_curtis[rows, :] = bc_rows
+            bray_curtis[:, rows] = bc_rows.T
+            jaccard[rows, :] = jac_rows
+            jaccard[:, rows] = jac_rows.T
+        self.store(slots, np.array(missing, dtype=np.int64), bray_curtis, jaccard)
+
+        return {
+            "table": table,
+            "alpha": alpha,
+            "bray_curtis": bray_curtis,
+            "jaccard": jaccard,
+            "cache": {"cached_pairs": cached_pairs, "computed_rows": len(missing),
+                      "total_pairs": n * (n - 1) // 2},
+        }
+
+    def close(self):
+        self._db.close()
+
+
+# Singleton для удобного использования
+_cohort_cache_instance: Optional[CohortCache] = None
+
+
+def get_cohort_cache() -> CohortCache:
+    """Получает экземпляр CohortCache (singleton, по одному на процесс пула)"""
+    global _cohort_cache_instance
+
+    if _cohort_cache_instance is None:
+        _cohort_cache_instance = CohortCache()
+
+    return _cohort_cache_instance
@@ -0,0 +1,375 @@
+"""
+Точная дерепликация ридов.
+Последовательности упаковываются по 2 бита на нуклеотид в слова uint64, хэшируются пачками
+в NumPy и подсчитываются в компактных таблицах с открытой адресацией (отдельная таблица на
+каждое число слов). Если таблицы не помещаются в бюджет памяти, они сбрасываются на диск
+по разделам хэша и сливаются по одному разделу в конце
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+from dataclasses import dataclass, field
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from TelegramBot.config import QC_CHUNK_SIZE, DEREP_MEMORY_BUDGET_MB, DEREP_SPILL_PARTITIONS
+from .qc import FastqFormatError, iter_record_chunks
+
+BASES_PER_WORD = 32
+ALPHABET = np.frombuffer(b"ACGT", dtype=np.uint8)
+MAX_LOAD = 0.5
+
+# Код нуклеотида (A=0, C=1, G=2, T=3); остальные символы (N и пр.) - 255
+_CODES = np.full(256, 255, dtype=np.uint8)
+for _code, _base in enumerate(b"ACGT"):
+    _CODES[_base] = _code
+    _CODES[_base | 0x20] = _code
+_SHIFTS = (2 * (BASES_PER_WORD - 1 - np.arange(BASES_PER_WORD))).astype(np.uint64)
+
+
+def _mix(h: np.ndarray) -> np.ndarray:
+    """splitmix64-финализатор"""
+    with np.errstate(over="ignore"):
+        h = h ^ (h >> np.uint64(30))
+        h = h * np.uint64(0xBF58476D1CE4E5B9)
+        h = h ^ (h >> np.uint64(27))
+        h = h * np.uint64(0x94D049BB133111EB)
+        h = h ^ (h >> np.uint64(31))
+    return h
+
+
+def hash_rows(rows: np.ndarray) -> np.ndarray:
+    """Хэш строк (длина, слова...) - по столбцам, векторно по всем строкам"""
+    h = _mix(rows[:, 0] + np.uint64(0x9E3779B97F4A7C15))
+    for col in range(1, rows.shape[1]):
+        h = _mix(h ^ rows[:, col])
+    return h
+
+
+def pack_codes(codes: np.ndarray, n_words: int) -> np.ndarray:
+    """Коды (n, n_words * 32) -> слова (n, n_words), первый нуклеотид в старших битах"""
+    # 4 нуклеотида в байт, затем 8 байт как big-endian uint64 - без промежуточных массивов uint64
+    quads = codes.reshape(len(codes), n_words * 8, 4)
+    packed = (quads[:, :, 0] << 6) | (quads[:, :, 1] << 4) | (quads[:, :, 2] << 2) | quads[:, :, 3]
+    return np.ascontiguousarray(packed).view(">u8").astype(np.uint64)
+
+
+def unpack_words(words: np.ndarray, length: int) -> np.ndarray:
+    """Слова одной последовательности -> коды нуклеотидов длины length"""
+    codes = (words[:, None] >> _SHIFTS) & np.uint64(3)
+    return codes.reshape(-1)[:length].astype(np.uint8)
+
+
+def _void_view(rows: np.ndarray) -> np.ndarray:
+    rows = np.ascontiguousarray(rows)
+    return rows.view(np.dtype((np.void, rows.dtype.itemsize * rows.shape[1]))).ravel()
+
+
+def _aggregate(rows: np.ndarray, counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Сливает одинаковые строки, суммируя счётчики"""
+    _, first, inverse = np.unique(_void_view(rows), return_index=True, return_inverse=True)
+    order = np.argsort(inverse, kind="stable")
+    bounds = np.flatnonzero(np.r_[True, np.diff(inverse[order]) != 0])
+    return rows[first], np.add.reduceat(counts[order], bounds)
+
+
+class CountTable:
+    """
+    Таблица с открытой адресацией (линейное пробирование) для строк фиксированной ширины:
+    столбец 0 - длина последовательности (0 - пустой слот), дальше упакованные слова
+    """
+
+    def __init__(self, n_words: int, capacity: int = 1024):
+        self.width = n_words + 1
+        self.size = 0
+        self._alloc(capacity)
+
+    def _alloc(self, capacity: int):
+        self.capacity = capacity
+        self.mask = np.uint64(capacity - 1)
+        self.keys = np.zeros((capacity, self.width), dtype=np.uint64)
+        self.hashes = np.zeros(capacity, dtype=np.uint64)
+        self.counts = np.zeros(capacity, dtype=np.uint64)
+
+    @staticmethod
+    def bytes_for(capacity: int, width: int) -> int:
+        return capacity * (width + 2) * 8
+
+    @property
+    def nbytes(self) -> int:
+        return self.bytes_for(self.capacity, self.width)
+
+    def capacity_for(self, extra: int) -> int:
+        """Ёмкость, нужная для ещё extra записей при допустимой загрузке"""
+        capacity = self.capacity
+        while self.size + extra > capacity * MAX_LOAD:
+            capacity *= 2
+        return capacity
+
+    def add(self, rows: np.ndarray, hashes: np.ndarray, counts: np.ndarray):
+        """Добавляет попарно различные строки (rows уникальны внутри вызова)"""
+        capacity = self.capacity_for(len(rows))
+        if capacity != self.capacity:
+            live = self.keys[:, 0] != 0
+            old = self.keys[live], self.hashes[live], self.counts[live]
+            self._alloc(capacity)
+            self.size = 0
+            self._insert(*old)
+        self._insert(rows, hashes, counts)
+
+    def _insert(self, rows: np.ndarray, hashes: np.ndarray, counts: np.ndarray):
+        pending = np.arange(len(rows))
+        slots = hashes & self.mask
+        while len(pending):
+            s = slots[pending]
+            current = self.keys[s]
+            empty = current[:, 0] == 0
+            match = ~empty & np.all(current == rows[pending], axis=1)
+            # Строки уникальны, поэтому в один слот совпадает не больше одной
+            self.counts[s[match]] += counts[pending[match]]
+
+            # Пустой слот занимает первая из претендующих на него строк, остальные проверят его заново
+            empty_slots, first = np.unique(s[empty], return_index=True)
+            winners = pending[empty][first]
+            self.keys[empty_slots] = rows[winners]
+            self.hashes[empty_slots] = hashes[winners]
+            self.counts[empty_slots] = counts[winners]
+            self.size += len(winners)
+
+            placed = match.copy()
+            placed[np.flatnonzero(empty)[first]] = True
+            collided = ~empty & ~match
+            slots[pending[collided]] = (slots[pending[collided]] + np.uint64(1)) & self.mask
+            pending = pending[~placed]
+
+    def items(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        live = self.keys[:, 0] != 0
+        return self.keys[live], self.hashes[live], self.counts[live]
+
+    def clear(self):
+        self._alloc(1024)
+        self.size = 0
+
+
+@dataclass
+class DerepResult:
+    """
+    Уникальные последовательности по убыванию численности.
+    Последовательность i: слова words[word_offsets[i]:word_offsets[i + 1]], длина lengths[i]
+    """
+    words: np.ndarray
+    word_offsets: np.ndarray
+    lengths: np.ndarray
+    counts: np.ndarray
+    stats: Dict[str, int] = field(default_factory=dict)
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def codes(self, i: int) -> np.ndarray:
+        return unpack_words(self.words[self.word_offsets[i]:self.word_offsets[i + 1]], int(self.lengths[i]))
+
+    def sequence(self, i: int) -> str:
+        return ALPHABET[self.codes(i)].tobytes().decode("ascii")
+
+    def feature_ids(self, indices: np.ndarray) -> np.ndarray:
+        """
+        Идентификаторы последовательностей для сравнения между задачами: 64 бита BLAKE2b
+        от упакованных слов и длины (одинаковая последовательность - один идентификатор в любой задаче)
+        """
+        ids = np.empty(len(indices), dtype=np.uint64)
+        words, offsets, lengths = self.words, self.word_offsets, self.lengths
+        for row, i in enumerate(np.asarray(indices).tolist()):
+            digest = hashlib.blake2b(words[offsets[i]:offsets[i + 1]].tobytes(), digest_size=8,
+                                     salt=int(lengths[i]).to_bytes(8, "little"))
+            ids[row] = int.from_bytes(digest.digest(), "big")
+        return ids
+
+    def iter_codes(self) -> Iterator[np.ndarray]:
+        for i in range(len(self)):
+            yield self.codes(i)
+
+
+class Dereplicator:
+    """
+    Подсчёт уникальных последовательностей. Принимает выровненные по записям куски FASTQ (update).
+    Риды с неоднозначными нуклеотидами (N и пр.) и пустые риды не учитываются
+    """
+
+    def __init__(self, memory_budget: int = DEREP_MEMORY_BUDGET_MB * 1024 * 1024,
+                 spill_dir: Optional[str] = None, partitions: int = DEREP_SPILL_PARTITIONS):
+        self.memory_budget = memory_budget
+        self.partitions = partitions
+        self._spill_dir = spill_dir
+        self._own_spill_dir = False
+        self.tables: Dict[int, CountTable] = {}
+        self.spills = 0
+        self.reads = 0
+        self.used_reads = 0
+        self.ambiguous = 0
+
+    # ---- приём данных ----
+
+    def update(self, chunk: bytes):
+        buf = np.frombuffer(chunk, dtype=np.uint8)
+        newlines = np.flatnonzero(buf == 10)
+        if len(newlines) % 4:
+            if buf[-1] == 10 or len(newlines) % 4 != 3:
+                raise FastqFormatError("FASTQ обрывается посреди записи")
+            # Последняя строка качества без перевода строки
+            newlines = np.append(newlines, len(buf))
+        if not len(newlines):
+            return
+        starts = np.empty(len(newlines), dtype=np.int64)
+        starts[0] = 0
+        starts[1:] = newlines[:-1] + 1
+        if not np.all(buf[starts[0::4]] == ord("@")):
+            raise FastqFormatError("Ожидался заголовок записи FASTQ ('@')")
+
+        seq_starts = starts[1::4]
+        seq_ends = newlines[1::4]
+        has_cr = (seq_ends > seq_starts) & (buf[np.maximum(seq_ends - 1, 0)] == 13)
+        lengths = seq_ends - seq_starts - has_cr
+        self.reads += len(lengths)
+
+        n_words = (lengths + BASES_PER_WORD - 1) // BASES_PER_WORD
+        # Запас в конце буфера, чтобы окно последней последовательности не выходило за границу
+        padded = np.concatenate([buf, np.zeros(int(n_words.max()) * BASES_PER_WORD, dtype=np.uint8)])
+        for w in np.unique(n_words[lengths > 0]):
+            group = np.flatnonzero(n_words == w)
+            self._add_group(padded, seq_starts[group], lengths[group], int(w))
+
+    def _add_group(self, buf: np.ndarray, starts: np.ndarray, lengths: np.ndarray, n_words: int):
+        span = n_words * BASES_PER_WORD
+        # Окна длины span с начала каждой последовательности: view на буфер, копируются только нужные строки
+        codes = _CODES[np.lib.stride_tricks.sliding_window_view(buf, span)[starts]]
+        codes[np.arange(span)[None, :] >= lengths[:, None]] = 0
+
+        ambiguous = np.any(codes == 255, axis=1)
+        self.ambiguous += int(ambiguous.sum())
+        keep = ~ambiguous
+        if not keep.any():
+            return
+        self.used_reads += int(keep.sum())
+
+        rows = np.empty((int(keep.sum()), n_words + 1), dtype=np.uint64)
+        rows[:, 0] = lengths[keep]
+        rows[:, 1:] = pack_codes(codes[keep], n_words)
+        rows, counts = _aggregate(rows, np.ones(len(rows), dtype=np.uint64))
+        self._add_rows(rows, counts, n_words)
+
+    def _add_rows(self, rows: np.ndarray, counts: np.ndarray, n_words: int):
+        table = self.tables.get(n_words)
+        if table is None:
+            table = self.tables[n_words] = CountTable(n_words)
+        grown = CountTable.bytes_for(table.capacity_for(len(rows)), table.width)
+        has_data = any(t.size for t in self.tables.values())
+        if has_data and self.memory_bytes() - table.nbytes + grown > self.memory_budget:
+            self._spill()
+        table.add(rows, hash_rows(rows), counts)
+
+    def memory_bytes(self) -> int:
+        return sum(table.nbytes for table in self.tables.values())
+
+    # ---- сброс на диск ----
+
+    @property
+    def spill_dir(self) -> str:
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(prefix="derep-")
+            self._own_spill_dir = True
+        os.makedirs(self._spill_dir, exist_ok=True)
+        return self._spill_dir
+
+    def _partition_path(self, n_words: int, partition: int) -> str:
+        return os.path.join(self.spill_dir, f"w{n_words}_p{partition}.bin")
+
+    def _spill(self):
+        """Дописывает содержимое таблиц в файлы разделов (по старшим битам хэша) и очищает таблицы"""
+        for n_words, table in self.tables.items():
+            rows, hashes, counts = table.items()
+            if not len(rows):
+                continue
+            partition = (hashes >> np.uint64(56)) % np.uint64(self.partitions)
+            records = np.hstack([rows, counts[:, None]])
+            for p in np.unique(partition):
+                with open(self._partition_path(n_words, int(p)), "ab") as f:
+                    records[partition == p].tofile(f)
+            table.clear()
+        self.spills += 1
+
+    def _iter_groups(self) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """Группы (строки, счётчики) с попарно различными строками"""
+        if not self.spills:
+            for table in self.tables.values():
+                rows, _, counts = table.items()
+                if len(rows):
+                    yield rows, counts
+            return
+
+        self._spill()
+        self.tables = {}
+        for name in sorted(os.listdir(self.spill_dir)):
+            n_words = int(name[1:name.index("_")])
+            path = os.path.join(self.spill_dir, name)
+            records = np.fromfile(path, dtype=np.uint64).reshape(-1, n_words + 2)
+            os.unlink(path)
+            yield _aggregate(records[:, :-1], records[:, -1])
+
+    # ---- результат ----
+
+    def finish(self, min_count: int = 1) -> DerepResult:
+        """Уникальные последовательности с численностью не меньше min_count"""
+        all_rows: List[np.ndarray] = []
+        all_counts: List[np.ndarray] = []
+        uniques = 0
+        singletons = 0
+        try:
+            for rows, counts in self._iter_groups():
+                uniques += len(rows)
+                singletons += int(np.count_nonzero(counts == 1))
+                keep = counts >= min_count
+                all_rows.append(rows[keep])
+                all_counts.append(counts[keep])
+        finally:
+            if self._own_spill_dir:
+                shutil.rmtree(self._spill_dir, ignore_errors=True)
+
+        counts = np.concatenate(all_counts) if all_counts else np.empty(0, dtype=np.uint64)
+        lengths = np.concatenate([rows[:, 0] for rows in all_rows]) if all_rows else np.empty(0, dtype=np.uint64)
+        words = np.concatenate([rows[:, 1:].ravel() for rows in all_rows]) if all_rows else np.empty(0, np.uint64)
+        n_words = ((lengths + BASES_PER_WORD - 1) // BASES_PER_WORD).astype(np.int64)
+        word_starts = np.cumsum(n_words) - n_words
+
+        # По убыванию численности, при равенстве - по длине
+        order = np.lexsort((lengths, -counts.astype(np.int64)))
+        sorted_words = n_words[order]
+        sorted_offsets = np.zeros(len(order) + 1, dtype=np.int64)
+        np.cumsum(sorted_words, out=sorted_offsets[1:])
+        # Индексы слов в новом порядке: начало каждой последовательности + смещение внутри неё
+        word_index = (np.repeat(word_starts[order], sorted_words)
+                      + np.arange(sorted_offsets[-1]) - np.repeat(sorted_offsets[:-1], sorted_words))
+
+        return DerepResult(
+            words=words[word_index],
+            word_offsets=sorted_offsets,
+            lengths=lengths[order].astype(np.uint32),
+            counts=counts[order],
+            stats={
+                "reads": self.reads,
+                "dereplicated_reads": self.used_reads,
+                "ambiguous_reads": self.ambiguous,
+                "uniques": uniques,
+                "singletons": singletons,
+                "spills": self.spills,
+            },
+        )
+
+
+def dereplicate_stream(stream: BinaryIO, chunk_size: int = QC_CHUNK_SIZE, **kwargs) -> DerepResult:
+    derep = Dereplicator(**kwargs)
+    for chunk in iter_record_chunks(stream, chunk_size):
+        derep.update(chunk)
+    return derep.finish()
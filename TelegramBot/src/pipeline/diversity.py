@@ -0,0 +1,224 @@
+"""
+Когортный анализ: разреженная матрица образец × признак (признак - последовательность,
+см. DerepResult.feature_ids) и метрики разнообразия по ней.
+Альфа-разнообразие считается по ненулевым элементам CSR-матрицы, Жаккар - разреженным
+произведением матриц присутствия, Брэй-Кёртис - суммой минимумов только по парам образцов,
+делящих признак. Циклов Python по парам образцов нет
+"""
+from dataclasses import dataclass
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+
+# Пар образцов, обрабатываемых за один шаг при расчёте Брэя-Кёртиса
+_PAIR_BUDGET = 1 << 22
+# Признаки, встречающиеся не меньше чем в такой доле образцов, считаются плотным блоком:
+# перебор пар с индексами дороже прямого np.minimum по всем парам примерно в 10 раз
+_DENSE_PREVALENCE = 0.25
+# Строк матрицы присутствия на одно разреженное произведение при расчёте Жаккара
+_JACCARD_BLOCK = 512
+
+
+@dataclass
+class FeatureTable:
+    """counts - CSR-матрица численностей (образцы × признаки), столбцы упорядочены по feature_ids"""
+    samples: List[str]
+    feature_ids: np.ndarray
+    counts: sp.csr_matrix
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.counts.shape
+
+
+def load_features(path: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Таблица признаков задачи (features.npz пайплайна): идентификаторы и численности"""
+    with np.load(path) as data:
+        return data["ids"], data["counts"]
+
+
+def build_feature_table(samples: Sequence[Tuple[str, np.ndarray, np.ndarray]]) -> FeatureTable:
+    """samples: (имя, идентификаторы признаков, численности). Общие столбцы - по совпадению идентификаторов"""
+    names = [name for name, _, _ in samples]
+    sizes = np.array([len(ids) for _, ids, _ in samples], dtype=np.int64)
+    if not sizes.sum():
+        return FeatureTable(names, np.empty(0, dtype=np.uint64), sp.csr_matrix((len(names), 0), dtype=np.int64))
+    all_ids = np.concatenate([np.asarray(ids, dtype=np.uint64) for _, ids, _ in samples])
+    feature_ids, columns = np.unique(all_ids, return_inverse=True)
+    rows = np.repeat(np.arange(len(names)), sizes)
+    counts = np.concatenate([np.asarray(c, dtype=np.int64) for _, _, c in samples])
+    # Повторы (образец, признак) суммируются при построении
+    matrix = sp.csr_matrix((counts, (rows, columns)), shape=(len(names), len(feature_ids)))
+    matrix.sum_duplicates()
+    matrix.eliminate_zeros()
+    return FeatureTable(names, feature_ids, matrix)
+
+
+def _row_index(matrix: sp.csr_matrix) -> np.ndarray:
+    return np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+
+
+def relative_abundance(table: FeatureTable) -> sp.csr_matrix:
+    """Доли признаков в образце (строки суммируются в 1, пустые строки остаются нулевыми)"""
+    counts = table.counts
+    totals = np.asarray(counts.sum(axis=1)).ravel().astype(np.float64)
+    data = counts.data / totals[_row_index(counts)]
+    return sp.csr_matrix((data, counts.indices, counts.indptr), shape=counts.shape)
+
+
+def alpha_diversity(table: FeatureTable) -> Dict[str, np.ndarray]:
+    """Число ридов, наблюдаемые признаки, индексы Шеннона (ln) и Симпсона (1 - Σp²), Chao1 с поправкой"""
+    counts = table.counts
+    n = counts.shape[0]
+    rows = _row_index(counts)
+    data = counts.data.astype(np.float64)
+    reads = np.bincount(rows, weights=data, minlength=n)
+    observed = np.diff(counts.indptr)
+    p = data / reads[rows]
+    shannon = -np.bincount(rows, weights=p * np.log(p), minlength=n)
+    simpson = np.where(observed > 0, 1.0 - np.bincount(rows, weights=p * p, minlength=n), 0.0)
+    singletons = np.bincount(rows, weights=counts.data == 1, minlength=n)
+    doubletons = np.bincount(rows, weights=counts.data == 2, minlength=n)
+    chao1 = observed + singletons * (singletons - 1) / (2 * (doubletons + 1))
+    return {
+        "reads": reads.astype(np.int64),
+        "observed": observed,
+        "shannon": shannon,
+        "simpson": simpson,
+        "chao1": chao1,
+    }
+
+
+def jaccard_distance(table: FeatureTable) -> np.ndarray:
+    """
+    1 - |A ∩ B| / |A ∪ B| по наборам присутствующих признаков. Произведение матриц присутствия
+    считается блоками строк: разреженный результат почти плотный и для всей когорты занял бы ~n² × 8 байт
+    """
+    n = table.counts.shape[0]
+    presence = table.counts.astype(bool).astype(np.float32).tocsr()
+    presence_t = presence.T.tocsc()
+    distance = np.empty((n, n), dtype=np.float32)
+    for start in range(0, n, _JACCARD_BLOCK):
+        distance[start:start + _JACCARD_BLOCK] = (presence[start:start + _JACCARD_BLOCK] @ presence_t).toarray()
+    richness = np.diff(table.counts.indptr).astype(np.float32)
+    # На месте: distance = 1 - shared / (r_i + r_j - shared), пустые пары - 0
+    union = richness[:, None] + richness[None, :]
+    union -= distance
+    with np.errstate(invalid="ignore", divide="ignore"):
+        np.divide(distance, union, out=distance)
+    np.subtract(1.0, distance, out=distance)
+    distance[union <= 0] = 0.0
+    np.fill_diagonal(distance, 0.0)
+    return distance
+
+
+def bray_curtis_distance(table: FeatureTable) -> np.ndarray:
+    """
+    Брэй-Кёртис по долям: 1 - Σ min(p_i, p_j). Слагаемое не нулевое только для признаков,
+    общих для пары, поэтому суммы собираются по столбцам: для признака, встречающегося в m образцах,
+    m(m-1)/2 пар. Столбцы с одинаковым m обрабатываются одним векторным блоком,
+    признаки, общие для большой доли образцов, - плотным перебором всех пар
+    """
+    n = table.counts.shape[0]
+    columns = relative_abundance(table).tocsc()
+    columns.sort_indices()
+    prevalence = np.diff(columns.indptr)
+    shared = np.zeros((n, n))
+    flat = shared.reshape(-1)
+    pending: List[Tuple[np.ndarray, np.ndarray]] = []
+    pending_pairs = 0
+
+    def flush():
+        # Один проход bincount по накопленным парам: выделение n² на проход окупается только большими пачками
+        nonlocal pending_pairs
+        if pending:
+            cells = np.concatenate([cell for cell, _ in pending])
+            weights = np.concatenate([weight for _, weight in pending])
+            flat[:] += np.bincount(cells, weights=weights, minlength=n * n)
+            pending.clear()
+            pending_pairs = 0
+
+    # Частые признаки: плотная матрица и np.minimum по блокам строк, только j >= i
+    dense = prevalence >= max(2, _DENSE_PREVALENCE * n)
+    if dense.any():
+        values = columns[:, np.flatnonzero(dense)].toarray()
+        rows_per_block = max(1, _PAIR_BUDGET // (n * values.shape[1]))
+        for start in range(0, n, rows_per_block):
+            stop = min(start + rows_per_block, n)
+            block = np.minimum(values[start:stop, None, :], values[None, start:, :]).sum(axis=2)
+            block[:, :stop - start] = np.triu(block[:, :stop - start], 1)
+            shared[start:stop, start:] += block
+
+    flush_at = max(_PAIR_BUDGET, n * n // 4)
+    for size in np.unique(prevalence[(prevalence >= 2) & ~dense]).tolist():
+        cols = np.flatnonzero(prevalence == size)
+        first, second = np.triu_indices(size, 1)
+        for pair_start in range(0, len(first), _PAIR_BUDGET):
+            a = first[pair_start:pair_start + _PAIR_BUDGET]
+            b = second[pair_start:pair_start + _PAIR_BUDGET]
+            per_block = max(1, _PAIR_BUDGET // len(a))
+            for start in range(0, len(cols), per_block):
+                positions = columns.indptr[cols[start:start + per_block], None] + np.arange(size)
+                samples = columns.indices[positions]
+                values = columns.data[positions]
+                # Индексы в столбце CSC отсортированы, поэтому i < j: заполняется верхний треугольник
+                pending.append(((samples[:, a] * n + samples[:, b]).ravel(),
+                                np.minimum(values[:, a], values[:, b]).ravel()))
+                pending_pairs += len(pending[-1][0])
+                if pending_pairs >= flush_at:
+                    flush()
+    flush()
+    # Заполнен только верхний треугольник: отражение блоками строк, без временной матрицы n² от shared + shared.T
+    for start in range(0, n, 1024):
+        stop = min(start + 1024, n)
+        shared[start:stop, :start] = shared[:start, start:stop].T
+        diagonal = shared[start:stop, start:stop]
+        diagonal += diagonal.T.copy()
+    np.subtract(1.0, shared, out=shared)
+    np.clip(shared, 0.0, 1.0, out=shared)
+    np.fill_diagonal(shared, 0.0)
+    return shared
+
+
+def distance_rows(table: FeatureTable, rows: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Строки матриц Брэя-Кёртиса и Жаккара для образцов rows против всех образцов таблицы.
+    Для образца с k признаками - проход по ненулевым значениям его k столбцов, O(n·k) на строку:
+    дешевле полного пересчёта, когда в когорту добавлено немного новых образцов.
+    Столбцы берутся срезами по _PAIR_BUDGET // n: у ASV-задач признаков ~10^5, плотный блок n × k не помещается в память
+    """
+    proportions = relative_abundance(table)
+    columns = proportions.tocsc()
+    n = table.shape[0]
+    presence_count = np.diff(table.counts.indptr)
+    bray_curtis = np.zeros((len(rows), n))
+    jaccard = np.zeros((len(rows), n))
+    slice_size = max(1, _PAIR_BUDGET // max(n, 1))
+    for out, row in enumerate(rows):
+        start, stop = proportions.indptr[row], proportions.indptr[row + 1]
+        cols, values = proportions.indices[start:stop], proportions.data[start:stop]
+        min_sums = np.zeros(n)
+        shared = np.zeros(n, dtype=np.int64)
+        for slice_start in range(0, len(cols), slice_size):
+            others = columns[:, cols[slice_start:slice_start + slice_size]]
+            present = others.data > 0
+            # Значение образца для столбца каждой ненулевой ячейки среза
+            own = np.repeat(values[slice_start:slice_start + slice_size], np.diff(others.indptr))
+            min_sums += np.bincount(others.indices, weights=np.minimum(others.data, own), minlength=n)
+            shared += np.bincount(others.indices[present], minlength=n)
+        bray_curtis[out] = 1.0 - min_sums
+        union = presence_count + len(cols) - shared
+        with np.errstate(invalid="ignore", divide="ignore"):
+            jaccard[out] = np.where(union > 0, 1.0 - shared / union, 0.0)
+        bray_curtis[out, row] = jaccard[out, row] = 0.0
+    return np.clip(bray_curtis, 0.0, 1.0), jaccard
+
+
+def cohort_diversity(table: FeatureTable) -> Dict[str, object]:
+    """Альфа-разнообразие по образцам и матрицы расстояний Брэя-Кёртиса и Жаккара"""
+    return {
+        "alpha": alpha_diversity(table),
+        "bray_curtis": bray_curtis_distance(table),
+        "jaccard": jaccard_distance(table),
+    }
@@ -0,0 +1,155 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import signal
+import sys
+from typing import Any, Callable, Dict, Optional
+
+from TelegramBot.config import (
+    PIPELINE_TIMEOUT, PIPELINE_MEMORY_LIMIT_MB, PIPELINE_KILL_GRACE, PIPELINE_WORK_DIR
+)
+
+logger = logging.getLogger(__name__)
+
+# Строка события с метриками QC может быть длиннее лимита StreamReader по умолчанию (64 КБ)
+STREAM_LIMIT = 16 * 1024 * 1024
+
+
+class PipelineError(Exception):
+    """Пайплайн завершился с ошибкой"""
+    pass
+
+
+class PipelineTimeout(PipelineError):
+    """Пайплайн не уложился в отведённое время"""
+    pass
+
+
+class PipelineExecutor:
+    """
+    Запускает пайплайн задачи в отдельном процессе (src.pipeline.worker).
+    Отмена и таймаут завершают процесс (SIGTERM, затем SIGKILL), лимит памяти
+    применяется в самом процессе, события этапов передаются через stdout
+    """
+
+    def __init__(self, timeout: float = PIPELINE_TIMEOUT, memory_limit_mb: int = PIPELINE_MEMORY_LIMIT_MB,
+                 kill_grace: float = PIPELINE_KILL_GRACE, work_dir: str = PIPELINE_WORK_DIR):
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.kill_grace = kill_grace
+        self.work_dir = work_dir
+
+    def task_dir(self, task_id: str) -> str:
+        return os.path.join(self.work_dir, task_id)
+
+    def cleanup(self, task_id: str):
+        shutil.rmtree(self.task_dir(task_id), ignore_errors=True)
+
+    async def run(
+        self,
+        task_id: str,
+        spec: Dict[str, Any],
+        on_log: Callable[[str], None],
+        on_metrics: Callable[[str, Dict[str, Any]], None],
+    ) -> Dict[str, Any]:
+        """
+        Выполняет пайплайн и возвращает событие result (path, filename).
+        Файл результата лежит в task_dir(task_id) до вызова cleanup
+        """
+        work_dir = self.task_dir(task_id)
+        os.makedirs(work_dir, exist_ok=True)
+        payload = {**spec, "task_id": task_id, "work_dir": work_dir, "memory_limit_mb": self.memory_limit_mb}
+
+        # Дочерний процесс видит те же пути импорта, что и бот
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in sys.path if p))
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "src.pipeline.worker",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env=env,
+            limit=STREAM_LIMIT,
+            # Своя группа процессов: сигнал получат и дочерние процессы инструментов
+            start_new_session=True,
+        )
+        proc.stdin.write(json.dumps(payload).encode("utf-8"))
+        await proc.stdin.drain()
+        proc.stdin.close()
+
+        state: Dict[str, Any] = {"result": None, "error": None}
+        stderr_task = asyncio.create_task(self._drain_stderr(task_id, proc))
+        try:
+            await asyncio.wait_for(self._read_events(proc, state, on_log, on_metrics), self.timeout)
+            returncode = await proc.wait()
+        except asyncio.TimeoutError:
+            await self._terminate(proc)
+            raise PipelineTimeout(f"Превышено время выполнения ({self.timeout} с)")
+        except asyncio.CancelledError:
+            await self._terminate(proc)
+            raise
+        finally:
+            await asyncio.gather(stderr_task, return_exceptions=True)
+
+        if state["error"]:
+            raise PipelineError(state["error"])
+        if returncode != 0:
+            if returncode < 0:
+                raise PipelineError(f"Процесс пайплайна завершён сигналом {signal.Signals(-returncode).name}")
+            raise PipelineError(f"Процесс пайплайна завершился с кодом {returncode}")
+        if state["result"] is None:
+            raise PipelineError("Пайплайн не вернул результат")
+        return state["result"]
+
+    @staticmethod
+    async def _read_events(proc, state: Dict[str, Any], on_log, on_metrics):
+        async for line in proc.stdout:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                logger.warning(f"Unexpected pipeline output: {line[:200]!r}")
+                continue
+            kind = event.get("event")
+            if kind == "log":
+                on_log(event["message"])
+            elif kind == "metrics":
+                on_metrics(event["stage"], event["values"])
+            elif kind == "result":
+                state["result"] = event
+            elif kind == "error":
+                state["error"] = event["message"]
+
+    @staticmethod
+    async def _drain_stderr(task_id: str, proc):
+        async for line in proc.stderr:
+            logger.warning(f"[pipeline {task_id}] {line.decode('utf-8', 'replace').rstrip()}")
+
+    async def _terminate(self, proc):
+        """SIGTERM группе процессов, по истечении kill_grace - SIGKILL"""
+        if proc.returncode is not None:
+            return
+        try:
+            os.killpg(proc.pid, signal.SIGTERM)
+            try:
+                await asyncio.wait_for(proc.wait(), self.kill_grace)
+                return
+            except asyncio.TimeoutError:
+                os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        await proc.wait()
+
+
+# Singleton для удобного использования
+_pipeline_executor_instance: Optional[PipelineExecutor] = None
+
+
+def get_pipeline_executor() -> PipelineExecutor:
+    """Получает экземпляр PipelineExecutor (singleton)"""
+    global _pipeline_executor_instance
+
+    if _pipeline_executor_instance is None:
+        _pipeline_executor_instance = PipelineExecutor()
+
+    return _pipeline_executor_instance
@@ -0,0 +1,202 @@
+"""
+Жадная кластеризация в OTU (в духе UCLUST / vsearch --cluster_size).
+Уникальные последовательности обрабатываются по убыванию численности: каждая присоединяется
+к первой центроиде с идентичностью не ниже порога или становится новой центроидой.
+Кандидаты отбираются по k-мерному индексу центроид и границам длины, затем проверяются
+расстоянием Хэмминга (при равной длине) и редакционным расстоянием
+"""
+from array import array
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from TelegramBot.config import OTU_IDENTITY, OTU_KMER_SIZE, OTU_MAX_REJECTS, OTU_MIN_SIZE
+from .derep import DerepResult
+
+# Код вне алфавита (0..3): в выравнивании не совпадает ни с чем
+_PAD = 4
+_INF = 1 << 20
+
+
+def kmer_codes(codes: np.ndarray, k: int) -> np.ndarray:
+    """Различные k-меры последовательности как целые числа 0..4^k-1"""
+    if len(codes) < k:
+        return np.empty(0, dtype=np.int64)
+    weights = 4 ** np.arange(k - 1, -1, -1, dtype=np.int64)
+    windows = np.lib.stride_tricks.sliding_window_view(codes.astype(np.int64), k)
+    return np.unique(windows @ weights)
+
+
+def edit_distance(query: List[int], target: List[int]) -> int:
+    """
+    Глобальное редакционное расстояние, бит-параллельный алгоритм Майерса (столбец DP - два битовых
+    вектора в int Python), O(len(target)) операций над целыми независимо от ширины ленты
+    """
+    m = len(query)
+    if m == 0:
+        return len(target)
+    peq = [0] * (_PAD + 1)
+    for i, c in enumerate(query):
+        peq[c] |= 1 << i
+    full = (1 << m) - 1
+    high = 1 << (m - 1)
+    pv, mv, score = full, 0, m
+    for c in target:
+        eq = peq[c]
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & full)
+        mh = pv & xh
+        if ph & high:
+            score += 1
+        elif mh & high:
+            score -= 1
+        # Глобальное выравнивание: верхняя строка D[0][j] = j растёт на 1 в каждом столбце
+        ph = ((ph << 1) | 1) & full
+        mh = (mh << 1) & full
+        pv = mh | (~(xv | ph) & full)
+        mv = ph & xv
+    return score
+
+
+@dataclass
+class OTUResult:
+    # Индексы центроид в DerepResult и суммарная численность каждой OTU
+    centroids: np.ndarray
+    sizes: np.ndarray
+    # Для каждой уникальной последовательности - номер OTU (-1 - отброшена по min_size)
+    assignments: np.ndarray
+    stats: Dict[str, float] = field(default_factory=dict)
+
+
+class GreedyOTUClusterer:
+    """
+    identity = 1 - d / max(len(query), len(centroid)), d - редакционное расстояние.
+    max_rejects - сколько лучших по k-мерам кандидатов выравнивается, прежде чем запрос
+    становится новой центроидой
+    """
+
+    def __init__(self, identity: float = OTU_IDENTITY, k: int = OTU_KMER_SIZE,
+                 max_rejects: int = OTU_MAX_REJECTS, min_size: int = OTU_MIN_SIZE):
+        self.identity = identity
+        self.k = k
+        self.max_rejects = max_rejects
+        self.min_size = min_size
+        self._postings: List[Optional[array]] = [None] * (4 ** k)
+        self._centroid_codes: List[np.ndarray] = []
+        self._centroid_lists: List[List[int]] = []
+        self._lengths = array("I")
+        self.aligned = 0
+        self.checked = 0
+        self.hamming_accepts = 0
+        self.kmer_skipped = 0
+
+    def _max_distance(self, length: np.ndarray) -> np.ndarray:
+        return np.floor((1.0 - self.identity) * length + 1e-9).astype(np.int64)
+
+    def _add_centroid(self, codes: np.ndarray, kmers: np.ndarray):
+        cid = len(self._centroid_codes)
+        self._centroid_codes.append(codes)
+        self._centroid_lists.append(codes.tolist())
+        self._lengths.append(len(codes))
+        postings = self._postings
+        for kmer in kmers.tolist():
+            bucket = postings[kmer]
+            if bucket is None:
+                bucket = postings[kmer] = array("I")
+            bucket.append(cid)
+        return cid
+
+    def _candidates(self, kmers: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Центроиды, упорядоченные по убыванию числа общих k-меров, и эти числа"""
+        postings = self._postings
+        joined = b"".join([bucket for bucket in map(postings.__getitem__, kmers.tolist()) if bucket is not None])
+        if not joined:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        ids, shared = np.unique(np.frombuffer(joined, dtype=np.uint32), return_counts=True)
+        order = np.argsort(-shared, kind="stable")
+        return ids[order].astype(np.int64), shared[order]
+
+    def _match(self, codes: np.ndarray, kmers: np.ndarray) -> int:
+        """Номер подходящей центроиды или -1"""
+        ids, shared = self._candidates(kmers)
+        if not len(ids):
+            return -1
+        lengths = np.frombuffer(self._lengths, dtype=np.uint32)[ids].astype(np.int64)
+        max_dist = self._max_distance(np.maximum(lengths, len(codes)))
+        # Каждая правка разрушает не больше k k-меров запроса: d >= (k-меров запроса - общих) / k
+        feasible = (len(kmers) - shared <= self.k * max_dist) & (np.abs(lengths - len(codes)) <= max_dist)
+        self.kmer_skipped += int(np.count_nonzero(~feasible[:self.max_rejects]))
+        ids, lengths, max_dist = ids[feasible], lengths[feasible], max_dist[feasible]
+        ids, lengths, max_dist = ids[:self.max_rejects], lengths[:self.max_rejects], max_dist[:self.max_rejects]
+        if not len(ids):
+            return -1
+
+        # Быстрый путь: без инделов расстояние не больше числа несовпадений
+        distance = np.full(len(ids), _INF)
+        same = np.flatnonzero(lengths == len(codes))
+        if len(same):
+            targets = np.stack([self._centroid_codes[c] for c in ids[same].tolist()])
+            distance[same] = np.count_nonzero(targets != codes, axis=1)
+        self.checked += len(same)
+        accepted = distance <= max_dist
+
+        # Кандидаты по порядку до первого принятого - по Хэммингу или по выравниванию
+        query = None
+        for row, cid in enumerate(ids.tolist()):
+            if accepted[row]:
+                self.hamming_accepts += 1
+                return cid
+            if query is None:
+                query = codes.tolist()
+            if lengths[row] != len(codes):
+                self.checked += 1
+            self.aligned += 1
+            if edit_distance(query, self._centroid_lists[cid]) <= max_dist[row]:
+                return cid
+        return -1
+
+    def cluster(self, derep: DerepResult) -> OTUResult:
+        n = len(derep)
+        assignments = np.full(n, -1, dtype=np.int64)
+        centroids: List[int] = []
+        reads = 0
+        for i in range(n):
+            if derep.counts[i] < self.min_size:
+                # Численность дальше только убывает
+                break
+            reads += int(derep.counts[i])
+            codes = derep.codes(i)
+            kmers = kmer_codes(codes, self.k)
+            cid = self._match(codes, kmers)
+            if cid < 0:
+                cid = self._add_centroid(codes, kmers)
+                centroids.append(i)
+            assignments[i] = cid
+
+        assigned = assignments >= 0
+        sizes = np.bincount(assignments[assigned], weights=derep.counts[assigned].astype(np.float64),
+                            minlength=len(centroids)).astype(np.int64)
+        clustered = int(np.count_nonzero(assigned))
+        return OTUResult(
+            centroids=np.array(centroids, dtype=np.int64),
+            sizes=sizes,
+            assignments=assignments,
+            stats={
+                "otus": len(centroids),
+                "clustered_uniques": clustered,
+                "clustered_reads": reads,
+                "discarded_uniques": n - clustered,
+                "checked_candidates": self.checked,
+                "checked_per_unique": self.checked / clustered if clustered else 0.0,
+                "aligned_candidates": self.aligned,
+                "hamming_accepts": self.hamming_accepts,
+                "kmer_filtered_candidates": self.kmer_skipped,
+                "identity": self.identity,
+            },
+        )
+
+
+def cluster_otus(derep: DerepResult, **kwargs) -> OTUResult:
+    return GreedyOTUClusterer(**kwargs).cluster(derep)
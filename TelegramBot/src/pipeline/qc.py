@@ -0,0 +1,296 @@
+"""
+Потоковый контроль качества FASTQ.
+Файл (обычный или gzip) читается кусками фиксированного размера, записи разбираются
+векторно в NumPy, поэтому память не зависит от размера файла
+"""
+import gzip
+from dataclasses import dataclass, asdict
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional
+
+import numpy as np
+
+from TelegramBot.config import QC_CHUNK_SIZE, QC_MAX_POSITIONS, QC_DUP_SKETCH_SIZE
+
+PHRED_OFFSET = 33
+MAX_PHRED = 94
+QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+GZIP_MAGIC = b"\x1f\x8b"
+
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+# Фиксированные случайные веса позиций для хэша ридов (одинаковые во всех процессах)
+_POSITION_WEIGHTS = np.random.default_rng(0x5EED).integers(1, 2 ** 63, size=4096, dtype=np.uint64) | np.uint64(1)
+
+
+class FastqFormatError(ValueError):
+    """Файл не похож на FASTQ"""
+    pass
+
+
+@dataclass
+class QCReport:
+    reads: int
+    bases: int
+    min_length: int
+    max_length: int
+    mean_length: float
+    gc_content: float
+    n_rate: float
+    mean_quality: float
+    q30_rate: float
+    duplication_rate: float
+    distinct_reads_estimate: int
+    # Квантили качества по позициям: {"0.5": [q по позиции 0, 1, ...], ...}
+    position_quality_quantiles: Dict[str, List[int]]
+    # Гистограмма длин: [(длина, число ридов), ...]
+    length_histogram: List[List[int]]
+    # Доля ридов по GC-составу с шагом 1%
+    gc_histogram: List[int]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    def summary(self) -> Dict[str, Any]:
+        """Скалярные метрики без гистограмм и квантилей по позициям"""
+        return {k: v for k, v in self.to_dict().items() if not isinstance(v, (list, dict))}
+
+
+def open_fastq(path: str) -> BinaryIO:
+    """Открывает FASTQ, распознавая gzip по сигнатуре, а не по расширению"""
+    with open(path, "rb") as f:
+        magic = f.read(2)
+    if magic == GZIP_MAGIC:
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+class QCAccumulator:
+    """
+    Накопитель метрик качества. Принимает произвольные куски байт FASTQ (update),
+    незавершённая запись переносится в следующий кусок
+    """
+
+    def __init__(self, max_positions: int = QC_MAX_POSITIONS, sketch_size: int = QC_DUP_SKETCH_SIZE):
+        self.max_positions = max_positions
+        self.sketch_size = sketch_size
+
+        self._leftover = b""
+        self.reads = 0
+        self.bases = 0
+        self.gc = 0
+        self.n = 0
+        self.quality_sum = 0
+        self.q30 = 0
+        self.min_length: Optional[int] = None
+        self.max_length = 0
+        # Гистограммы фиксированного размера: качество по позициям, длины, GC
+        self.position_hist = np.zeros((max_positions, MAX_PHRED), dtype=np.int64)
+        self.length_hist = np.zeros(max_positions + 1, dtype=np.int64)
+        self.gc_hist = np.zeros(101, dtype=np.int64)
+        # KMV-скетч: sketch_size наименьших хэшей ридов для оценки числа уникальных
+        self.sketch = np.empty(0, dtype=np.uint64)
+
+    def update(self, chunk: bytes):
+        data = self._leftover + chunk if self._leftover else chunk
+        buf = np.frombuffer(data, dtype=np.uint8)
+        newlines = np.flatnonzero(buf == 10)
+        complete = len(newlines) - len(newlines) % 4
+        if complete == 0:
+            self._leftover = data
+            return
+        cut = int(newlines[complete - 1]) + 1
+        self._process(buf[:cut], newlines[:complete])
+        self._leftover = data[cut:]
+
+    def finish(self):
+        rest = self._leftover.strip()
+        self._leftover = b""
+        if not rest:
+            return
+        data = rest + b"\n"
+        buf = np.frombuffer(data, dtype=np.uint8)
+        newlines = np.flatnonzero(buf == 10)
+        if len(newlines) % 4:
+            raise FastqFormatError("FASTQ обрывается посреди записи")
+        self._process(buf, newlines)
+
+    def _process(self, buf: np.ndarray, newlines: np.ndarray):
+        n_lines = len(newlines)
+        n_reads = n_lines // 4
+        starts = np.empty(n_lines, dtype=np.int64)
+        starts[0] = 0
+        starts[1:] = newlines[:-1] + 1
+
+        if not np.all(buf[starts[0::4]] == ord("@")):
+            raise FastqFormatError("Ожидался заголовок записи FASTQ ('@')")
+
+        # Роль каждого байта в записи (0 - заголовок, 1 - последовательность, 2 - '+', 3 - качество)
+        # и его позиция в строке: дальше всё считается одномерными операциями по куску
+        line_sizes = newlines - starts + 1
+        roles = np.repeat(np.tile(np.arange(4, dtype=np.uint8), n_reads), line_sizes)
+        positions = np.arange(len(buf), dtype=np.int32) - np.repeat(starts.astype(np.int32), line_sizes)
+        content = (buf != 10) & (buf != 13)
+        seq_mask = (roles == 1) & content
+        qual_mask = (roles == 3) & content
+
+        seq = buf[seq_mask] & 0xDF
+        seq_pos = positions[seq_mask]
+        qual = buf[qual_mask]
+        qual_pos = positions[qual_mask]
+
+        # Длина строки без перевода строки (и без '\r' для файлов из Windows)
+        has_cr = (line_sizes > 1) & (buf[np.maximum(newlines - 1, 0)] == 13)
+        line_lengths = line_sizes - 1 - has_cr
+        lengths = line_lengths[1::4]
+        if not np.array_equal(lengths, line_lengths[3::4]):
+            raise FastqFormatError("Длины последовательности и строки качества не совпадают")
+
+        self.reads += n_reads
+        self.bases += len(seq)
+        self.min_length = int(lengths.min()) if self.min_length is None else min(self.min_length, int(lengths.min()))
+        self.max_length = max(self.max_length, int(lengths.max()))
+        self.length_hist += np.bincount(np.minimum(lengths, self.max_positions),
+                                        minlength=self.max_positions + 1)
+
+        base_counts = np.bincount(seq, minlength=256)
+        self.gc += int(base_counts[ord("G")] + base_counts[ord("C")])
+        self.n += int(base_counts[ord("N")])
+
+        # Символы ниже '!' некорректны для Phred+33 и после вычитания попадают в последний бин
+        phred = np.minimum(qual - np.uint8(PHRED_OFFSET), MAX_PHRED - 1)
+        phred_counts = np.bincount(phred, minlength=MAX_PHRED)
+        self.quality_sum += int(phred_counts @ np.arange(MAX_PHRED))
+        self.q30 += int(phred_counts[30:].sum())
+
+        tracked = qual_pos < self.max_positions
+        flat = qual_pos[tracked] * MAX_PHRED + phred[tracked]
+        self.position_hist += np.bincount(flat, minlength=self.max_positions * MAX_PHRED).reshape(
+            self.max_positions, MAX_PHRED
+        )
+
+        # Пер-ридовые суммы по непустым ридам: границы ридов в сжатом массиве последовательностей
+        nonempty = lengths > 0
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))[nonempty]
+        gc_per_read = np.zeros(n_reads, dtype=np.int64)
+        hashes = np.zeros(n_reads, dtype=np.uint64)
+        if len(offsets):
+            is_gc = (seq == ord("G")) | (seq == ord("C"))
+            gc_per_read[nonempty] = np.add.reduceat(is_gc, offsets, dtype=np.int64)
+            # Линейный хэш со случайными весами позиций: сумма w[pos] * base по риду (mod 2^64)
+            weights = _POSITION_WEIGHTS[seq_pos & (len(_POSITION_WEIGHTS) - 1)]
+            with np.errstate(over="ignore"):
+                hashes[nonempty] = np.add.reduceat(weights * seq.astype(np.uint64), offsets)
+        gc_percent = gc_per_read * 100 // np.maximum(lengths, 1)
+        self.gc_hist += np.bincount(gc_percent, minlength=101)[:101]
+        self._update_sketch(_finalize_hashes(hashes, lengths))
+
+    def merge(self, other: "QCAccumulator"):
+        """Добавляет метрики другого накопителя (например, посчитанного по другому куску файла)"""
+        self.reads += other.reads
+        self.bases += other.bases
+        self.gc += other.gc
+        self.n += other.n
+        self.quality_sum += other.quality_sum
+        self.q30 += other.q30
+        if other.min_length is not None:
+            self.min_length = other.min_length if self.min_length is None else min(self.min_length, other.min_length)
+        self.max_length = max(self.max_length, other.max_length)
+        self.position_hist += other.position_hist
+        self.length_hist += other.length_hist
+        self.gc_hist += other.gc_hist
+        self._update_sketch(other.sketch)
+
+    def _update_sketch(self, hashes: np.ndarray):
+        merged = np.unique(np.concatenate([self.sketch, hashes]))
+        self.sketch = merged[:self.sketch_size]
+
+    def distinct_estimate(self) -> int:
+        if len(self.sketch) < self.sketch_size:
+            return len(self.sketch)
+        kth = float(self.sketch[self.sketch_size - 1])
+        return int((self.sketch_size - 1) * 2.0 ** 64 / kth)
+
+    def result(self) -> QCReport:
+        totals = self.position_hist.sum(axis=1)
+        used = int(np.count_nonzero(totals))
+        cumulative = np.cumsum(self.position_hist[:used], axis=1)
+        quantiles = {}
+        for q in QUANTILES:
+            threshold = np.ceil(totals[:used] * q)
+            quantiles[str(q)] = np.argmax(cumulative >= threshold[:, None], axis=1).astype(int).tolist()
+
+        distinct = min(self.distinct_estimate(), self.reads)
+        nonzero_lengths = np.flatnonzero(self.length_hist)
+        return QCReport(
+            reads=self.reads,
+            bases=self.bases,
+            min_length=self.min_length or 0,
+            max_length=self.max_length,
+            mean_length=self.bases / self.reads if self.reads else 0.0,
+            gc_content=self.gc / self.bases if self.bases else 0.0,
+            n_rate=self.n / self.bases if self.bases else 0.0,
+            mean_quality=self.quality_sum / self.bases if self.bases else 0.0,
+            q30_rate=self.q30 / self.bases if self.bases else 0.0,
+            duplication_rate=1.0 - distinct / self.reads if self.reads else 0.0,
+            distinct_reads_estimate=distinct,
+            position_quality_quantiles=quantiles,
+            length_histogram=[[int(length), int(self.length_hist[length])] for length in nonzero_lengths],
+            gc_histogram=self.gc_hist.astype(int).tolist(),
+        )
+
+
+def _finalize_hashes(h: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """Подмешивает длину и перемешивает биты (splitmix64), чтобы хэши равномерно покрывали диапазон для KMV"""
+    with np.errstate(over="ignore"):
+        h = h ^ (lengths.astype(np.uint64) * _MIX)
+        h ^= h >> np.uint64(30)
+        h *= np.uint64(0xBF58476D1CE4E5B9)
+        h ^= h >> np.uint64(27)
+        h *= np.uint64(0x94D049BB133111EB)
+        h ^= h >> np.uint64(31)
+    return h
+
+
+def iter_record_chunks(stream: BinaryIO, chunk_size: int = QC_CHUNK_SIZE) -> Iterator[bytes]:
+    """Куски потока примерно по chunk_size, выровненные по границам записей FASTQ (4 строки)"""
+    leftover = b""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        data = leftover + chunk if leftover else chunk
+        newlines = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == 10)
+        complete = len(newlines) - len(newlines) % 4
+        if complete == 0:
+            leftover = data
+            continue
+        cut = int(newlines[complete - 1]) + 1
+        yield data[:cut]
+        leftover = data[cut:]
+    if leftover.strip():
+        # Последняя запись может быть без завершающего перевода строки
+        yield leftover
+
+
+def qc_chunk(data: bytes) -> QCAccumulator:
+    """Метрики одного выровненного куска; выполняется в процессах пула, результаты объединяются merge()"""
+    acc = QCAccumulator()
+    acc.update(data)
+    acc.finish()
+    return acc
+
+
+def run_qc_stream(stream: BinaryIO, chunk_size: int = QC_CHUNK_SIZE) -> QCReport:
+    acc = QCAccumulator()
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        acc.update(chunk)
+    acc.finish()
+    return acc.result()
+
+
+def run_qc(path: str, chunk_size: int = QC_CHUNK_SIZE) -> QCReport:
+    """Контроль качества FASTQ-файла (обычного или gzip)"""
+    with open_fastq(path) as stream:
+        return run_qc_stream(stream, chunk_size)
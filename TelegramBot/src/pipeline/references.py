@@ -0,0 +1,221 @@
+"""
+Реестр референсных баз таксономии. Индекс каждой базы открывается один раз на процесс:
+в боте - при запуске (REFERENCE_PRELOAD) с чтением всех страниц, в процессе пайплайна - при первом
+обращении. Матрица индекса отображена из файла только для чтения, поэтому её страницы в страничном
+кэше ОС общие для бота и всех процессов пайплайна и не копируются в память каждого из них.
+
+Версии лежат в каталогах base_dir/ИМЯ@ВЕРСИЯ, base_dir/ИМЯ - символическая ссылка на текущую.
+Новая версия публикуется атомарной заменой ссылки; реестр сверяет ссылку и файлы при обращении
+(и периодически в боте) и переключается на новую версию, старая освобождается вместе с последней ссылкой
+"""
+import asyncio
+import logging
+import os
+import shutil
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from TelegramBot.config import REFERENCE_CHECK_INTERVAL, REFERENCE_KEEP_VERSIONS, TAXONOMY_INDEX_DIR
+from .taxonomy import LOGP_FILE, META_FILE, TaxonomyIndex
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _LoadedReference:
+    index: TaxonomyIndex
+    signature: Tuple
+    load_seconds: float
+    loaded_at: float
+    prefetched: bool
+
+
+def _mapped_rss(path: str) -> Optional[int]:
+    """Резидентная память отображений файла path в текущем процессе (байт), None вне Linux"""
+    try:
+        with open("/proc/self/smaps", "r") as f:
+            rss, inside = 0, False
+            for line in f:
+                fields = line.split()
+                if "-" in fields[0] and len(fields) >= 5 and ":" in fields[3]:
+                    # Заголовок отображения: адреса, права, смещение, устройство, inode, путь
+                    mapped = line.split(None, 5)[5].strip() if len(fields) >= 6 else ""
+                    inside = mapped == path or mapped == path + " (deleted)"
+                elif inside and fields[0] == "Rss:":
+                    rss += int(fields[1]) * 1024
+            return rss
+    except OSError:
+        return None
+
+
+class ReferenceRegistry:
+    """Загруженные индексы референсов по имени (SILVA, Greengenes), не больше одного на имя"""
+
+    def __init__(self, base_dir: str = TAXONOMY_INDEX_DIR, keep_versions: int = REFERENCE_KEEP_VERSIONS):
+        self.base_dir = base_dir
+        self.keep_versions = keep_versions
+        self.swaps = 0
+        self._loaded: Dict[str, _LoadedReference] = {}
+        self._lock = threading.Lock()
+        self._watch_task: Optional[asyncio.Task] = None
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.base_dir, name)
+
+    def _signature(self, name: str) -> Optional[Tuple]:
+        """Текущая версия на диске: каталог после разрешения ссылки и (inode, mtime) файлов индекса"""
+        directory = os.path.realpath(self.path(name))
+        try:
+            meta = os.stat(os.path.join(directory, META_FILE))
+            logp = os.stat(os.path.join(directory, LOGP_FILE))
+        except FileNotFoundError:
+            return None
+        return directory, meta.st_ino, meta.st_mtime_ns, logp.st_ino, logp.st_mtime_ns
+
+    def _load(self, name: str, signature: Tuple, prefetch: bool) -> TaxonomyIndex:
+        started = time.perf_counter()
+        index = TaxonomyIndex(signature[0])
+        if prefetch:
+            index.prefetch()
+        previous = self._loaded.get(name)
+        self._loaded[name] = _LoadedReference(
+            index=index,
+            signature=signature,
+            load_seconds=time.perf_counter() - started,
+            loaded_at=time.time(),
+            prefetched=prefetch,
+        )
+        if previous is not None:
+            # Старую версию не закрываем: её массивы могут использоваться классификацией,
+            # отображение снимется, когда их не останется
+            self.swaps += 1
+            logger.info(f"Референс {name}: {os.path.basename(previous.signature[0])} -> "
+                        f"{os.path.basename(signature[0])}")
+        return index
+
+    def get(self, name: str) -> Optional[TaxonomyIndex]:
+        """Индекс текущей версии референса или None, если он не обучен"""
+        with self._lock:
+            signature = self._signature(name)
+            if signature is None:
+                self._loaded.pop(name, None)
+                return None
+            loaded = self._loaded.get(name)
+            if loaded is not None and loaded.signature == signature:
+                return loaded.index
+            return self._load(name, signature, prefetch=loaded.prefetched if loaded else False)
+
+    def preload(self, names: Iterable[str]) -> List[str]:
+        """Загрузка с чтением всех страниц индекса; возвращает имена загруженных референсов"""
+        loaded = []
+        for name in names:
+            with self._lock:
+                signature = self._signature(name)
+                if signature is None:
+                    logger.warning(f"Референс {name} не найден в {self.base_dir}, предзагрузка пропущена")
+                    continue
+                self._load(name, signature, prefetch=True)
+            loaded.append(name)
+            stats = self.stats()[name]
+            logger.info(f"Референс {name} загружен за {stats['load_seconds']:.2f} с, "
+                        f"в памяти {stats['resident_mb']} МБ из {stats['mapped_mb']} МБ")
+        return loaded
+
+    def refresh(self) -> List[str]:
+        """Переключает загруженные референсы, у которых на диске появилась новая версия"""
+        swapped = []
+        for name in list(self._loaded):
+            before = self._loaded.get(name)
+            index = self.get(name)
+            if before is not None and index is not before.index:
+                swapped.append(name)
+        return swapped
+
+    def stats(self) -> Dict[str, Dict[str, object]]:
+        """Время загрузки и память по загруженным референсам"""
+        result = {}
+        with self._lock:
+            for name, loaded in self._loaded.items():
+                rss = _mapped_rss(loaded.index.logp_path)
+                result[name] = {
+                    "version": os.path.basename(loaded.signature[0]),
+                    "load_seconds": round(loaded.load_seconds, 3),
+                    "loaded_at": loaded.loaded_at,
+                    "mapped_mb": round(loaded.index.mapped_bytes / 2 ** 20, 1),
+                    "resident_mb": round(rss / 2 ** 20, 1) if rss is not None else None,
+                }
+        return result
+
+    def index_bytes(self, name: str) -> int:
+        """Размер матрицы текущей версии: отображение занимает столько же адресного пространства"""
+        signature = self._signature(name)
+        if signature is None:
+            return 0
+        return os.path.getsize(os.path.join(signature[0], LOGP_FILE))
+
+    def new_version_dir(self, name: str) -> str:
+        """Каталог для обучения новой версии (ещё не опубликованной)"""
+        version = time.strftime("%Y%m%d%H%M%S")
+        return os.path.join(self.base_dir, f"{name}@{version}-{os.getpid()}")
+
+    def publish(self, name: str, version_dir: str):
+        """Делает version_dir текущей версией name: атомарная замена символической ссылки"""
+        link = self.path(name)
+        if os.path.isdir(link) and not os.path.islink(link):
+            # Индекс, обученный прямо в base_dir/ИМЯ, становится обычной старой версией
+            os.rename(link, f"{link}@{time.strftime('%Y%m%d%H%M%S', time.localtime(os.path.getmtime(link)))}")
+        tmp = f"{link}.tmp-{os.getpid()}"
+        os.symlink(os.path.basename(os.path.normpath(version_dir)), tmp)
+        os.replace(tmp, link)
+        self._prune(name, current=os.path.realpath(link))
+
+    def _prune(self, name: str, current: str):
+        """Удаляет старые версии сверх keep_versions; отображённые файлы остаются доступны до освобождения"""
+        prefix = f"{name}@"
+        versions = sorted(
+            (entry.path for entry in os.scandir(self.base_dir)
+             if entry.name.startswith(prefix) and entry.is_dir(follow_symlinks=False)
+             and os.path.realpath(entry.path) != current),
+            key=os.path.getmtime,
+            reverse=True,
+        )
+        for path in versions[max(self.keep_versions - 1, 0):]:
+            shutil.rmtree(path, ignore_errors=True)
+
+    async def _watch(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                swapped = await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                logger.error(f"Ошибка проверки версий референсов: {e}")
+                continue
+            if swapped:
+                logger.info(f"Обновлены референсы: {', '.join(swapped)}")
+
+    def start_watching(self, interval: float = REFERENCE_CHECK_INTERVAL):
+        """Периодическая проверка новых версий загруженных референсов (в event loop бота)"""
+        if self._watch_task is None and interval > 0:
+            self._watch_task = asyncio.create_task(self._watch(interval))
+
+    async def stop_watching(self):
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            await asyncio.gather(self._watch_task, return_exceptions=True)
+            self._watch_task = None
+
+
+# Singleton для удобного использования
+_reference_registry_instance: Optional[ReferenceRegistry] = None
+
+
+def get_reference_registry() -> ReferenceRegistry:
+    """Получает экземпляр ReferenceRegistry (singleton)"""
+    global _reference_registry_instance
+
+    if _reference_registry_instance is None:
+        _reference_registry_instance = ReferenceRegistry()
+
+    return _reference_registry_instance
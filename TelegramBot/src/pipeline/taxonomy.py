@@ -0,0 +1,400 @@
+"""
+Таксономическая классификация наивным байесовским k-мерным классификатором (в духе RDP Classifier
+и q2-feature-classifier). Обучение на референсной базе (SILVA, Greengenes) строит индекс на диске:
+матрица k-мер × таксон логарифмов условных вероятностей, которая при классификации
+отображается в память (np.load(mmap_mode="r")) и не загружается целиком.
+
+Формат референса как в QIIME 2: FASTA с последовательностями и TSV "id<TAB>k__...; p__...; g__..."
+"""
+import argparse
+import gzip
+import json
+import mmap
+import os
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from TelegramBot.config import (
+    TAXONOMY_BOOTSTRAPS, TAXONOMY_CONFIDENCE, TAXONOMY_DEPTH, TAXONOMY_KMER_SIZE,
+)
+from .derep import _CODES
+from .qc import GZIP_MAGIC
+
+INDEX_VERSION = 1
+LOGP_FILE = "kmer_logp.npy"
+META_FILE = "taxonomy.json"
+UNASSIGNED = "Unassigned"
+
+# Пар (k-мер, таксон) в буфере обучения до сброса в матрицу счётчиков
+_TRAIN_BUFFER = 1 << 22
+# Ограничение на размер собираемого блока строк матрицы при классификации (элементов float32)
+_GATHER_BUDGET = 1 << 24
+
+
+def encode(sequence: bytes) -> np.ndarray:
+    """Коды нуклеотидов 0..3, прочие символы (N, IUPAC) - 255"""
+    return _CODES[np.frombuffer(sequence, dtype=np.uint8)]
+
+
+def sequence_kmers(codes: np.ndarray, k: int) -> np.ndarray:
+    """Различные k-меры последовательности без неоднозначных нуклеотидов, как числа 0..4^k-1"""
+    if len(codes) < k:
+        return np.empty(0, dtype=np.int64)
+    windows = np.lib.stride_tricks.sliding_window_view(codes, k)
+    windows = windows[(windows <= 3).all(axis=1)].astype(np.int64)
+    weights = 4 ** np.arange(k - 1, -1, -1, dtype=np.int64)
+    return np.unique(windows @ weights)
+
+
+def split_lineage(lineage: str, depth: int) -> Tuple[str, ...]:
+    """Уровни таксономии до depth-го (для depth=6 - до рода), пустые уровни отбрасываются"""
+    levels = [level.strip() for level in lineage.split(";")]
+    levels = [level for level in levels if level and not level.endswith("__")]
+    return tuple(levels[:depth])
+
+
+def _open_text(path: str):
+    with open(path, "rb") as f:
+        magic = f.read(2)
+    if magic == GZIP_MAGIC:
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def iter_fasta(path: str) -> Iterator[Tuple[str, bytes]]:
+    """Записи FASTA (обычный или gzip): (идентификатор, последовательность)"""
+    with _open_text(path) as f:
+        name, parts = None, []
+        for line in f:
+            line = line.strip()
+            if line.startswith(b">"):
+                if name is not None:
+                    yield name, b"".join(parts)
+                name, parts = line[1:].split(maxsplit=1)[0].decode("utf-8", "replace"), []
+            elif line:
+                parts.append(line)
+        if name is not None:
+            yield name, b"".join(parts)
+
+
+def read_taxonomy(path: str) -> Dict[str, str]:
+    """TSV с таксономией: идентификатор и линия через ';'; строка заголовка (Feature ID) пропускается"""
+    taxonomy = {}
+    with _open_text(path) as f:
+        for line in f:
+            fields = line.decode("utf-8", "replace").rstrip("\r\n").split("\t")
+            if len(fields) < 2 or fields[0].startswith("#") or fields[0] == "Feature ID":
+                continue
+            taxonomy[fields[0]] = fields[1]
+    return taxonomy
+
+
+def train_index(fasta_path: str, taxonomy_path: str, out_dir: str, name: Optional[str] = None,
+                k: int = TAXONOMY_KMER_SIZE, depth: int = TAXONOMY_DEPTH) -> Dict[str, object]:
+    """
+    Обучение индекса по правилам RDP: для k-мера w и таксона G
+    P(w|G) = (m(w,G) + P(w)) / (M_G + 1), P(w) = (n(w) + 0.5) / (N + 1),
+    где m(w,G) - число последовательностей таксона с k-мером w, M_G - число последовательностей таксона,
+    n(w) и N - то же по всей базе. Матрица пишется сразу в файл на диске, память - O(буфера)
+    """
+    taxonomy = read_taxonomy(taxonomy_path)
+    lineages: Dict[Tuple[str, ...], int] = {}
+    for lineage in taxonomy.values():
+        lineages.setdefault(split_lineage(lineage, depth), len(lineages))
+    lineages.pop((), None)
+    ordered = sorted(lineages)
+    lineages = {lineage: i for i, lineage in enumerate(ordered)}
+    n_taxa = len(ordered)
+    if not n_taxa:
+        raise ValueError("В таксономии нет ни одной линии")
+
+    os.makedirs(out_dir, exist_ok=True)
+    tmp_path = os.path.join(out_dir, LOGP_FILE + ".tmp")
+    matrix = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(4 ** k, n_taxa))
+    flat = matrix.reshape(-1)
+    taxon_sizes = np.zeros(n_taxa, dtype=np.int64)
+    buffer: List[np.ndarray] = []
+    buffered = 0
+    skipped = 0
+
+    def flush():
+        # Пары (k-мер, таксон) повторяются только между последовательностями: суммируем и добавляем разом
+        nonlocal buffered
+        if buffer:
+            cells, counts = np.unique(np.concatenate(buffer), return_counts=True)
+            flat[cells] += counts
+            buffer.clear()
+            buffered = 0
+
+    for seq_id, sequence in iter_fasta(fasta_path):
+        lineage = split_lineage(taxonomy.get(seq_id, ""), depth)
+        taxon = lineages.get(lineage)
+        kmers = sequence_kmers(encode(sequence), k) if taxon is not None else None
+        if kmers is None or not len(kmers):
+            skipped += 1
+            continue
+        taxon_sizes[taxon] += 1
+        buffer.append(kmers * n_taxa + taxon)
+        buffered += len(kmers)
+        if buffered >= _TRAIN_BUFFER:
+            flush()
+    flush()
+
+    n_sequences = int(taxon_sizes.sum())
+    if not n_sequences:
+        raise ValueError("Ни одна последовательность референса не сопоставлена с таксономией")
+    # Счётчики -> логарифмы вероятностей, блоками строк
+    denominator = np.log(taxon_sizes + 1.0).astype(np.float32)
+    block = max(1, _GATHER_BUDGET // n_taxa)
+    for start in range(0, matrix.shape[0], block):
+        rows = matrix[start:start + block]
+        prior = (rows.sum(axis=1, dtype=np.float64) + 0.5) / (n_sequences + 1)
+        rows += prior[:, None].astype(np.float32)
+        np.log(rows, out=rows)
+        rows -= denominator
+    matrix.flush()
+    del matrix, flat
+    os.replace(tmp_path, os.path.join(out_dir, LOGP_FILE))
+
+    meta = {
+        "version": INDEX_VERSION,
+        "name": name or os.path.basename(os.path.normpath(out_dir)),
+        "k": k,
+        "depth": depth,
+        "sequences": n_sequences,
+        "skipped_sequences": skipped,
+        "lineages": ["; ".join(lineage) for lineage in ordered],
+        "taxon_sizes": taxon_sizes.tolist(),
+    }
+    with open(os.path.join(out_dir, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    return meta
+
+
+@dataclass
+class TaxonomyResult:
+    """
+    Классификация набора последовательностей. taxon - номер лучшей линии индекса (-1 - нет k-меров),
+    depth - число уровней, прошедших порог достоверности, confidence - достоверность по уровням
+    """
+    lineages: List[str]
+    taxon: np.ndarray
+    depth: np.ndarray
+    confidence: np.ndarray
+    stats: Dict[str, float] = field(default_factory=dict)
+
+    def __len__(self) -> int:
+        return len(self.taxon)
+
+    def lineage(self, i: int) -> str:
+        """Линия, обрезанная до последнего достоверного уровня"""
+        if self.taxon[i] < 0 or self.depth[i] == 0:
+            return UNASSIGNED
+        return "; ".join(self.lineages[self.taxon[i]].split("; ")[:self.depth[i]])
+
+    def assigned_confidence(self, i: int) -> float:
+        if self.taxon[i] < 0 or self.depth[i] == 0:
+            return 0.0
+        return float(self.confidence[i, self.depth[i] - 1])
+
+    def abundance_table(self, weights: Sequence[int], top: Optional[int] = None) -> List[Tuple[str, int]]:
+        """Суммарная численность по назначенным линиям, по убыванию"""
+        totals: Dict[str, int] = {}
+        for i, weight in enumerate(weights):
+            lineage = self.lineage(i)
+            totals[lineage] = totals.get(lineage, 0) + int(weight)
+        table = sorted(totals.items(), key=lambda item: (-item[1], item[0]))
+        return table[:top] if top else table
+
+
+class TaxonomyIndex:
+    """
+    Обученный индекс: матрица логарифмов вероятностей отображена в память только для чтения.
+    Страницы файла лежат в страничном кэше ОС и общие для всех процессов, отобразивших тот же файл
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, META_FILE), encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != INDEX_VERSION:
+            raise ValueError(f"Неподдерживаемая версия индекса {meta.get('version')} в {path}")
+        self.meta = meta
+        self.name: str = meta["name"]
+        self.k: int = meta["k"]
+        self.lineages: List[str] = meta["lineages"]
+        self.logp_path = os.path.realpath(os.path.join(path, LOGP_FILE))
+        self._mmap, self.logp = _map_npy(self.logp_path)
+        if self.logp.shape != (4 ** self.k, len(self.lineages)):
+            self.close()
+            raise ValueError(f"Размер матрицы индекса {path} не совпадает с описанием")
+        # Номер префикса линии на каждом уровне: совпадение номеров = совпадение линий до этого уровня
+        depth = meta["depth"]
+        self.rank_ids = np.full((len(self.lineages), depth), -1, dtype=np.int64)
+        prefixes: Dict[Tuple[str, ...], int] = {}
+        for t, lineage in enumerate(self.lineages):
+            levels = lineage.split("; ")
+            for r in range(len(levels)):
+                self.rank_ids[t, r] = prefixes.setdefault(tuple(levels[:r + 1]), len(prefixes))
+
+    @property
+    def n_taxa(self) -> int:
+        return len(self.lineages)
+
+    @property
+    def mapped_bytes(self) -> int:
+        return len(self._mmap) if self._mmap is not None else 0
+
+    def prefetch(self):
+        """Читает по байту с каждой страницы: файл попадает в страничный кэш и в RSS процесса"""
+        if hasattr(mmap, "MADV_WILLNEED"):
+            self._mmap.madvise(mmap.MADV_WILLNEED)
+        np.frombuffer(self._mmap, dtype=np.uint8)[::mmap.PAGESIZE].sum()
+
+    def close(self):
+        """Снимает отображение; массивы, ещё используемые классификацией, держат его до освобождения"""
+        self.logp = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # На отображение ссылаются живые массивы - оно закроется вместе с ними
+                pass
+            self._mmap = None
+
+
+def _map_npy(path: str) -> Tuple[mmap.mmap, np.ndarray]:
+    """Файл .npy как массив только для чтения поверх mmap (без копирования в память процесса)"""
+    with open(path, "rb") as f:
+        version = np.lib.format.read_magic(f)
+        read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+        shape, fortran_order, dtype = read_header(f)
+        offset = f.tell()
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    order = "F" if fortran_order else "C"
+    return mapping, np.ndarray(shape, dtype=dtype, buffer=mapping, offset=offset, order=order)
+
+
+class NaiveBayesClassifier:
+    """
+    Классификация пачками: строки матрицы для k-меров всех запросов пачки читаются одним
+    индексированием и суммируются по запросам одной векторной операцией. Бутстрэп как в RDP:
+    bootstraps раз выбирается len(k-меров) / k k-меров с возвращением, достоверность уровня -
+    доля повторов, где лучшая линия совпадает с основной до этого уровня
+    """
+
+    def __init__(self, index: TaxonomyIndex, confidence: float = TAXONOMY_CONFIDENCE,
+                 bootstraps: int = TAXONOMY_BOOTSTRAPS, seed: int = 0):
+        self.index = index
+        self.threshold = confidence
+        self.bootstraps = bootstraps
+        self.seed = seed
+
+    def _batches(self, sizes: np.ndarray) -> Iterator[Tuple[int, int]]:
+        """Границы пачек так, чтобы собранный блок строк (с учётом бутстрэпа) укладывался в бюджет"""
+        per_row = self.index.n_taxa
+        cost = sizes.max(initial=0) + self.bootstraps * np.maximum(sizes // self.index.k, 1)
+        start, used = 0, 0
+        for i, c in enumerate((cost * per_row).tolist()):
+            if i > start and used + c > _GATHER_BUDGET:
+                yield start, i
+                start, used = i, 0
+            used += c
+        if start < len(sizes):
+            yield start, len(sizes)
+
+    def _classify_batch(self, kmers: List[np.ndarray], rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray]:
+        sizes = np.array([len(x) for x in kmers], dtype=np.int64)
+        # Строки матрицы в порядке возрастания k-меров - последовательное чтение из отображённого файла;
+        # последняя строка нулевая - заполнитель для запросов короче самого длинного в пачке
+        unique, inverse = np.unique(np.concatenate(kmers), return_inverse=True)
+        rows = np.zeros((len(unique) + 1, self.index.n_taxa), dtype=np.float32)
+        rows[:-1] = self.index.logp[unique]
+        slots = np.full((len(kmers), int(sizes.max())), len(unique), dtype=np.int64)
+        slots[np.arange(slots.shape[1]) < sizes[:, None]] = inverse
+        # Суммы по оси блока (а не reduceat по сегментам) - в несколько раз быстрее
+        best = rows[slots].sum(axis=1).argmax(axis=1)
+
+        n_rank = self.index.rank_ids.shape[1]
+        if not self.bootstraps:
+            return best, np.ones((len(kmers), n_rank))
+        # Бутстрэп: для запроса q и каждого повтора - s_q случайных строк запроса;
+        # запросы с одинаковым s_q обрабатываются одним блоком (q, повтор, s_q, таксон)
+        subset = np.maximum(sizes // self.index.k, 1)
+        winners = np.empty((len(kmers), self.bootstraps), dtype=np.int64)
+        for s in np.unique(subset).tolist():
+            group = np.flatnonzero(subset == s)
+            local = (rng.random((len(group), self.bootstraps, s)) * sizes[group, None, None]).astype(np.int64)
+            picks = slots[group[:, None, None], local]
+            winners[group] = rows[picks].sum(axis=2).argmax(axis=2)
+        rank_ids = self.index.rank_ids
+        agree = rank_ids[winners] == rank_ids[best][:, None, :]
+        return best, agree.mean(axis=1)
+
+    def classify(self, sequences: Sequence[np.ndarray]) -> TaxonomyResult:
+        """sequences - коды нуклеотидов (0..3, прочие - 255), например DerepResult.codes(i)"""
+        k = self.index.k
+        n = len(sequences)
+        n_rank = self.index.rank_ids.shape[1]
+        taxon = np.full(n, -1, dtype=np.int64)
+        confidence = np.zeros((n, n_rank))
+        kmers = [sequence_kmers(codes, k) for codes in sequences]
+        sizes = np.array([len(x) for x in kmers], dtype=np.int64)
+        present = np.flatnonzero(sizes > 0)
+        rng = np.random.default_rng(self.seed)
+        for start, stop in self._batches(sizes[present]):
+            ids = present[start:stop]
+            best, conf = self._classify_batch([kmers[i] for i in ids.tolist()], rng)
+            taxon[ids] = best
+            confidence[ids] = conf
+
+        # Достоверность не растёт с глубиной: назначается самый глубокий уровень выше порога
+        # (уровни за концом линии имеют номер -1 и совпадают всегда - отсекаются по длине линии)
+        lineage_depth = (self.index.rank_ids >= 0).sum(axis=1)
+        depth = (confidence >= self.threshold).sum(axis=1)
+        depth = np.where(taxon >= 0, np.minimum(depth, lineage_depth[np.maximum(taxon, 0)]), 0)
+        assigned = int(np.count_nonzero(depth > 0))
+        return TaxonomyResult(
+            lineages=self.index.lineages,
+            taxon=taxon,
+            depth=depth,
+            confidence=confidence,
+            stats={
+                "reference": self.index.name,
+                "queries": n,
+                "assigned": assigned,
+                "unassigned": n - assigned,
+                "confidence_threshold": self.threshold,
+                "bootstraps": self.bootstraps,
+            },
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Обучение k-мерного индекса таксономии")
+    parser.add_argument("--fasta", required=True, help="Референсные последовательности (FASTA, можно .gz)")
+    parser.add_argument("--taxonomy", required=True, help="TSV: идентификатор<TAB>линия")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--out", help="Каталог индекса")
+    target.add_argument("--reference", help="Имя референса (SILVA, Greengenes): новая версия в TAXONOMY_INDEX_DIR "
+                                            "атомарно заменяет текущую, работающий бот подхватит её сам")
+    parser.add_argument("--name", default=None)
+    parser.add_argument("--k", type=int, default=TAXONOMY_KMER_SIZE)
+    parser.add_argument("--depth", type=int, default=TAXONOMY_DEPTH)
+    args = parser.parse_args()
+    if args.reference:
+        from .references import get_reference_registry
+        registry = get_reference_registry()
+        out = registry.new_version_dir(args.reference)
+        meta = train_index(args.fasta, args.taxonomy, out, name=args.name or args.reference, k=args.k, depth=args.depth)
+        registry.publish(args.reference, out)
+    else:
+        meta = train_index(args.fasta, args.taxonomy, args.out, name=args.name, k=args.k, depth=args.depth)
+    print(f"{meta['name']}: {meta['sequences']} последовательностей, {len(meta['lineages'])} таксонов, "
+          f"пропущено {meta['skipped_sequences']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Процесс выполнения пайплайна одной задачи.
+Запускается ботом как `python -m src.pipeline.worker`, спецификация задачи приходит JSON-ом в stdin,
+события (логи этапов, метрики, результат) пишутся в stdout по одному JSON-объекту в строке
+"""
+import json
+import os
+import resource
+import signal
+import sys
+import time
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from TelegramBot.config import OTU_IDENTITY, TAXONOMY_INDEX_DIR
+
+from .archive import iter_samples, run_qc_samples, sample_name
+from .derep import Dereplicator, DerepResult
+from .otu import OTUResult, cluster_otus
+from .qc import FastqFormatError, QCReport, iter_record_chunks
+from .references import get_reference_registry
+from .taxonomy import NaiveBayesClassifier
+
+# Строк таблицы таксономии в метриках и отчёте
+TAXONOMY_TABLE_ROWS = 20
+
+# Версия пайплайна входит в ключ кэша результатов: увеличивать при изменении этапов или отчёта
+PIPELINE_VERSION = 4
+
+
+def emit(event: str, **payload):
+    sys.stdout.write(json.dumps({"event": event, **payload}, ensure_ascii=False) + "\n")
+    sys.stdout.flush()
+
+
+def log(message: str):
+    emit("log", message=message)
+
+
+def _qc_summary(report: QCReport) -> str:
+    return (
+        f"{report.reads} ридов, средняя длина {report.mean_length:.1f}, "
+        f"GC {report.gc_content * 100:.1f}%, Q30 {report.q30_rate * 100:.1f}%."
+    )
+
+
+def dereplicate_file(path: str, spill_dir: str) -> DerepResult:
+    """Дерепликация всех образцов входного файла вместе"""
+    derep = Dereplicator(spill_dir=spill_dir)
+    for _, stream in iter_samples(path):
+        for chunk in iter_record_chunks(stream):
+            derep.update(chunk)
+    return derep.finish()
+
+
+def classify_features(derep: DerepResult, otu: Optional[OTUResult], reference: str) -> Optional[Dict[str, Any]]:
+    """
+    Таксономия центроид OTU (или всех уникальных последовательностей без OTU-кластеризации)
+    по индексу референса; None, если индекс не обучен
+    """
+    registry = get_reference_registry()
+    index = registry.get(reference)
+    if index is None:
+        return None
+    loaded = registry.stats()[reference]
+    log(f"Индекс {reference} ({loaded['version']}) открыт за {loaded['load_seconds']:.2f} с.")
+    if otu is not None:
+        features, weights = otu.centroids.tolist(), otu.sizes
+    else:
+        features, weights = range(len(derep)), derep.counts
+    result = NaiveBayesClassifier(index).classify([derep.codes(i) for i in features])
+    table = result.abundance_table(weights.tolist())
+    return {
+        **result.stats,
+        "taxa": len(table),
+        "reads": int(sum(reads for _, reads in table)),
+        "table": [[lineage, reads] for lineage, reads in table[:TAXONOMY_TABLE_ROWS]],
+    }
+
+
+def write_features(derep: DerepResult, otu: Optional[OTUResult], path: str):
+    """
+    Таблица признаков задачи для когортного анализа: идентификаторы последовательностей
+    (центроид OTU или уникальных последовательностей) и их численности
+    """
+    if otu is not None:
+        features, counts = otu.centroids, otu.sizes
+    else:
+        features, counts = np.arange(len(derep)), derep.counts
+    np.savez(path, ids=derep.feature_ids(features), counts=counts.astype(np.int64))
+
+
+def limit_memory(limit_mb: int):
+    """Ограничивает адресное пространство процесса; превышение приводит к MemoryError"""
+    if limit_mb > 0:
+        limit = limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def run_pipeline(spec: Dict[str, Any]):
+    """Этапы анализа: контроль качества, дерепликация, кластеризация в OTU, таксономическая аннотация, отчёт"""
+    from ..utils.report_render import render_task_report
+
+    log("Контроль качества: сбор метрик.")
+    file_path = spec.get("file_path")
+    qc = None
+    samples = None
+    derep = None
+    if file_path and os.path.exists(file_path):
+        total, reports = run_qc_samples(
+            file_path,
+            default_name=sample_name(spec.get("filename")),
+            on_sample=lambda name, report: log(f"Образец {name}: {_qc_summary(report)}")
+        )
+        qc = total.to_dict()
+        emit("metrics", stage="qc", values=qc)
+        if len(reports) > 1:
+            # По образцам храним только сводные значения, без гистограмм
+            samples = {name: report.summary() for name, report in reports.items()}
+            emit("metrics", stage="samples", values=samples)
+        elif not reports:
+            raise FastqFormatError("В архиве нет файлов FASTQ")
+        log(f"Контроль качества ({len(reports)} обр.): {_qc_summary(total)}")
+    else:
+        log("Файл с ридами не найден, контроль качества пропущен.")
+
+    if qc is not None:
+        log("Дерепликация ридов.")
+        derep = dereplicate_file(file_path, os.path.join(spec["work_dir"], "derep"))
+        emit("metrics", stage="derep", values=derep.stats)
+        log(
+            f"Дерепликация: {derep.stats['uniques']} уникальных последовательностей "
+            f"из {derep.stats['dereplicated_reads']} ридов, синглтонов {derep.stats['singletons']}, "
+            f"пропущено ридов с N: {derep.stats['ambiguous_reads']}."
+        )
+
+    otu = None
+    clustering = (spec.get("params") or {}).get("clustering")
+    if derep is not None and clustering == "OTU":
+        log(f"Кластеризация в OTU (идентичность {OTU_IDENTITY:.0%}).")
+        otu = cluster_otus(derep)
+        emit("metrics", stage="otu", values=otu.stats)
+        log(
+            f"Кластеризация: {otu.stats['otus']} OTU из {otu.stats['clustered_uniques']} уникальных "
+            f"последовательностей, проверено центроид на последовательность: {otu.stats['checked_per_unique']:.2f}."
+        )
+    else:
+        log("Кластеризация (симуляция).")
+        time.sleep(1)
+    taxonomy = None
+    reference = (spec.get("params") or {}).get("reference")
+    if derep is not None and reference:
+        log(f"Таксономическая аннотация по {reference}.")
+        taxonomy = classify_features(derep, otu, reference)
+        if taxonomy is None:
+            log(f"Индекс {reference} не найден в {TAXONOMY_INDEX_DIR}, аннотация пропущена.")
+        else:
+            emit("metrics", stage="taxonomy", values=taxonomy)
+            log(
+                f"Аннотация: назначено {taxonomy['assigned']} из {taxonomy['queries']} последовательностей, "
+                f"таксонов {taxonomy['taxa']}."
+            )
+    else:
+        log("Аннотация пропущена.")
+
+    data, filename, render_error = render_task_report({
+        **spec, "qc": qc, "samples": samples,
+        "derep": derep.stats if derep else None,
+        "otu": otu.stats if otu else None,
+        "taxonomy": taxonomy,
+    })
+    if render_error:
+        log(f"reportlab not available or failed: {render_error}. Using TXT fallback.")
+    output_path = os.path.join(spec["work_dir"], filename)
+    with open(output_path, "wb") as f:
+        f.write(data)
+    features_path = None
+    if derep is not None:
+        features_path = os.path.join(spec["work_dir"], "features.npz")
+        write_features(derep, otu, features_path)
+    emit("result", path=output_path, filename=filename, features=features_path)
+
+
+def main():
+    # SIGTERM от бота (отмена, таймаут) завершает процесс через SystemExit, а не молча
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(143))
+    spec = json.load(sys.stdin)
+    memory_limit_mb = int(spec.get("memory_limit_mb") or 0)
+    reference = (spec.get("params") or {}).get("reference")
+    if memory_limit_mb and reference:
+        # Отображение индекса референса - общий страничный кэш, а не память задачи, но RLIMIT_AS его учитывает
+        memory_limit_mb += get_reference_registry().index_bytes(reference) // 2 ** 20
+    limit_memory(memory_limit_mb)
+    try:
+        run_pipeline(spec)
+    except MemoryError:
+        emit("error", message=f"Превышен лимит памяти ({spec.get('memory_limit_mb')} МБ)")
+        sys.exit(1)
+    except Exception as e:
+        emit("error", message=f"{type(e).__name__}: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
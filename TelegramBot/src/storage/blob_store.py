@@ -0,0 +1,194 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from io import BytesIO
+from collections import OrderedDict
+from typing import BinaryIO, Optional, Tuple
+
+from TelegramBot.config import BLOB_STORE_DIR, REPORT_CACHE_MAX_BYTES, REPORT_CACHE_MAX_ITEM_BYTES, UPLOAD_STORE_DIR
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class BlobStore:
+    """
+    Контентно-адресуемое хранилище файлов: blob лежит по пути <root>/<sha[:2]>/<sha[2:4]>/<sha>.
+    Небольшие недавно использованные blob'ы держатся в памяти в пределах бюджета
+    """
+
+    def __init__(
+            self,
+            root: str = BLOB_STORE_DIR,
+            cache_max_bytes: int = REPORT_CACHE_MAX_BYTES,
+            cache_max_item_bytes: int = REPORT_CACHE_MAX_ITEM_BYTES
+    ):
+        self.root = root
+        self.cache_max_bytes = cache_max_bytes
+        self.cache_max_item_bytes = min(cache_max_item_bytes, cache_max_bytes)
+        self._tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self._tmp_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[str, bytes]" = OrderedDict()
+        self._cache_bytes = 0
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest: str) -> bool:
+        return os.path.exists(self.path(digest))
+
+    def writer(self) -> "BlobWriter":
+        """Запись blob'а по частям (например, при скачивании файла): commit() возвращает (digest, size)"""
+        return BlobWriter(self)
+
+    def put_stream(self, stream: BinaryIO) -> Tuple[str, int]:
+        """Записывает поток в хранилище, считая SHA-256 по ходу записи. Возвращает (digest, size)"""
+        writer = self.writer()
+        try:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                writer.write(chunk)
+            return writer.commit()
+        except BaseException:
+            writer.abort()
+            raise
+
+    def put_bytes(self, data: bytes) -> Tuple[str, int]:
+        return self.put_stream(BytesIO(data))
+
+    def _commit(self, tmp_path: str, digest: str):
+        final_path = self.path(digest)
+        if os.path.exists(final_path):
+            # Такой blob уже есть - содержимое совпадает по построению
+            os.unlink(tmp_path)
+            return
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(tmp_path, final_path)
+
+    def open(self, digest: str) -> BinaryIO:
+        return open(self.path(digest), "rb")
+
+    def size(self, digest: str) -> int:
+        return os.path.getsize(self.path(digest))
+
+    def get_cached(self, digest: str) -> Optional[bytes]:
+        """
+        Содержимое blob'а из кэша. Небольшие blob'ы при промахе читаются с диска и кэшируются,
+        для больших возвращается None - их нужно отдавать потоком из файла
+        """
+        with self._lock:
+            data = self._cache.get(digest)
+            if data is not None:
+                self._cache.move_to_end(digest)
+                return data
+
+        try:
+            if self.size(digest) > self.cache_max_item_bytes:
+                return None
+            with self.open(digest) as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        self._cache_put(digest, data)
+        return data
+
+    def _cache_put(self, digest: str, data: bytes):
+        if len(data) > self.cache_max_item_bytes:
+            return
+        with self._lock:
+            old = self._cache.pop(digest, None)
+            if old is not None:
+                self._cache_bytes -= len(old)
+            self._cache[digest] = data
+            self._cache_bytes += len(data)
+            while self._cache_bytes > self.cache_max_bytes:
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_bytes -= len(evicted)
+
+    def delete(self, digest: str):
+        with self._lock:
+            data = self._cache.pop(digest, None)
+            if data is not None:
+                self._cache_bytes -= len(data)
+        try:
+            os.unlink(self.path(digest))
+        except FileNotFoundError:
+            pass
+
+
+class BlobWriter:
+    """Файлоподобный объект для записи в BlobStore: данные хэшируются по мере записи во временный файл"""
+
+    def __init__(self, store: BlobStore):
+        self.store = store
+        self.size = 0
+        self._sha = hashlib.sha256()
+        self._head = bytearray()
+        fd, self._tmp_path = tempfile.mkstemp(dir=store._tmp_dir)
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, chunk: bytes) -> int:
+        self._sha.update(chunk)
+        self._file.write(chunk)
+        self.size += len(chunk)
+        if self.size <= self.store.cache_max_item_bytes:
+            self._head += chunk
+        return len(chunk)
+
+    def flush(self):
+        # fsync делается один раз в commit()
+        pass
+
+    def commit(self) -> Tuple[str, int]:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        digest = self._sha.hexdigest()
+        try:
+            self.store._commit(self._tmp_path, digest)
+        except BaseException:
+            self.abort()
+            raise
+        if self.size <= self.store.cache_max_item_bytes:
+            self.store._cache_put(digest, bytes(self._head))
+        return digest, self.size
+
+    def abort(self):
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.unlink(self._tmp_path)
+
+
+# Singleton для удобного использования
+_blob_store_instance: Optional[BlobStore] = None
+
+
+def get_blob_store() -> BlobStore:
+    """Получает экземпляр BlobStore (singleton)"""
+    global _blob_store_instance
+
+    if _blob_store_instance is None:
+        _blob_store_instance = BlobStore()
+
+    return _blob_store_instance
+
+
+_upload_store_instance: Optional[BlobStore] = None
+
+
+def get_upload_store() -> BlobStore:
+    """Хранилище загруженных FASTQ (singleton); файлы большие, поэтому без кэша в памяти"""
+    global _upload_store_instance
+
+    if _upload_store_instance is None:
+        _upload_store_instance = BlobStore(root=UPLOAD_STORE_DIR, cache_max_bytes=0, cache_max_item_bytes=0)
+
+    return _upload_store_instance
@@ -0,0 +1,234 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from TelegramBot.config import (
+    FSM_STORAGE, FSM_DB_PATH, FSM_REDIS_URL, FSM_TTL, FSM_CACHE_SIZE, FSM_WRITE_BATCH_SIZE, FSM_FLUSH_INTERVAL,
+    FSM_PURGE_INTERVAL,
+)
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fsm (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data TEXT,
+    expires_at INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS fsm_expires ON fsm (expires_at);
+"""
+
+# Запись кэша: состояние, данные, момент истечения (секунды, 0 - нет записи)
+_Record = Tuple[Optional[str], Dict[str, Any], float]
+_EMPTY: _Record = (None, {}, 0.0)
+
+
+def default_key_builder() -> KeyBuilder:
+    """Ключи как у RedisStorage с тем же построителем: хранилища взаимозаменяемы"""
+    return DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM-хранилище в SQLite (WAL), общее для нескольких процессов бота на одной машине.
+    - Запись пачками: изменения копятся в памяти и пишутся одной транзакцией по размеру пачки или по таймеру
+      (как в TaskStore); до записи другие процессы видят предыдущее состояние
+    - TTL: каждая запись продлевает диалог на ttl секунд, брошенные диалоги не читаются и удаляются фоном
+    - Кэш чтения: LRU по ключам; при изменениях из другого процесса (PRAGMA data_version) кэш сбрасывается
+    """
+
+    def __init__(
+            self,
+            path: str = FSM_DB_PATH,
+            ttl: int = FSM_TTL,
+            cache_size: int = FSM_CACHE_SIZE,
+            batch_size: int = FSM_WRITE_BATCH_SIZE,
+            flush_interval: float = FSM_FLUSH_INTERVAL,
+            purge_interval: float = FSM_PURGE_INTERVAL,
+            key_builder: Optional[KeyBuilder] = None
+    ):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self.path = path
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.batch_size = batch_size
+        self.purge_interval = purge_interval
+        self.key_builder = key_builder or default_key_builder()
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._data_version = self._read_data_version()
+
+        self._cache: "OrderedDict[str, _Record]" = OrderedDict()
+        self._dirty: Dict[str, _Record] = {}
+        self._last_purge = 0.0
+        self.hits = 0
+        self.misses = 0
+
+        self._closed = threading.Event()
+        self._flusher = None
+        if flush_interval > 0:
+            self._flusher = threading.Thread(
+                target=self._flush_loop, args=(flush_interval,), name="fsm-store-flush", daemon=True
+            )
+            self._flusher.start()
+
+    # ---- кэш ----
+
+    def _read_data_version(self) -> int:
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _check_external_writes(self):
+        """data_version меняется только при коммитах других соединений: тогда чистые записи кэша устарели"""
+        version = self._read_data_version()
+        if version != self._data_version:
+            self._data_version = version
+            self._cache = OrderedDict((key, record) for key, record in self._cache.items() if key in self._dirty)
+
+    def _cache_put(self, key: str, record: _Record):
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            oldest = next(iter(self._cache))
+            if oldest in self._dirty:
+                # Несохранённую запись нельзя выбрасывать из кэша до записи
+                if not self._try_flush():
+                    break
+            self._cache.popitem(last=False)
+
+    def _record(self, key: str) -> _Record:
+        with self._lock:
+            self._check_external_writes()
+            record = self._cache.get(key)
+            if record is not None:
+                self.hits += 1
+                self._cache.move_to_end(key)
+            else:
+                self.misses += 1
+                row = self._conn.execute("SELECT state, data, expires_at FROM fsm WHERE key = ?", (key,)).fetchone()
+                record = (row[0], json.loads(row[1]) if row[1] else {}, row[2]) if row else _EMPTY
+                self._cache_put(key, record)
+        if record[2] and record[2] < time.time():
+            return _EMPTY
+        return record
+
+    def _write(self, key: str, state: Optional[str], data: Dict[str, Any]):
+        with self._lock:
+            expires_at = time.time() + self.ttl if state is not None or data else 0.0
+            record = (state, data, expires_at)
+            self._cache_put(key, record)
+            self._dirty[key] = record
+            if len(self._dirty) >= self.batch_size:
+                self._try_flush()
+
+    def _try_flush(self) -> bool:
+        """Запись по размеру пачки или при вытеснении из кэша: при ошибке (например, база занята другим
+        процессом бота) изменения остаются в памяти до следующей записи, хэндлер не получает исключение"""
+        try:
+            self.flush()
+            return True
+        except sqlite3.Error:
+            return False
+
+    # ---- BaseStorage ----
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = self.key_builder.build(key)
+        _, data, _ = self._record(storage_key)
+        self._write(storage_key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return self._record(self.key_builder.build(key))[0]
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        storage_key = self.key_builder.build(key)
+        state, _, _ = self._record(storage_key)
+        self._write(storage_key, state, dict(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return dict(self._record(self.key_builder.build(key))[1])
+
+    async def close(self) -> None:
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=5)
+        with self._lock:
+            self.flush()
+            self._conn.close()
+
+    # ---- запись ----
+
+    def flush(self):
+        """Записывает накопленные изменения одной транзакцией; пустые диалоги удаляются"""
+        with self._lock:
+            if not self._dirty:
+                return
+            upserts = [(key, state, json.dumps(data, ensure_ascii=False, default=str) if data else None, int(expires))
+                       for key, (state, data, expires) in self._dirty.items() if expires]
+            deletes = [(key,) for key, (_, _, expires) in self._dirty.items() if not expires]
+            try:
+                self._conn.execute("BEGIN")
+                if upserts:
+                    self._conn.executemany(
+                        "INSERT INTO fsm (key, state, data, expires_at) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data, "
+                        "expires_at = excluded.expires_at", upserts
+                    )
+                if deletes:
+                    self._conn.executemany("DELETE FROM fsm WHERE key = ?", deletes)
+                self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                logger.exception("Не удалось записать состояния FSM")
+                raise
+            self._dirty = {}
+
+    def purge_expired(self) -> int:
+        """Удаляет брошенные диалоги с истёкшим TTL"""
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM fsm WHERE expires_at < ?", (int(time.time()),))
+            self._last_purge = time.monotonic()
+            return cursor.rowcount
+
+    def _flush_loop(self, interval: float):
+        while not self._closed.wait(interval):
+            try:
+                self.flush()
+                if time.monotonic() - self._last_purge >= self.purge_interval:
+                    removed = self.purge_expired()
+                    if removed:
+                        logger.info(f"Удалено истёкших диалогов FSM: {removed}")
+            except Exception:
+                logger.exception("Ошибка фоновой записи FSM")
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "cached": len(self._cache), "pending": len(self._dirty)}
+
+
+def make_fsm_storage(kind: str = FSM_STORAGE) -> BaseStorage:
+    """FSM-хранилище по настройке FSM_STORAGE: sqlite, redis (пакет redis) или memory (только один процесс)"""
+    if kind == "redis":
+        from aiogram.fsm.storage.redis import RedisStorage
+
+        return RedisStorage.from_url(FSM_REDIS_URL, key_builder=default_key_builder(),
+                                     state_ttl=FSM_TTL, data_ttl=FSM_TTL)
+    if kind == "memory":
+        return MemoryStorage()
+    return SQLiteStorage()
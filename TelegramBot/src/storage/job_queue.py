@@ -0,0 +1,431 @@
+import heapq
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional, Tuple
+
+from TelegramBot.config import (
+    JOB_QUEUE_PATH, JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS, JOB_DEFAULT_SECONDS, JOB_HEARTBEAT_INTERVAL,
+)
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_LOW = -10
+PRIORITY_NORMAL = 0
+
+# Сколько завершённых заданий хранить для оценки длительности
+_FINISHED_KEEP = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    task_id TEXT PRIMARY KEY,
+    owner_id TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    worker_id TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    enqueued_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_queued ON jobs (state, priority DESC, seq);
+CREATE TABLE IF NOT EXISTS job_owners (
+    owner_id TEXT PRIMARY KEY,
+    last_leased REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS workers (
+    worker_id TEXT PRIMARY KEY,
+    concurrency INTEGER NOT NULL,
+    seen_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS notifications (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS progress (
+    task_id TEXT PRIMARY KEY,
+    chat_id INTEGER,
+    message_id INTEGER,
+    text TEXT,
+    version INTEGER NOT NULL DEFAULT 0,
+    sent_version INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+# Состояния задания
+QUEUED = "queued"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+CANCELED = "canceled"
+
+
+@dataclass
+class Job:
+    task_id: str
+    owner_id: str
+    priority: int
+    attempts: int
+
+
+class JobQueue:
+    """
+    Очередь анализов в SQLite (WAL), общая для бота и процессов-воркеров, в том числе после перезапуска.
+    - Бот ставит задания (enqueue), воркеры берут их в аренду (lease) и продлевают её heartbeat'ами.
+      Аренда, не продлённая за lease_seconds (воркер упал), возвращает задание в очередь;
+      после max_attempts таких попыток задание считается проваленным
+    - Порядок выдачи как у прежнего планировщика: выше приоритет, среди владельцев - дольше всех
+      не получавший задание (round-robin по пользователям), затем раньше поставленное
+    - Уведомления пользователям воркеры пишут в таблицу notifications, бот отправляет их и удаляет (outbox)
+    - Ход анализа: у задачи есть сообщение бота (progress), воркер записывает в него последний этап,
+      бот редактирует сообщение; version растёт с каждым этапом, sent_version - что уже показано
+    - PRAGMA data_version меняется при коммитах других соединений: по нему бот и воркеры
+      узнают о новых заданиях и уведомлениях, не выполняя запросы впустую
+    """
+
+    def __init__(self, path: str = JOB_QUEUE_PATH, lease_seconds: float = JOB_LEASE_SECONDS,
+                 max_attempts: int = JOB_MAX_ATTEMPTS, default_job_seconds: float = JOB_DEFAULT_SECONDS):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.default_job_seconds = default_job_seconds
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def _transaction(self, fn, *args):
+        """fn(*args) в транзакции BEGIN IMMEDIATE: выбор и захват задания не пересекаются с другими процессами"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(*args)
+                self._conn.execute("COMMIT")
+                return result
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def data_version(self) -> int:
+        with self._lock:
+            return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    # ---- бот ----
+
+    def enqueue(self, task_id: str, owner_id: str, priority: int = PRIORITY_NORMAL):
+        def insert():
+            seq = self._conn.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM jobs").fetchone()[0]
+            self._conn.execute(
+                "INSERT INTO jobs (task_id, owner_id, priority, seq, state, enqueued_at) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(task_id) DO UPDATE SET state = excluded.state, seq = excluded.seq, worker_id = NULL, "
+                "attempts = 0, enqueued_at = excluded.enqueued_at",
+                (task_id, owner_id, priority, seq, QUEUED, time.time())
+            )
+        self._transaction(insert)
+
+    def cancel(self, task_id: str) -> Optional[str]:
+        """Отменяет ожидающее или выполняющееся задание; воркер заметит отмену и остановит анализ.
+        Возвращает прежнее состояние (None - задания нет или оно уже завершено)"""
+        def update():
+            row = self._conn.execute("SELECT state FROM jobs WHERE task_id = ?", (task_id,)).fetchone()
+            if row is None or row[0] not in (QUEUED, LEASED):
+                return None
+            self._conn.execute("UPDATE jobs SET state = ?, finished_at = ? WHERE task_id = ?",
+                               (CANCELED, time.time(), task_id))
+            return row[0]
+        return self._transaction(update)
+
+    def state(self, task_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT state FROM jobs WHERE task_id = ?", (task_id,)).fetchone()
+            return row[0] if row else None
+
+    def states(self, task_ids: List[str]) -> Dict[str, str]:
+        with self._lock:
+            found: Dict[str, str] = {}
+            for start in range(0, len(task_ids), 500):
+                chunk = task_ids[start:start + 500]
+                found.update(self._conn.execute(
+                    f"SELECT task_id, state FROM jobs WHERE task_id IN ({', '.join('?' for _ in chunk)})", chunk
+                ).fetchall())
+            return found
+
+    def queued_count(self, owner_id: str) -> int:
+        """Сколько заданий владельца ждут в очереди"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE owner_id = ? AND state = ?", (owner_id, QUEUED)
+            ).fetchone()[0]
+
+    def is_active(self, task_id: str) -> bool:
+        return self.state(task_id) in (QUEUED, LEASED)
+
+    # ---- воркеры ----
+
+    def lease(self, worker_id: str) -> Optional[Job]:
+        """Берёт следующее задание в аренду на lease_seconds"""
+        def take():
+            now = time.time()
+            row = self._conn.execute(
+                "SELECT j.task_id, j.owner_id, j.priority, j.attempts FROM jobs j "
+                "LEFT JOIN job_owners o ON o.owner_id = j.owner_id "
+                "WHERE j.state = ? ORDER BY j.priority DESC, COALESCE(o.last_leased, 0), j.seq LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if row is None:
+                return None
+            job = Job(task_id=row[0], owner_id=row[1], priority=row[2], attempts=row[3] + 1)
+            self._conn.execute(
+                "UPDATE jobs SET state = ?, worker_id = ?, lease_expires = ?, attempts = ?, started_at = ? "
+                "WHERE task_id = ?", (LEASED, worker_id, now + self.lease_seconds, job.attempts, now, job.task_id)
+            )
+            self._conn.execute(
+                "INSERT INTO job_owners (owner_id, last_leased) VALUES (?, ?) "
+                "ON CONFLICT(owner_id) DO UPDATE SET last_leased = excluded.last_leased", (job.owner_id, now)
+            )
+            return job
+        return self._transaction(take)
+
+    def reclaim_expired(self) -> List[str]:
+        """
+        Возвращает в очередь задания с истёкшей арендой; задания, исчерпавшие max_attempts,
+        помечаются проваленными - их id возвращаются, чтобы воркер обновил статус задачи и уведомил владельца
+        """
+        def reclaim():
+            now = time.time()
+            expired = self._conn.execute(
+                "SELECT task_id, attempts FROM jobs WHERE state = ? AND lease_expires < ?", (LEASED, now)
+            ).fetchall()
+            abandoned = []
+            for task_id, attempts in expired:
+                if attempts >= self.max_attempts:
+                    self._conn.execute("UPDATE jobs SET state = ?, worker_id = NULL, finished_at = ? WHERE task_id = ?",
+                                       (FAILED, now, task_id))
+                    abandoned.append(task_id)
+                else:
+                    self._conn.execute("UPDATE jobs SET state = ?, worker_id = NULL WHERE task_id = ?",
+                                       (QUEUED, task_id))
+            if expired:
+                logger.warning(f"Аренда истекла у заданий: {len(expired)}, провалено: {len(abandoned)}")
+            return abandoned
+        return self._transaction(reclaim)
+
+    def heartbeat(self, worker_id: str, task_ids: List[str], concurrency: int) -> List[str]:
+        """Продлевает аренду заданий воркера; возвращает те, что он больше не держит (отменены или перехвачены)"""
+        def extend():
+            now = time.time()
+            self._conn.execute(
+                "INSERT INTO workers (worker_id, concurrency, seen_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(worker_id) DO UPDATE SET concurrency = excluded.concurrency, seen_at = excluded.seen_at",
+                (worker_id, concurrency, now)
+            )
+            lost = []
+            for task_id in task_ids:
+                cursor = self._conn.execute(
+                    "UPDATE jobs SET lease_expires = ? WHERE task_id = ? AND worker_id = ? AND state = ?",
+                    (now + self.lease_seconds, task_id, worker_id, LEASED)
+                )
+                if cursor.rowcount != 1:
+                    lost.append(task_id)
+            return lost
+        return self._transaction(extend)
+
+    def finish(self, task_id: str, worker_id: str, state: str = DONE):
+        def update():
+            self._conn.execute(
+                "UPDATE jobs SET state = ?, finished_at = ? WHERE task_id = ? AND worker_id = ? AND state = ?",
+                (state, time.time(), task_id, worker_id, LEASED)
+            )
+            self._conn.execute(
+                "DELETE FROM jobs WHERE state IN (?, ?, ?) AND task_id NOT IN "
+                "(SELECT task_id FROM jobs WHERE state IN (?, ?, ?) ORDER BY finished_at DESC LIMIT ?)",
+                (DONE, FAILED, CANCELED, DONE, FAILED, CANCELED, _FINISHED_KEEP)
+            )
+            # Этапы задач без сообщения о ходе анализа больше никто не покажет
+            self._conn.execute("DELETE FROM progress WHERE task_id = ? AND message_id IS NULL", (task_id,))
+        self._transaction(update)
+
+    def release(self, task_id: str, worker_id: str):
+        """Возвращает задание в очередь без учёта попытки (воркер останавливается штатно)"""
+        def update():
+            self._conn.execute(
+                "UPDATE jobs SET state = ?, worker_id = NULL, attempts = MAX(attempts - 1, 0) "
+                "WHERE task_id = ? AND worker_id = ? AND state = ?", (QUEUED, task_id, worker_id, LEASED)
+            )
+        self._transaction(update)
+
+    def unregister_worker(self, worker_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM workers WHERE worker_id = ?", (worker_id,))
+
+    # ---- уведомления (outbox) ----
+
+    def notify(self, chat_id: int, text: str):
+        with self._lock:
+            self._conn.execute("INSERT INTO notifications (chat_id, text, created_at) VALUES (?, ?, ?)",
+                               (chat_id, text, time.time()))
+
+    def pending_notifications(self, limit: int = 100) -> List[Tuple[int, int, str]]:
+        """(id, chat_id, text) неотправленных уведомлений в порядке создания"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, chat_id, text FROM notifications ORDER BY id LIMIT ?", (limit,)
+            ).fetchall()
+
+    def ack_notifications(self, ids: List[int]):
+        with self._lock:
+            self._conn.executemany("DELETE FROM notifications WHERE id = ?", [(i,) for i in ids])
+
+    # ---- сообщения о ходе анализа ----
+
+    def track_progress(self, task_id: str, chat_id: int, message_id: int):
+        """Сообщение бота, которое показывает ход анализа задачи"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO progress (task_id, chat_id, message_id) VALUES (?, ?, ?) "
+                "ON CONFLICT(task_id) DO UPDATE SET chat_id = excluded.chat_id, message_id = excluded.message_id",
+                (task_id, chat_id, message_id)
+            )
+
+    def report_progress(self, task_id: str, text: str):
+        """
+        Новый этап выполняющегося задания. Сообщение может появиться и позже - тогда в нём сразу будет
+        последний этап; для завершённых и отменённых заданий этапы не записываются
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO progress (task_id, text, version) SELECT ?, ?, 1 "
+                "WHERE EXISTS (SELECT 1 FROM jobs WHERE task_id = ? AND state = ?) "
+                "ON CONFLICT(task_id) DO UPDATE SET text = excluded.text, version = version + 1",
+                (task_id, text, task_id, LEASED)
+            )
+
+    def pending_progress(self) -> List[Tuple[str, int, int, Optional[str], int, Optional[str]]]:
+        """
+        (task_id, chat_id, message_id, текст этапа, version, состояние задания) для сообщений,
+        которые нужно отредактировать: есть непоказанный этап или задание завершилось (последняя правка)
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT p.task_id, p.chat_id, p.message_id, p.text, p.version, j.state FROM progress p "
+                "LEFT JOIN jobs j ON j.task_id = p.task_id WHERE p.message_id IS NOT NULL "
+                "AND (p.version > p.sent_version OR j.state IS NULL OR j.state NOT IN (?, ?)) ORDER BY p.rowid",
+                (QUEUED, LEASED)
+            ).fetchall()
+
+    def ack_progress(self, task_id: str, version: int, final: bool = False):
+        """Этап version показан; после последней правки сообщение больше не отслеживается"""
+        with self._lock:
+            if final:
+                self._conn.execute("DELETE FROM progress WHERE task_id = ? AND version <= ?", (task_id, version))
+            else:
+                self._conn.execute("UPDATE progress SET sent_version = MAX(sent_version, ?) WHERE task_id = ?",
+                                   (version, task_id))
+
+    # ---- позиция и ETA ----
+
+    def position(self, task_id: str) -> Optional[int]:
+        """Сколько заданий будет выдано раньше данного (0 - следующее), None - задание не в очереди"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT j.task_id, j.owner_id, j.priority, j.seq, COALESCE(o.last_leased, 0) FROM jobs j "
+                "LEFT JOIN job_owners o ON o.owner_id = j.owner_id WHERE j.state = ?", (QUEUED,)
+            ).fetchall()
+        if task_id not in {row[0] for row in rows}:
+            return None
+        # Прогоняем порядок выдачи: очереди владельцев, владельцы - по давности последней выдачи
+        queues: Dict[str, List[Tuple[int, int, str]]] = {}
+        last: Dict[str, float] = {}
+        for tid, owner, priority, seq, last_leased in rows:
+            queues.setdefault(owner, []).append((-priority, seq, tid))
+            last[owner] = last_leased
+        for queue in queues.values():
+            heapq.heapify(queue)
+        rr: Deque[str] = deque(sorted(queues, key=lambda owner: last[owner]))
+        position = 0
+        while rr:
+            best = min(queues[owner][0][0] for owner in rr)
+            owner = next(owner for owner in rr if queues[owner][0][0] == best)
+            _, _, tid = heapq.heappop(queues[owner])
+            if tid == task_id:
+                return position
+            rr.remove(owner)
+            if queues[owner]:
+                rr.append(owner)
+            position += 1
+        return None
+
+    def queue_position(self, task_id: str) -> Optional[Tuple[int, float]]:
+        """
+        (позиция, оценка ожидания в секундах) одним чтением: воркер другого процесса может взять задание
+        между отдельными запросами. None - задание не в очереди
+        """
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                position = self.position(task_id)
+                return None if position is None else (position, self.eta_seconds(position))
+            finally:
+                self._conn.execute("COMMIT")
+
+    def eta_seconds(self, position: int) -> float:
+        """Оценка времени до запуска задания на позиции position: средняя длительность недавних заданий
+        и число слотов живых воркеров"""
+        now = time.time()
+        with self._lock:
+            avg = self._conn.execute(
+                "SELECT AVG(finished_at - started_at) FROM (SELECT finished_at, started_at FROM jobs "
+                "WHERE state = ? ORDER BY finished_at DESC LIMIT 20)", (DONE,)
+            ).fetchone()[0] or self.default_job_seconds
+            capacity = self._conn.execute(
+                "SELECT COALESCE(SUM(concurrency), 0) FROM workers WHERE seen_at > ?",
+                (now - 3 * JOB_HEARTBEAT_INTERVAL,)
+            ).fetchone()[0]
+            started = [row[0] for row in self._conn.execute(
+                "SELECT started_at FROM jobs WHERE state = ?", (LEASED,)
+            )]
+        # Освобождение слотов: выполняющиеся задания закончатся примерно через avg - elapsed
+        free_at = sorted(max(0.0, avg - (now - s)) for s in started)
+        free_at += [0.0] * max(0, max(capacity, 1) - len(free_at))
+        heapq.heapify(free_at)
+        start = 0.0
+        for _ in range(position + 1):
+            start = heapq.heappop(free_at)
+            heapq.heappush(free_at, start + avg)
+        return start
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+            counts["notifications"] = self._conn.execute("SELECT COUNT(*) FROM notifications").fetchone()[0]
+            counts["progress"] = self._conn.execute("SELECT COUNT(*) FROM progress").fetchone()[0]
+            return counts
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# Singleton для удобного использования
+_job_queue_instance: Optional[JobQueue] = None
+
+
+def get_job_queue() -> JobQueue:
+    """Получает экземпляр JobQueue (singleton). Воркеры и рассылка уведомлений открывают свои экземпляры:
+    data_version не меняется от коммитов собственного соединения"""
+    global _job_queue_instance
+
+    if _job_queue_instance is None:
+        _job_queue_instance = JobQueue()
+
+    return _job_queue_instance
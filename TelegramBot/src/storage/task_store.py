@@ -0,0 +1,531 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from TelegramBot.config import TASK_DB_PATH, TASK_CACHE_SIZE, TASK_WRITE_BATCH_SIZE, TASK_FLUSH_INTERVAL
+from ..task_manage import TaskMetadata, TaskResult, TaskStatus, INDEXED_PARAMS, to_micros, from_micros
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id TEXT PRIMARY KEY,
+    owner_id TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    params TEXT NOT NULL,
+    instrument TEXT,
+    reference TEXT,
+    clustering TEXT,
+    status TEXT NOT NULL,
+    created_at INTEGER NOT NULL,
+    started_at INTEGER,
+    finished_at INTEGER,
+    file_path TEXT,
+    result_filename TEXT,
+    result_digest TEXT,
+    result_size INTEGER,
+    metrics TEXT
+);
+-- Вторичные индексы упорядочены по (created_at, id): выборка страницы - это проход по диапазону индекса
+DROP INDEX IF EXISTS idx_tasks_owner_created;
+DROP INDEX IF EXISTS idx_tasks_owner_instrument;
+DROP INDEX IF EXISTS idx_tasks_owner_reference;
+DROP INDEX IF EXISTS idx_tasks_owner_clustering;
+CREATE INDEX IF NOT EXISTS idx_tasks_owner_page ON tasks (owner_id, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_tasks_owner_status_page ON tasks (owner_id, status, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_tasks_owner_instrument_page ON tasks (owner_id, instrument, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_tasks_owner_reference_page ON tasks (owner_id, reference, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_tasks_owner_clustering_page ON tasks (owner_id, clustering, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status);
+CREATE INDEX IF NOT EXISTS idx_tasks_created ON tasks (created_at);
+
+-- file_id, которые Telegram вернул при первой отправке файла (ключ - digest отчёта или когорты)
+CREATE TABLE IF NOT EXISTS telegram_files (
+    key TEXT PRIMARY KEY,
+    file_id TEXT NOT NULL
+) WITHOUT ROWID;
+
+-- Загруженные файлы (по SHA-256), ссылки задач на них и file_unique_id Telegram -> digest
+CREATE TABLE IF NOT EXISTS uploads (
+    digest TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    last_used INTEGER NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS upload_refs (
+    task_id TEXT PRIMARY KEY,
+    digest TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_upload_refs_digest ON upload_refs (digest);
+
+CREATE TABLE IF NOT EXISTS telegram_uploads (
+    file_unique_id TEXT PRIMARY KEY,
+    digest TEXT NOT NULL
+) WITHOUT ROWID;
+
+-- Кэш результатов: ключ - digest входного файла + параметры + версия пайплайна
+CREATE TABLE IF NOT EXISTS result_memo (
+    key TEXT PRIMARY KEY,
+    source_task_id TEXT NOT NULL,
+    result_digest TEXT NOT NULL,
+    result_filename TEXT NOT NULL,
+    result_size INTEGER NOT NULL,
+    metrics TEXT,
+    last_used INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_result_memo_last_used ON result_memo (last_used);
+
+CREATE TABLE IF NOT EXISTS task_logs (
+    task_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    message TEXT NOT NULL,
+    PRIMARY KEY (task_id, seq)
+) WITHOUT ROWID;
+"""
+
+_TASK_COLUMNS = (
+    "id", "owner_id", "filename", "params", "instrument", "reference", "clustering", "status",
+    "created_at", "started_at", "finished_at", "file_path", "result_filename", "result_digest",
+    "result_size", "metrics"
+)
+
+_UPSERT_SQL = (
+    f"INSERT INTO tasks ({', '.join(_TASK_COLUMNS)}) VALUES ({', '.join('?' for _ in _TASK_COLUMNS)}) "
+    f"ON CONFLICT(id) DO UPDATE SET "
+    + ", ".join(f"{c} = excluded.{c}" for c in _TASK_COLUMNS if c != "id")
+)
+
+# Номер строки лога выдаёт SQLite в момент записи: бот и воркеры дописывают лог одной задачи независимо
+_APPEND_LOG_SQL = (
+    "INSERT INTO task_logs (task_id, seq, message) "
+    "SELECT ?, COALESCE(MAX(seq), -1) + 1, ? FROM task_logs WHERE task_id = ?"
+)
+
+_FINAL_STATUSES = tuple(s.value for s in (TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELED))
+
+
+class TaskStore:
+    """
+    Хранилище задач в SQLite (WAL) с write-through кэшем горячих задач.
+    Изменения копятся в памяти и записываются пачками: по размеру пачки или по таймеру.
+    Задачу меняют бот и воркеры в разных процессах, поэтому у существующей задачи записываются
+    только изменённые столбцы (update), а завершённый статус другой процесс не перезапишет
+    """
+
+    # Группы столбцов для update
+    STATUS_COLUMNS = ("status", "started_at", "finished_at")
+    RESULT_COLUMNS = ("result_filename", "result_digest", "result_size")
+    METRICS_COLUMNS = ("metrics",)
+
+    def __init__(
+            self,
+            path: str = TASK_DB_PATH,
+            cache_size: int = TASK_CACHE_SIZE,
+            batch_size: int = TASK_WRITE_BATCH_SIZE,
+            flush_interval: float = TASK_FLUSH_INTERVAL
+    ):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self.path = path
+        self.cache_size = cache_size
+        self.batch_size = batch_size
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+        self._cache: "OrderedDict[str, TaskMetadata]" = OrderedDict()
+        self._dirty: Dict[str, TaskMetadata] = {}
+        # Изменённые столбцы задачи; None - задача новая, пишется целиком
+        self._dirty_columns: Dict[str, Optional[Set[str]]] = {}
+        self._pending_logs: List[Tuple[str, str]] = []
+        self._data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+        self._closed = threading.Event()
+        self._flusher = None
+        if flush_interval > 0:
+            self._flusher = threading.Thread(
+                target=self._flush_loop, args=(flush_interval,), name="task-store-flush", daemon=True
+            )
+            self._flusher.start()
+
+    # ---- кэш ----
+
+    def _check_external_writes(self):
+        """
+        Задачи меняют и бот, и процессы-воркеры. data_version меняется при коммитах других соединений:
+        тогда закэшированные задачи (кроме ещё не записанных своих) могли устареть
+        """
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if version != self._data_version:
+            self._data_version = version
+            pending = {log[0] for log in self._pending_logs}
+            self._cache = OrderedDict(
+                (task_id, meta) for task_id, meta in self._cache.items() if task_id in self._dirty or task_id in pending
+            )
+
+    def _cache_put(self, meta: TaskMetadata):
+        self._cache[meta.id] = meta
+        self._cache.move_to_end(meta.id)
+        while len(self._cache) > self.cache_size:
+            oldest_id = next(iter(self._cache))
+            if oldest_id in self._dirty or any(log[0] == oldest_id for log in self._pending_logs):
+                # Несохранённую задачу нельзя выбрасывать из кэша до записи
+                if not self._try_flush():
+                    break
+            self._cache.popitem(last=False)
+
+    # ---- запись ----
+
+    def put(self, meta: TaskMetadata):
+        """Сохраняет новую задачу целиком"""
+        with self._lock:
+            self._cache_put(meta)
+            self._dirty[meta.id] = meta
+            self._dirty_columns[meta.id] = None
+            self._maybe_flush()
+
+    def update(self, meta: TaskMetadata, columns: Iterable[str]):
+        """Сохраняет изменённые столбцы задачи (например, STATUS_COLUMNS); остальные не перезаписываются"""
+        with self._lock:
+            self._cache_put(meta)
+            self._dirty[meta.id] = meta
+            dirty = self._dirty_columns.setdefault(meta.id, set())
+            # Новая задача (None) и так будет записана целиком
+            if dirty is not None:
+                dirty.update(columns)
+            self._maybe_flush()
+
+    def append_log(self, meta: TaskMetadata, message: str):
+        """Добавляет строку в лог задачи"""
+        with self._lock:
+            meta.log.append(message)
+            self._pending_logs.append((meta.id, message))
+            self._maybe_flush()
+
+    def _maybe_flush(self):
+        if len(self._dirty) + len(self._pending_logs) >= self.batch_size:
+            self._try_flush()
+
+    def _try_flush(self) -> bool:
+        """Запись по размеру пачки: при ошибке (например, база занята другим процессом) изменения
+        остаются в памяти до следующей записи, вызывающий не получает исключение"""
+        try:
+            self.flush()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def flush(self):
+        """Записывает накопленные изменения одной транзакцией"""
+        with self._lock:
+            if not self._dirty and not self._pending_logs:
+                return
+            created = [self._to_row(meta) for task_id, meta in self._dirty.items()
+                       if self._dirty_columns.get(task_id) is None]
+            stale = []
+            try:
+                self._conn.execute("BEGIN")
+                if created:
+                    self._conn.executemany(_UPSERT_SQL, created)
+                for task_id, meta in self._dirty.items():
+                    columns = self._dirty_columns.get(task_id)
+                    if columns and not self._write_columns(meta, columns):
+                        stale.append(task_id)
+                if self._pending_logs:
+                    self._conn.executemany(
+                        _APPEND_LOG_SQL, [(task_id, message, task_id) for task_id, message in self._pending_logs]
+                    )
+                self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                logger.exception("Не удалось записать задачи в хранилище")
+                raise
+            self._dirty = {}
+            self._dirty_columns = {}
+            self._pending_logs = []
+            for task_id in stale:
+                # Другой процесс уже завершил задачу: закэшированная копия устарела
+                self._cache.pop(task_id, None)
+
+    def _write_columns(self, meta: TaskMetadata, columns: Set[str]) -> bool:
+        """UPDATE изменённых столбцов; False - статус не записан, задача уже завершена другим процессом"""
+        values = dict(zip(_TASK_COLUMNS, self._to_row(meta)))
+        other = [c for c in _TASK_COLUMNS if c in columns and c not in self.STATUS_COLUMNS]
+        if other:
+            self._conn.execute(f"UPDATE tasks SET {', '.join(f'{c} = ?' for c in other)} WHERE id = ?",
+                               [values[c] for c in other] + [meta.id])
+        status = [c for c in self.STATUS_COLUMNS if c in columns]
+        if not status:
+            return True
+        cursor = self._conn.execute(
+            f"UPDATE tasks SET {', '.join(f'{c} = ?' for c in status)} "
+            f"WHERE id = ? AND (status = ? OR status NOT IN ({', '.join('?' for _ in _FINAL_STATUSES)}))",
+            [values[c] for c in status] + [meta.id, values["status"], *_FINAL_STATUSES]
+        )
+        return cursor.rowcount == 1
+
+    def _flush_loop(self, interval: float):
+        while not self._closed.wait(interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Ошибка фоновой записи задач")
+
+    # ---- file_id Telegram ----
+
+    def get_file_id(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT file_id FROM telegram_files WHERE key = ?", (key,)).fetchone()
+            return row[0] if row else None
+
+    def set_file_id(self, key: str, file_id: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO telegram_files (key, file_id) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET file_id = excluded.file_id", (key, file_id)
+            )
+
+    def delete_file_id(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM telegram_files WHERE key = ?", (key,))
+
+    # ---- загрузки ----
+
+    def register_upload(self, digest: str, size: int, now: int, file_unique_id: Optional[str] = None):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "INSERT INTO uploads (digest, size, last_used) VALUES (?, ?, ?) "
+                "ON CONFLICT(digest) DO UPDATE SET last_used = excluded.last_used", (digest, size, now)
+            )
+            if file_unique_id:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO telegram_uploads (file_unique_id, digest) VALUES (?, ?)",
+                    (file_unique_id, digest)
+                )
+            self._conn.execute("COMMIT")
+
+    def find_upload(self, file_unique_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT digest FROM telegram_uploads WHERE file_unique_id = ?", (file_unique_id,)
+            ).fetchone()
+            return row[0] if row else None
+
+    def add_upload_ref(self, task_id: str, digest: str, now: int):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute("INSERT OR IGNORE INTO upload_refs (task_id, digest) VALUES (?, ?)", (task_id, digest))
+            self._conn.execute("UPDATE uploads SET last_used = ? WHERE digest = ?", (now, digest))
+            self._conn.execute("COMMIT")
+
+    def release_upload_ref(self, task_id: str, now: int):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "UPDATE uploads SET last_used = ? WHERE digest = (SELECT digest FROM upload_refs WHERE task_id = ?)",
+                (now, task_id)
+            )
+            self._conn.execute("DELETE FROM upload_refs WHERE task_id = ?", (task_id,))
+            self._conn.execute("COMMIT")
+
+    def upload_refcount(self, digest: str) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM upload_refs WHERE digest = ?", (digest,)).fetchone()[0]
+
+    def orphan_uploads(self, used_before: int) -> List[str]:
+        """Загрузки без ссылок из задач, не использовавшиеся с used_before"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT digest FROM uploads u WHERE last_used < ? "
+                "AND NOT EXISTS (SELECT 1 FROM upload_refs r WHERE r.digest = u.digest)", (used_before,)
+            ).fetchall()
+            return [row[0] for row in rows]
+
+    def delete_upload(self, digest: str):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM telegram_uploads WHERE digest = ?", (digest,))
+            self._conn.execute("DELETE FROM uploads WHERE digest = ?", (digest,))
+            self._conn.execute("COMMIT")
+
+    # ---- кэш результатов ----
+
+    def memo_get(self, key: str, now: int) -> Optional[Tuple[str, TaskResult, Dict]]:
+        """(id исходной задачи, результат, метрики) или None; обновляет время использования"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT source_task_id, result_digest, result_filename, result_size, metrics "
+                "FROM result_memo WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE result_memo SET last_used = ? WHERE key = ?", (now, key))
+            source_task_id, digest, filename, size, metrics = row
+            return source_task_id, TaskResult(digest=digest, filename=filename, size=size), \
+                json.loads(metrics) if metrics else {}
+
+    def memo_put(self, key: str, meta: TaskMetadata, now: int, max_entries: int):
+        """Запоминает результат задачи; при превышении max_entries вытесняет давно не использованные"""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "INSERT OR REPLACE INTO result_memo (key, source_task_id, result_digest, result_filename, "
+                "result_size, metrics, last_used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, meta.id, meta.result.digest, meta.result.filename, meta.result.size,
+                 json.dumps(meta.metrics, ensure_ascii=False, default=str) if meta.metrics else None, now)
+            )
+            self._conn.execute(
+                "DELETE FROM result_memo WHERE key IN "
+                "(SELECT key FROM result_memo ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (max_entries,)
+            )
+            self._conn.execute("COMMIT")
+
+    def memo_delete(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM result_memo WHERE key = ?", (key,))
+
+    def memo_size(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM result_memo").fetchone()[0]
+
+    # ---- чтение ----
+
+    def get(self, task_id: str) -> Optional[TaskMetadata]:
+        with self._lock:
+            self._check_external_writes()
+            meta = self._cache.get(task_id)
+            if meta is not None:
+                self._cache.move_to_end(task_id)
+                return meta
+
+            row = self._conn.execute(
+                f"SELECT {', '.join(_TASK_COLUMNS)} FROM tasks WHERE id = ?", (task_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            meta = self._hydrate([row])[0]
+            self._cache_put(meta)
+            return meta
+
+    def get_many(self, task_ids: Iterable[str]) -> Dict[str, TaskMetadata]:
+        """
+        Задачи по списку идентификаторов за один проход: закэшированные - из кэша, остальные -
+        запросами по 500 id. Найденные в базе задачи в кэш не кладутся, чтобы проверка
+        большой когорты не вытесняла горячие задачи. Отсутствующих id в результате нет
+        """
+        with self._lock:
+            self._check_external_writes()
+            found: Dict[str, TaskMetadata] = {}
+            missing = []
+            for task_id in dict.fromkeys(task_ids):
+                meta = self._cache.get(task_id)
+                if meta is not None:
+                    found[task_id] = meta
+                else:
+                    missing.append(task_id)
+            for start in range(0, len(missing), 500):
+                chunk = missing[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT {', '.join(_TASK_COLUMNS)} FROM tasks WHERE id IN ({', '.join('?' for _ in chunk)})", chunk
+                ).fetchall()
+                for meta in self._hydrate(rows):
+                    found[meta.id] = meta
+            return found
+
+    def query(self, where: str = "", args: Iterable = (), order_by: str = "created_at DESC",
+              limit: Optional[int] = None) -> List[TaskMetadata]:
+        """Выбирает задачи SQL-условием (после записи накопленных изменений)"""
+        with self._lock:
+            self.flush()
+            self._check_external_writes()
+            sql = f"SELECT {', '.join(_TASK_COLUMNS)} FROM tasks"
+            if where:
+                sql += f" WHERE {where}"
+            if order_by:
+                sql += f" ORDER BY {order_by}"
+            args = list(args)
+            if limit is not None:
+                sql += " LIMIT ?"
+                args.append(limit)
+            rows = self._conn.execute(sql, args).fetchall()
+            return self._hydrate(rows)
+
+    def _hydrate(self, rows) -> List[TaskMetadata]:
+        """Собирает TaskMetadata из строк; уже закэшированные задачи берутся из кэша"""
+        result: List[TaskMetadata] = []
+        missing = [row[0] for row in rows if row[0] not in self._cache]
+        logs: Dict[str, List[str]] = {task_id: [] for task_id in missing}
+        for start in range(0, len(missing), 500):
+            chunk = missing[start:start + 500]
+            for task_id, message in self._conn.execute(
+                    f"SELECT task_id, message FROM task_logs WHERE task_id IN ({', '.join('?' for _ in chunk)}) "
+                    f"ORDER BY task_id, seq", chunk
+            ):
+                logs[task_id].append(message)
+
+        for row in rows:
+            cached = self._cache.get(row[0])
+            if cached is not None:
+                result.append(cached)
+                continue
+            result.append(self._from_row(row, logs[row[0]]))
+        return result
+
+    @staticmethod
+    def _to_row(meta: TaskMetadata) -> tuple:
+        return (
+            meta.id,
+            meta.owner_id,
+            meta.filename,
+            json.dumps(meta.params, ensure_ascii=False, default=str),
+            *(None if meta.params.get(p) is None else str(meta.params.get(p)) for p in INDEXED_PARAMS),
+            meta.status.value,
+            to_micros(meta.created_at),
+            to_micros(meta.started_at),
+            to_micros(meta.finished_at),
+            meta.file_path,
+            meta.result.filename if meta.result else None,
+            meta.result.digest if meta.result else None,
+            meta.result.size if meta.result else None,
+            json.dumps(meta.metrics, ensure_ascii=False, default=str) if meta.metrics else None,
+        )
+
+    @staticmethod
+    def _from_row(row, log: List[str]) -> TaskMetadata:
+        values = dict(zip(_TASK_COLUMNS, row))
+        result = None
+        if values["result_filename"] is not None:
+            result = TaskResult(
+                digest=values["result_digest"], filename=values["result_filename"], size=values["result_size"]
+            )
+        return TaskMetadata(
+            id=values["id"],
+            owner_id=values["owner_id"],
+            filename=values["filename"],
+            params=json.loads(values["params"]),
+            status=TaskStatus(values["status"]),
+            created_at=from_micros(values["created_at"]),
+            started_at=from_micros(values["started_at"]),
+            finished_at=from_micros(values["finished_at"]),
+            result=result,
+            log=log,
+            file_path=values["file_path"],
+            metrics=json.loads(values["metrics"]) if values["metrics"] else {},
+        )
+
+    def close(self):
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=5)
+        with self._lock:
+            self.flush()
+            self._conn.close()
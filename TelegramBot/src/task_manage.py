@@ -1,11 +1,33 @@
-import asyncio
+import logging
 import uuid
-from datetime import datetime, timezone
-from io import BytesIO
+from datetime import datetime, timedelta, timezone
 from dataclasses import dataclass, field
-from typing import Dict, List, Optional, Any
+from typing import BinaryIO, Callable, Dict, Iterable, List, Optional, Any, Tuple
 from enum import Enum
 
+from TelegramBot.config import UPLOAD_RETENTION, RESULT_MEMO_MAX_ENTRIES, JOB_LOW_PRIORITY_AFTER
+from .storage.blob_store import get_blob_store, get_upload_store
+from .storage.job_queue import get_job_queue, PRIORITY_LOW, PRIORITY_NORMAL
+
+logger = logging.getLogger(__name__)
+
+# Параметры задачи, по которым хранилище строит индексы
+INDEXED_PARAMS = ("instrument", "reference", "clustering")
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def to_micros(dt: Optional[datetime]) -> Optional[int]:
+    if dt is None:
+        return None
+    return (dt - _EPOCH) // timedelta(microseconds=1)
+
+
+def from_micros(value: Optional[int]) -> Optional[datetime]:
+    if value is None:
+        return None
+    return _EPOCH + timedelta(microseconds=value)
+
 
 class TaskStatus(Enum):
     PENDING = "pending"
@@ -17,8 +39,10 @@ class TaskStatus(Enum):
 
 @dataclass
 class TaskResult:
-    bytes: bytes
+    """Отчёт задачи; содержимое лежит в BlobStore под SHA-256 digest"""
+    digest: str
     filename: str
+    size: int = 0
 
 
 @dataclass
@@ -34,6 +58,25 @@ class TaskMetadata:
     result: Optional[TaskResult] = None
     log: List[str] = field(default_factory=list)
     file_path: Optional[str] = None
+    # Результаты стадий пайплайна (например, "qc"), попадают в отчёт
+    metrics: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class TaskPage:
+    """Страница списка задач; курсоры указывают на крайние задачи страницы"""
+    items: List[TaskMetadata]
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+
+
+def encode_cursor(t: TaskMetadata) -> str:
+    return f"{to_micros(t.created_at):x}:{t.id}"
+
+
+def decode_cursor(cursor: str) -> Tuple[int, str]:
+    created, task_id = cursor.split(":", 1)
+    return int(created, 16), task_id
 
 
 class TaskManager:
@@ -41,13 +84,37 @@ class TaskManager:
 
     def __new__(cls):
         if cls._instance is None:
+            from .storage.task_store import TaskStore
+
             cls._instance = super(TaskManager, cls).__new__(cls)
-            cls._instance.tasks: Dict[str, TaskMetadata] = {}
-            cls._instance._bg_tasks: Dict[str, asyncio.Task] = {}
+            cls._instance.store = TaskStore()
+            cls._instance.jobs = get_job_queue()
+            cls._instance.memo_hits = 0
+            cls._instance.memo_misses = 0
+            cls._instance._log_listeners = []
+            cls._instance._recover_interrupted()
         return cls._instance
 
-    def create_task(self, owner_id: str, filename: str, params: dict, file_path: str = None) -> str:
+    def _recover_interrupted(self):
+        """
+        Задачи pending/running без задания в очереди анализов больше некому выполнять.
+        Задания в очереди переживают перезапуск: их возьмёт воркер, в том числе после истечения аренды
+        """
+        where = "status IN (?, ?)"
+        for t in self.store.query(where, (TaskStatus.PENDING.value, TaskStatus.RUNNING.value), order_by=""):
+            if self.jobs.is_active(t.id):
+                continue
+            self.add_log(t.id, "Задача прервана перезапуском бота.")
+            self.set_status(t.id, TaskStatus.FAILED)
+
+    def create_task(self, owner_id: str, filename: str, params: dict, file_path: str = None,
+                    upload_digest: Optional[str] = None) -> str:
+        """upload_digest - загруженный файл из хранилища загрузок; задача держит на него ссылку"""
         task_id = str(uuid.uuid4())
+        if upload_digest:
+            file_path = get_upload_store().path(upload_digest)
+            params = {**params, "upload_digest": upload_digest}
+            self.store.add_upload_ref(task_id, upload_digest, to_micros(datetime.now(timezone.utc)))
         meta = TaskMetadata(
             id=task_id,
             owner_id=owner_id,
@@ -55,14 +122,18 @@ class TaskManager:
             params=params,
             file_path=file_path
         )
-        self.tasks[task_id] = meta
+        self.store.put(meta)
         return task_id
 
     def get(self, task_id: str) -> Optional[TaskMetadata]:
-        return self.tasks.get(task_id)
+        return self.store.get(task_id)
+
+    def get_many(self, task_ids: Iterable[str]) -> Dict[str, TaskMetadata]:
+        """Найденные задачи по id (отсутствующих в результате нет)"""
+        return self.store.get_many(task_ids)
 
     def set_status(self, task_id: str, status: TaskStatus):
-        t = self.tasks.get(task_id)
+        t = self.store.get(task_id)
         if not t:
             return
         t.status = status
@@ -70,30 +141,234 @@ class TaskManager:
             t.started_at = datetime.now(timezone.utc)
         elif status in (TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELED):
             t.finished_at = datetime.now(timezone.utc)
+            # Загруженный файл больше не нужен задаче; он остаётся для повторных запусков до истечения UPLOAD_RETENTION
+            self.store.release_upload_ref(task_id, to_micros(t.finished_at))
+        self.store.update(t, self.store.STATUS_COLUMNS)
 
     def add_log(self, task_id: str, message: str):
-        t = self.tasks.get(task_id)
+        t = self.store.get(task_id)
         if t:
-            t.log.append(f"[{datetime.now(timezone.utc).isoformat()}] {message}")
+            self.store.append_log(t, f"[{datetime.now(timezone.utc).isoformat()}] {message}")
+            for listener in self._log_listeners:
+                try:
+                    listener(task_id, message)
+                except Exception:
+                    logger.exception(f"Ошибка обработчика лога задачи {task_id}")
 
-    def attach_result(self, task_id: str, bytes_io: BytesIO, filename: str):
-        t = self.tasks.get(task_id)
+    def add_log_listener(self, listener: Callable[[str, str], None]):
+        """listener(task_id, сообщение) вызывается для каждой записи лога задач этого процесса"""
+        self._log_listeners.append(listener)
+
+    def remove_log_listener(self, listener: Callable[[str, str], None]):
+        if listener in self._log_listeners:
+            self._log_listeners.remove(listener)
+
+    def attach_result(self, task_id: str, bytes_io: BinaryIO, filename: str):
+        t = self.store.get(task_id)
         if t:
-            t.result = TaskResult(bytes=bytes_io.getvalue(), filename=filename)
+            bytes_io.seek(0)
+            digest, size = get_blob_store().put_stream(bytes_io)
+            t.result = TaskResult(digest=digest, filename=filename, size=size)
+            self.store.update(t, self.store.RESULT_COLUMNS)
+
+    def attach_features(self, task_id: str, bytes_io: BinaryIO):
+        """Таблица признаков задачи (для когорт) в BlobStore; ссылка хранится в metrics["features"]"""
+        bytes_io.seek(0)
+        digest, size = get_blob_store().put_stream(bytes_io)
+        self.set_metrics(task_id, "features", {"digest": digest, "size": size})
+
+    def features_path(self, t: TaskMetadata) -> Optional[str]:
+        features = t.metrics.get("features")
+        if not features or not get_blob_store().exists(features["digest"]):
+            return None
+        return get_blob_store().path(features["digest"])
 
     def list_for_user(self, owner_id: str, filters: Optional[Dict] = None) -> List[TaskMetadata]:
-        res = [t for t in self.tasks.values() if t.owner_id == owner_id]
-        if not filters:
-            return res
-        for k, v in filters.items():
-            res = [t for t in res if t.params.get(k) == v]
-        return res
+        where, args = self._owner_filters(owner_id, filters)
+        return self.store.query(" AND ".join(where), args)
+
+    @staticmethod
+    def _owner_filters(owner_id: str, filters: Optional[Dict]) -> Tuple[List[str], List[Any]]:
+        where = ["owner_id = ?"]
+        args: List[Any] = [owner_id]
+        for k, v in (filters or {}).items():
+            if k in INDEXED_PARAMS:
+                where.append(f"{k} = ?")
+            else:
+                where.append("json_extract(params, ?) = ?")
+                args.append(f'$."{k}"')
+            args.append(v)
+        return where, args
+
+    def query_for_user(
+            self,
+            owner_id: str,
+            filters: Optional[Dict] = None,
+            statuses: Optional[List[TaskStatus]] = None,
+            created_from: Optional[datetime] = None,
+            created_to: Optional[datetime] = None,
+            cursor: Optional[str] = None,
+            backward: bool = False,
+            limit: int = 20
+    ) -> TaskPage:
+        """
+        Страница задач пользователя от новых к старым.
+        cursor + backward=False - задачи старше курсора, backward=True - новее.
+        Выборка идёт по индексу (owner_id, [параметр], created_at, id), без полного прохода
+        """
+        where, args = self._owner_filters(owner_id, filters)
+        if statuses:
+            where.append(f"status IN ({', '.join('?' for _ in statuses)})")
+            args.extend(s.value for s in statuses)
+        if created_from is not None:
+            where.append("created_at >= ?")
+            args.append(to_micros(created_from))
+        if created_to is not None:
+            where.append("created_at < ?")
+            args.append(to_micros(created_to))
+        if cursor:
+            where.append("(created_at, id) > (?, ?)" if backward else "(created_at, id) < (?, ?)")
+            args.extend(decode_cursor(cursor))
+
+        order = "created_at ASC, id ASC" if backward else "created_at DESC, id DESC"
+        rows = self.store.query(" AND ".join(where), args, order_by=order, limit=limit + 1)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if backward:
+            rows.reverse()
+
+        page = TaskPage(items=rows)
+        if rows:
+            # Есть ли страница в направлении движения - известно по лишней строке,
+            # в обратном направлении страница есть, если мы пришли по курсору
+            older_exists = has_more if not backward else cursor is not None
+            newer_exists = has_more if backward else cursor is not None
+            if older_exists:
+                page.next_cursor = encode_cursor(rows[-1])
+            if newer_exists:
+                page.prev_cursor = encode_cursor(rows[0])
+        return page
+
+    def set_metrics(self, task_id: str, stage: str, values: Dict[str, Any]):
+        t = self.store.get(task_id)
+        if t:
+            t.metrics[stage] = values
+            self.store.update(t, self.store.METRICS_COLUMNS)
+
+    @staticmethod
+    def _memo_key(t: TaskMetadata) -> Optional[str]:
+        from .pipeline.worker import PIPELINE_VERSION
+
+        digest = t.params.get("upload_digest")
+        if not digest:
+            return None
+        parts = [digest] + [str(t.params.get(name)) for name in INDEXED_PARAMS] + [f"v{PIPELINE_VERSION}"]
+        return "|".join(parts)
+
+    def complete_from_memo(self, task_id: str) -> bool:
+        """
+        Если такой же файл с теми же параметрами уже анализировался, завершает задачу сразу,
+        ссылаясь на готовый отчёт. Возвращает True при попадании в кэш
+        """
+        t = self.store.get(task_id)
+        key = self._memo_key(t) if t else None
+        if key is None:
+            return False
+
+        hit = self.store.memo_get(key, to_micros(datetime.now(timezone.utc)))
+        if hit is not None and not get_blob_store().exists(hit[1].digest):
+            self.store.memo_delete(key)
+            hit = None
+        if hit is None:
+            self.memo_misses += 1
+            return False
+
+        self.memo_hits += 1
+        source_task_id, result, metrics = hit
+        t.result = result
+        t.metrics = dict(metrics)
+        self.store.update(t, self.store.RESULT_COLUMNS + self.store.METRICS_COLUMNS)
+        self.add_log(task_id, f"Результат взят из кэша (задача {source_task_id} с тем же файлом и параметрами).")
+        self.set_status(task_id, TaskStatus.COMPLETED)
+        return True
+
+    def remember_result(self, task_id: str):
+        """Добавляет результат завершённой задачи в кэш результатов"""
+        t = self.store.get(task_id)
+        key = self._memo_key(t) if t else None
+        if key and t.result:
+            self.store.memo_put(key, t, to_micros(datetime.now(timezone.utc)), RESULT_MEMO_MAX_ENTRIES)
+
+    def memo_stats(self) -> Dict[str, int]:
+        return {"hits": self.memo_hits, "misses": self.memo_misses, "entries": self.store.memo_size()}
+
+    def register_upload(self, digest: str, size: int, file_unique_id: Optional[str] = None):
+        self.store.register_upload(digest, size, to_micros(datetime.now(timezone.utc)), file_unique_id)
+
+    def find_upload(self, file_unique_id: str) -> Optional[str]:
+        """digest ранее загруженного файла Telegram, если он ещё есть в хранилище"""
+        digest = self.store.find_upload(file_unique_id)
+        if digest and get_upload_store().exists(digest):
+            return digest
+        return None
+
+    def collect_uploads(self, retention: float = UPLOAD_RETENTION) -> int:
+        """Удаляет загрузки без ссылок из задач, не использовавшиеся дольше retention секунд"""
+        cutoff = to_micros(datetime.now(timezone.utc) - timedelta(seconds=retention))
+        upload_store = get_upload_store()
+        removed = 0
+        for digest in self.store.orphan_uploads(cutoff):
+            self.store.delete_upload(digest)
+            upload_store.delete(digest)
+            removed += 1
+        return removed
+
+    def get_file_id(self, key: str) -> Optional[str]:
+        """file_id Telegram для ранее отправленного файла"""
+        return self.store.get_file_id(key)
+
+    def set_file_id(self, key: str, file_id: str):
+        self.store.set_file_id(key, file_id)
+
+    def forget_file_id(self, key: str):
+        self.store.delete_file_id(key)
+
+    def submit(self, task_id: str) -> int:
+        """
+        Ставит задачу в очередь анализов; пока воркер её не взял, статус остаётся pending.
+        Если у владельца уже ждут JOB_LOW_PRIORITY_AFTER заданий, задача получает пониженный приоритет
+        и выполняется после обычных заданий остальных пользователей. Возвращает приоритет
+        """
+        t = self.get(task_id)
+        priority = PRIORITY_LOW if self.jobs.queued_count(t.owner_id) >= JOB_LOW_PRIORITY_AFTER else PRIORITY_NORMAL
+        if priority == PRIORITY_LOW:
+            self.add_log(task_id, "Много задач пользователя в очереди: задача поставлена с пониженным приоритетом.")
+        # Воркер в другом процессе читает задачу из базы: она должна быть записана до постановки в очередь
+        self.flush()
+        self.jobs.enqueue(task_id, t.owner_id, priority)
+        return priority
+
+    def track_progress(self, task_id: str, chat_id: int, message_id: int):
+        """Сообщение, которое бот будет редактировать по мере выполнения этапов анализа"""
+        self.jobs.track_progress(task_id, chat_id, message_id)
+
+    def queue_position(self, task_id: str) -> Optional[Tuple[int, float]]:
+        """(позиция в очереди начиная с 1, оценка ожидания в секундах) или None, если задача не в очереди"""
+        queued = self.jobs.queue_position(task_id)
+        if queued is None:
+            return None
+        position, eta = queued
+        return position + 1, eta
 
     def cancel_task(self, task_id: str):
-        bg = self._bg_tasks.get(task_id)
-        if bg and not bg.done():
-            bg.cancel()
+        # Выполняющуюся задачу остановит воркер, заметив отмену в очереди
+        self.jobs.cancel(task_id)
         self.set_status(task_id, TaskStatus.CANCELED)
 
-    def store_bg_task(self, task_id: str, bg_task: asyncio.Task):
-        self._bg_tasks[task_id] = bg_task
\ No newline at end of file
+    def flush(self):
+        """Записывает накопленные изменения задач, не дожидаясь фоновой записи"""
+        self.store.flush()
+
+    def close(self):
+        """Сбрасывает несохранённые изменения на диск"""
+        self.store.close()
@@ -1,15 +1,16 @@
-import asyncio
 import logging
-from io import BytesIO
+from typing import Callable
 from ..task_manage import TaskManager, TaskStatus
+from ..pipeline.executor import get_pipeline_executor
 
 logger = logging.getLogger(__name__)
 
 
-async def simulate_analysis_and_generate_report(task_id: str, bot, dp):
+async def run_analysis(task_id: str, notify: Callable[[int, str], None]):
     """
-    Симулирует работу пайплайна и генерирует PDF-отчёт
-    Добавлен параметр dp (dispatcher) для корректного завершения
+    Симулирует работу пайплайна и генерирует PDF-отчёт. Выполняется воркером очереди анализов
+    (в процессе бота или в отдельном worker.py); уведомления владельцу уходят через notify(chat_id, текст) -
+    их отправляет процесс бота. Отмену (CancelledError) обрабатывает воркер
     """
     task_manager = TaskManager()
     t = task_manager.get(task_id)
@@ -18,78 +19,35 @@ async def simulate_analysis_and_generate_report(task_id: str, bot, dp):
 
     try:
         task_manager.set_status(task_id, TaskStatus.RUNNING)
-        task_manager.add_log(task_id, "Запуск анализа (симуляция).")
-
-        # ---- симуляция этапов с логированием ----
-        await asyncio.sleep(1)
-        task_manager.add_log(task_id, "Контроль качества: сбор метрик (симуляция).")
-        await asyncio.sleep(1)
-        task_manager.add_log(task_id, "Кластеризация/аннотация (симуляция).")
-        await asyncio.sleep(1)
-
-        # ---- генерация простого PDF отчёта ----
-        pdf_bytes = BytesIO()
-        filename = f"report_{task_id}.pdf"
+        task_manager.add_log(task_id, "Запуск анализа (симуляция) в отдельном процессе.")
 
+        # ---- этапы пайплайна выполняются в отдельном процессе, логи этапов приходят по мере выполнения ----
+        executor = get_pipeline_executor()
+        spec = {"filename": t.filename, "params": dict(t.params), "file_path": t.file_path}
         try:
-            from reportlab.pdfgen import canvas
-            from reportlab.lib.pagesizes import letter
-            c = canvas.Canvas(pdf_bytes, pagesize=letter)
-            c.setFont("Helvetica", 12)
-            c.drawString(72, 720, f"Task ID: {task_id}")
-            c.drawString(72, 700, f"Sample file: {t.filename}")
-            c.drawString(72, 680, f"Instrument: {t.params.get('instrument')}")
-            c.drawString(72, 660, f"Reference: {t.params.get('reference')}")
-            c.drawString(72, 640, f"Clustering: {t.params.get('clustering')}")
-            c.drawString(72, 600, " --- Simulated QC plot (placeholder) ---")
-            c.drawString(72, 580, "Alpha diversity: (simulated values)")
-            c.drawString(72, 560, "Beta diversity: (simulated values)")
-            c.drawString(72, 540, "Taxonomy table: (simulated)")
-            c.showPage()
-            c.save()
-            pdf_bytes.seek(0)
-        except Exception as e:
-            task_manager.add_log(task_id, f"reportlab not available or failed: {e}. Using TXT fallback.")
-            pdf_bytes = BytesIO()
-            txt = [
-                f"Task ID: {task_id}",
-                f"Sample file: {t.filename}",
-                f"Instrument: {t.params.get('instrument')}",
-                f"Reference: {t.params.get('reference')}",
-                f"Clustering: {t.params.get('clustering')}",
-                "",
-                "Simulated report (reportlab not installed)."
-            ]
-            pdf_bytes.write("\n".join(txt).encode("utf-8"))
-            pdf_bytes.seek(0)
-            filename = f"report_{task_id}.txt"
+            result = await executor.run(
+                task_id,
+                spec,
+                on_log=lambda message: task_manager.add_log(task_id, message),
+                on_metrics=lambda stage, values: task_manager.set_metrics(task_id, stage, values),
+            )
+            with open(result["path"], "rb") as report:
+                task_manager.attach_result(task_id, report, result["filename"])
+            if result.get("features"):
+                with open(result["features"], "rb") as features:
+                    task_manager.attach_features(task_id, features)
+        finally:
+            executor.cleanup(task_id)
 
-        # attach result
-        task_manager.attach_result(task_id, pdf_bytes, filename)
         task_manager.set_status(task_id, TaskStatus.COMPLETED)
+        task_manager.remember_result(task_id)
         task_manager.add_log(task_id, "Анализ завершён успешно.")
 
         # уведомление пользователя
-        try:
-            await bot.send_message(
-                int(t.owner_id),
-                f"Задача {task_id} завершена. Используйте /get_report {task_id} чтобы скачать отчёт."
-            )
-        except Exception:
-            logger.exception("Не удалось уведомить пользователя о завершении задачи.")
+        notify(int(t.owner_id), f"Задача {task_id} завершена. Используйте /get_report {task_id} чтобы скачать отчёт.")
 
-    except asyncio.CancelledError:
-        task_manager.add_log(task_id, "Фоновая задача была отменена.")
-        task_manager.set_status(task_id, TaskStatus.CANCELED)
-        logger.info(f"Задача {task_id} была корректно отменена")
     except Exception as e:
-        logger.exception(f"Ошибка в simulate_analysis_and_generate_report для задачи {task_id}")
+        logger.exception(f"Ошибка в run_analysis для задачи {task_id}")
         task_manager.add_log(task_id, f"Ошибка при обработке: {e}")
         task_manager.set_status(task_id, TaskStatus.FAILED)
-        try:
-            await bot.send_message(
-                int(t.owner_id),
-                f"Задача {task_id} завершилась с ошибкой. Используйте /status {task_id} для деталей."
-            )
-        except Exception:
-            pass
\ No newline at end of file
+        notify(int(t.owner_id), f"Задача {task_id} завершилась с ошибкой. Используйте /status {task_id} для деталей.")
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+from TelegramBot.config import JOB_NOTIFY_INTERVAL, PROGRESS_EDIT_INTERVAL
+from ..middlewares.outbound import bulk_lane
+from ..storage.job_queue import JobQueue, QUEUED, LEASED, DONE, FAILED, CANCELED
+
+logger = logging.getLogger(__name__)
+
+_STATE_LABELS = {
+    QUEUED: "⏳ в очереди",
+    LEASED: "⚙️ выполняется",
+    DONE: "✅ завершена",
+    FAILED: "❌ ошибка",
+    CANCELED: "🚫 отменена",
+}
+
+# Длина строки этапа в сообщении о ходе анализа
+_STAGE_LIMIT = 500
+
+
+def format_progress(task_id: str, stage: Optional[str], state: Optional[str]) -> str:
+    """Текст сообщения о ходе анализа: состояние задания и последний этап"""
+    text = f"Задача {task_id}\nСтатус: {_STATE_LABELS.get(state, 'обработка завершена')}"
+    if stage:
+        text += f"\nЭтап: {stage[:_STAGE_LIMIT]}"
+    if state == DONE:
+        text += f"\n\nОтчёт: /get_report {task_id}"
+    return text
+
+
+class NotificationRelay:
+    """
+    Отправляет уведомления, которые воркеры анализов записали в очередь (outbox), от имени бота.
+    Таблица перечитывается, только когда data_version очереди изменился (коммит другого соединения),
+    и раз в минуту на случай ошибок отправки. Уведомление удаляется после отправки; недоставляемые
+    (бот заблокирован, чат не найден) удаляются с записью в лог, при сетевых ошибках - повтор позже.
+    Здесь же редактируются сообщения о ходе анализа: этапы из лога задач, которые записывают воркеры
+    """
+
+    def __init__(self, bot: Bot, queue: Optional[JobQueue] = None, interval: float = JOB_NOTIFY_INTERVAL,
+                 edit_interval: float = PROGRESS_EDIT_INTERVAL):
+        self.bot = bot
+        # Своё соединение: изменения, сделанные через него, data_version не меняют
+        self.queue = queue or JobQueue()
+        self.interval = interval
+        self.edit_interval = edit_interval
+        self.sent = 0
+        self.dropped = 0
+        self.edits = 0
+        # Когда в чате можно следующую правку (time.monotonic) и когда повторить отложенные правки
+        self._next_edit: Dict[int, float] = {}
+        self._retry_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        seen_version = None
+        idle = 0.0
+        while True:
+            version = self.queue.data_version()
+            deferred_due = self._retry_at is not None and time.monotonic() >= self._retry_at
+            if version != seen_version or idle >= 60 or deferred_due:
+                seen_version = version
+                idle = 0.0
+                try:
+                    await self.deliver()
+                except Exception:
+                    logger.exception("Ошибка отправки уведомлений")
+                try:
+                    await self.deliver_progress()
+                except Exception:
+                    logger.exception("Ошибка обновления сообщений о ходе анализа")
+            await asyncio.sleep(self.interval)
+            idle += self.interval
+
+    async def deliver(self):
+        """Отправляет накопленные уведомления; при сетевой ошибке оставшиеся ждут следующего прохода"""
+        with bulk_lane():
+            await self._deliver()
+
+    async def _deliver(self):
+        while True:
+            pending = self.queue.pending_notifications()
+            if not pending:
+                return
+            # Пачка отправляется одновременно: очерёдность и лимиты по чатам соблюдает OutboundDispatcher,
+            # поэтому чат с множеством уведомлений не задерживает остальные
+            results = await asyncio.gather(*(self._send(chat_id, text) for _, chat_id, text in pending),
+                                           return_exceptions=True)
+            self.queue.ack_notifications([notification[0] for notification, result in zip(pending, results)
+                                          if not isinstance(result, BaseException)])
+            errors = [result for result in results if isinstance(result, BaseException)]
+            if errors:
+                # Неотправленные остаются в очереди до следующего прохода
+                raise errors[0]
+
+    async def _send(self, chat_id: int, text: str):
+        try:
+            await self.bot.send_message(chat_id, text)
+            self.sent += 1
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            logger.warning(f"Уведомление для {chat_id} не доставлено: {e}")
+            self.dropped += 1
+
+    def _defer(self, until: float):
+        self._retry_at = until if self._retry_at is None else min(self._retry_at, until)
+
+    async def deliver_progress(self):
+        """
+        Редактирует сообщения о ходе анализа, не чаще раза в edit_interval на чат: этапы, пришедшие
+        между правками, схлопываются в одну правку с последним. После правки с итоговым состоянием
+        задания сообщение больше не отслеживается
+        """
+        with bulk_lane():
+            await self._deliver_progress()
+
+    async def _deliver_progress(self):
+        now = time.monotonic()
+        self._retry_at = None
+        self._next_edit = {chat_id: at for chat_id, at in self._next_edit.items() if at > now}
+        for task_id, chat_id, message_id, stage, version, state in self.queue.pending_progress():
+            allowed = self._next_edit.get(chat_id, 0.0)
+            if allowed > now:
+                self._defer(allowed)
+                continue
+            final = state not in (QUEUED, LEASED)
+            try:
+                await self.bot.edit_message_text(format_progress(task_id, stage, state),
+                                                 chat_id=chat_id, message_id=message_id)
+                self.edits += 1
+            except TelegramRetryAfter as e:
+                self._next_edit[chat_id] = now + e.retry_after
+                self._defer(now + e.retry_after)
+                continue
+            except TelegramBadRequest as e:
+                if "message is not modified" not in str(e):
+                    # Сообщение удалено или недоступно - больше не отслеживаем
+                    logger.warning(f"Сообщение о ходе задачи {task_id} не обновлено: {e}")
+                    final = True
+            except TelegramForbiddenError as e:
+                logger.warning(f"Сообщение о ходе задачи {task_id} не обновлено: {e}")
+                final = True
+            self._next_edit[chat_id] = now + self.edit_interval
+            self.queue.ack_progress(task_id, version, final)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # Последний проход: уведомления завершившихся перед остановкой задач
+        try:
+            await self.deliver()
+        except Exception:
+            logger.exception("Не удалось отправить уведомления при остановке")
@@ -0,0 +1,101 @@
+"""
+Потоковая запись PDF: каждая страница сжимается и пишется в файл сразу после showPage,
+в памяти остаются только смещения объектов для таблицы xref. Поддерживается подмножество
+методов reportlab.pdfgen.canvas.Canvas, которым пользуются отчёты (setFont, drawString, showPage, save),
+и стандартные шрифты PDF без встраивания - для больших когортных отчётов из тысяч страниц
+"""
+import zlib
+from array import array
+from typing import BinaryIO, List, Tuple
+
+LETTER = (612.0, 792.0)
+
+# Стандартные шрифты PDF: имя ресурса на странице
+FONTS = {"Helvetica": "F1", "Helvetica-Bold": "F2", "Courier": "F3"}
+
+# Номера постоянных объектов; страница занимает два следующих номера (страница и её содержимое)
+_CATALOG, _PAGES, _RESOURCES = 1, 2, 3
+_FIRST_FONT = 4
+_FIRST_PAGE = _FIRST_FONT + len(FONTS)
+
+
+def _escape(text: str) -> bytes:
+    data = text.encode("cp1252", errors="replace")
+    return data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+
+class StreamingCanvas:
+    def __init__(self, path: str, pagesize: Tuple[float, float] = LETTER):
+        self.path = path
+        self.pagesize = pagesize
+        self._file: BinaryIO = open(path, "wb")
+        self._offsets = array("Q", [0] * (_FIRST_PAGE - 1))
+        self._pages = 0
+        self._content: List[bytes] = []
+        self._font = ("Helvetica", 12)
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        self._object(_CATALOG, b"<< /Type /Catalog /Pages 2 0 R >>")
+        fonts = b" ".join(f"/{name} {_FIRST_FONT + i} 0 R".encode() for i, name in enumerate(FONTS.values()))
+        self._object(_RESOURCES, b"<< /Font << " + fonts + b" >> >>")
+        for i, font in enumerate(FONTS):
+            self._object(_FIRST_FONT + i, f"<< /Type /Font /Subtype /Type1 /BaseFont /{font} "
+                                          f"/Encoding /WinAnsiEncoding >>".encode())
+
+    def _write(self, data: bytes):
+        self._file.write(data)
+
+    def _object(self, number: int, body: bytes):
+        if number > len(self._offsets):
+            self._offsets.extend([0] * (number - len(self._offsets)))
+        self._offsets[number - 1] = self._file.tell()
+        self._write(f"{number} 0 obj\n".encode() + body + b"\nendobj\n")
+
+    @property
+    def page_count(self) -> int:
+        return self._pages
+
+    def setFont(self, name: str, size: float):
+        if name not in FONTS:
+            raise ValueError(f"Unsupported font: {name}")
+        self._font = (name, size)
+
+    def drawString(self, x: float, y: float, text: str):
+        name, size = self._font
+        self._content.append(
+            f"BT /{FONTS[name]} {size:g} Tf {x:g} {y:g} Td (".encode() + _escape(text) + b") Tj ET"
+        )
+
+    def showPage(self):
+        """Завершает страницу: содержимое сжимается и пишется в файл, буфер страницы освобождается"""
+        number = _FIRST_PAGE + 2 * self._pages
+        stream = zlib.compress(b"\n".join(self._content))
+        width, height = self.pagesize
+        self._object(number, f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width:g} {height:g}] "
+                             f"/Resources 3 0 R /Contents {number + 1} 0 R >>".encode())
+        self._object(number + 1, f"<< /Length {len(stream)} /Filter /FlateDecode >>\nstream\n".encode()
+                     + stream + b"\nendstream")
+        self._pages += 1
+        self._content = []
+
+    def save(self):
+        if self._content:
+            self.showPage()
+        # Номера объектов страниц известны по счётчику: список Kids не хранится, а собирается при записи
+        self._offsets[_PAGES - 1] = self._file.tell()
+        self._write(f"{_PAGES} 0 obj\n<< /Type /Pages /Count {self._pages} /Kids [".encode())
+        for start in range(0, self._pages, 1024):
+            stop = min(start + 1024, self._pages)
+            self._write(b"".join(f"{_FIRST_PAGE + 2 * i} 0 R ".encode() for i in range(start, stop)))
+        self._write(b"] >>\nendobj\n")
+
+        xref = self._file.tell()
+        self._write(f"xref\n0 {len(self._offsets) + 1}\n0000000000 65535 f \n".encode())
+        for start in range(0, len(self._offsets), 4096):
+            self._write(b"".join(f"{offset:010d} 00000 n \n".encode() for offset in self._offsets[start:start + 4096]))
+        self._write(f"trailer\n<< /Size {len(self._offsets) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+        self._file.close()
+
+    def close(self):
+        """Закрывает файл без завершения документа (при ошибке рендеринга)"""
+        if not self._file.closed:
+            self._file.close()
@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Optional
+
+from TelegramBot.config import RENDER_WORKERS, RENDER_QUEUE_SIZE, RENDER_QUEUE_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+
+class RenderQueueFull(Exception):
+    """Очередь рендеринга заполнена"""
+    pass
+
+
+def _warmup():
+    # Импорт reportlab в процессе пула заранее, чтобы первый отчёт не платил за него
+    try:
+        import reportlab.pdfgen.canvas  # noqa: F401
+    except ImportError:
+        pass
+
+
+class RenderExecutor:
+    """
+    Пул процессов для рендеринга отчётов, чтобы reportlab не блокировал event loop.
+    Число принятых (выполняемых и ожидающих) заданий ограничено queue_size
+    """
+
+    def __init__(self, workers: int = RENDER_WORKERS, queue_size: int = RENDER_QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._accepted = 0
+
+    def _ensure_started(self):
+        if self._executor is None:
+            # spawn: дочерние процессы не наследуют потоки и соединения бота
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_warmup
+            )
+            self._loop = asyncio.get_running_loop()
+            self._slots = asyncio.Semaphore(self.queue_size)
+
+    @property
+    def queue_depth(self) -> int:
+        """Сколько заданий сейчас принято пулом"""
+        return self._accepted
+
+    async def render(self, fn: Callable[..., Any], *args, timeout: Optional[float] = None) -> Any:
+        """
+        Выполняет fn(*args) в процессе пула.
+        Если очередь заполнена, ждёт свободного места не дольше timeout (None - без ограничения)
+        """
+        self._ensure_started()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise RenderQueueFull(f"Render queue is full ({self.queue_size} jobs)")
+
+        self._accepted += 1
+
+        try:
+            cf = self._executor.submit(fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        # Слот освобождается по завершении задания в пуле, а не по отмене ожидающего:
+        # иначе отменённые запросы позволили бы переполнить пул
+        cf.add_done_callback(self._on_done)
+        return await asyncio.wrap_future(cf)
+
+    def _release(self):
+        self._accepted -= 1
+        self._slots.release()
+
+    def _on_done(self, _):
+        try:
+            self._loop.call_soon_threadsafe(self._release)
+        except RuntimeError:
+            # event loop уже закрыт - бот завершает работу
+            pass
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# Singleton для удобного использования
+_render_executor_instance: Optional[RenderExecutor] = None
+
+
+def get_render_executor() -> RenderExecutor:
+    """Получает экземпляр RenderExecutor (singleton)"""
+    global _render_executor_instance
+
+    if _render_executor_instance is None:
+        _render_executor_instance = RenderExecutor()
+
+    return _render_executor_instance
+
+
+async def render_interactive(fn: Callable[..., Any], *args) -> Any:
+    """Рендеринг по запросу пользователя: при переполненной очереди ждёт не дольше RENDER_QUEUE_TIMEOUT"""
+    return await get_render_executor().render(fn, *args, timeout=RENDER_QUEUE_TIMEOUT)
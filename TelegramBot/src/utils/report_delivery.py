@@ -0,0 +1,67 @@
+import hashlib
+import logging
+from typing import Awaitable, Callable, Iterable
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile, FSInputFile, InputFile, Message
+
+from ..task_manage import TaskManager, TaskResult
+from ..storage.blob_store import get_blob_store
+
+logger = logging.getLogger(__name__)
+
+# Версия формата когортного отчёта: при её смене сохранённые file_id когорт перестают совпадать
+COHORT_REPORT_VERSION = 3
+
+
+def report_file_key(result: TaskResult) -> str:
+    return f"blob:{result.digest}"
+
+
+def cohort_file_key(task_ids: Iterable[str]) -> str:
+    digest = hashlib.sha256(",".join(sorted(set(task_ids))).encode("utf-8")).hexdigest()
+    return f"cohort:v{COHORT_REPORT_VERSION}:{digest}"
+
+
+async def send_cached_document(
+        bot: Bot,
+        chat_id: int,
+        key: str,
+        make_document: Callable[[], Awaitable[InputFile]],
+        **kwargs
+) -> Message:
+    """
+    Отправляет документ по сохранённому file_id, а если его нет или Telegram его отверг -
+    загружает файл заново (make_document) и запоминает новый file_id
+    """
+    task_manager = TaskManager()
+    file_id = task_manager.get_file_id(key)
+    if file_id:
+        try:
+            return await bot.send_document(chat_id=chat_id, document=file_id, **kwargs)
+        except TelegramBadRequest as e:
+            logger.warning(f"Telegram rejected cached file_id for {key}: {e}. Uploading again")
+            task_manager.forget_file_id(key)
+
+    message = await bot.send_document(chat_id=chat_id, document=await make_document(), **kwargs)
+    if message.document:
+        task_manager.set_file_id(key, message.document.file_id)
+    return message
+
+
+async def send_task_report(bot: Bot, chat_id: int, result: TaskResult) -> Message:
+    """Отправляет отчёт задачи, загружая файл в Telegram только при первой отправке.
+    FileNotFoundError - файла отчёта нет, а сохранённый file_id Telegram отверг (или его нет)"""
+    async def make_document() -> InputFile:
+        blobs = get_blob_store()
+        # Небольшие недавние отчёты отдаются из памяти, остальные - потоком из файла
+        data = blobs.get_cached(result.digest)
+        if data is not None:
+            return BufferedInputFile(data, filename=result.filename)
+        # FSInputFile открывает файл только во время запроса: отсутствие проверяется заранее
+        if not blobs.exists(result.digest):
+            raise FileNotFoundError(blobs.path(result.digest))
+        return FSInputFile(blobs.path(result.digest), filename=result.filename)
+
+    return await send_cached_document(bot, chat_id, report_file_key(result), make_document)
@@ -0,0 +1,288 @@
+"""
+Рендеринг отчётов. Функции модуля выполняются в процессах пула рендеринга,
+поэтому принимают и возвращают только простые (picklable) значения и не зависят от aiogram
+"""
+import os
+from io import BytesIO
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+def render_task_report(spec: Dict[str, Any]) -> Tuple[bytes, str, Optional[str]]:
+    """
+    Отчёт по задаче. spec: task_id, filename, params и необязательные метрики qc.
+    Возвращает (содержимое, имя файла, ошибка reportlab или None - тогда отчёт в TXT)
+    """
+    task_id = spec["task_id"]
+    params = spec.get("params", {})
+
+    try:
+        from reportlab.pdfgen import canvas
+        from reportlab.lib.pagesizes import letter
+        pdf_bytes = BytesIO()
+        c = canvas.Canvas(pdf_bytes, pagesize=letter)
+        c.setFont("Helvetica", 12)
+        c.drawString(72, 720, f"Task ID: {task_id}")
+        c.drawString(72, 700, f"Sample file: {spec.get('filename')}")
+        c.drawString(72, 680, f"Instrument: {params.get('instrument')}")
+        c.drawString(72, 660, f"Reference: {params.get('reference')}")
+        c.drawString(72, 640, f"Clustering: {params.get('clustering')}")
+        qc = spec.get("qc")
+        if qc:
+            y = _draw_qc(c, qc, top=600)
+        else:
+            c.drawString(72, 600, " --- Simulated QC plot (placeholder) ---")
+            y = 580
+        for line in _stage_lines(spec):
+            c.drawString(72, y, line)
+            y -= 20
+        c.drawString(72, y, "Alpha diversity: (simulated values)")
+        c.drawString(72, y - 20, "Beta diversity: (simulated values)")
+        if not spec.get("taxonomy"):
+            c.drawString(72, y - 40, "Taxonomy table: (simulated)")
+        c.showPage()
+        if spec.get("taxonomy"):
+            _draw_taxonomy(c, spec["taxonomy"])
+        if spec.get("samples"):
+            _draw_samples(c, spec["samples"])
+        c.save()
+        return pdf_bytes.getvalue(), f"report_{task_id}.pdf", None
+    except Exception as e:
+        txt = [
+            f"Task ID: {task_id}",
+            f"Sample file: {spec.get('filename')}",
+            f"Instrument: {params.get('instrument')}",
+            f"Reference: {params.get('reference')}",
+            f"Clustering: {params.get('clustering')}",
+        ]
+        if spec.get("qc"):
+            txt += [""] + _qc_lines(spec["qc"])
+        txt += _stage_lines(spec)
+        if spec.get("taxonomy"):
+            txt += ["", "Taxonomy:"] + _taxonomy_lines(spec["taxonomy"])
+        if spec.get("samples"):
+            txt += ["", "Samples:"] + _sample_lines(spec["samples"])
+        txt += ["", "Simulated report (reportlab not installed)."]
+        return "\n".join(txt).encode("utf-8"), f"report_{task_id}.txt", str(e)
+
+
+def _stage_lines(spec: Dict[str, Any]) -> List[str]:
+    """Сводка этапов пайплайна после контроля качества"""
+    lines = []
+    derep = spec.get("derep")
+    if derep:
+        lines.append(
+            f"Dereplication: {derep['uniques']:,} unique sequences from {derep['dereplicated_reads']:,} reads "
+            f"({derep['singletons']:,} singletons, {derep['ambiguous_reads']:,} reads with N skipped)"
+        )
+    otu = spec.get("otu")
+    if otu:
+        lines.append(
+            f"OTU clustering ({otu['identity']:.0%} identity): {otu['otus']:,} OTUs "
+            f"from {otu['clustered_uniques']:,} unique sequences"
+        )
+    taxonomy = spec.get("taxonomy")
+    if taxonomy:
+        lines.append(
+            f"Taxonomy ({taxonomy['reference']}, confidence {taxonomy['confidence_threshold']}): "
+            f"{taxonomy['assigned']:,} of {taxonomy['queries']:,} sequences assigned, {taxonomy['taxa']:,} taxa"
+        )
+    return lines
+
+
+def _qc_lines(qc: Dict[str, Any]) -> List[str]:
+    return [
+        f"Reads: {qc['reads']:,}   Bases: {qc['bases']:,}",
+        f"Length: min {qc['min_length']}, mean {qc['mean_length']:.1f}, max {qc['max_length']}",
+        f"GC content: {qc['gc_content'] * 100:.2f}%   N rate: {qc['n_rate'] * 100:.3f}%",
+        f"Mean quality: {qc['mean_quality']:.1f}   Q30 bases: {qc['q30_rate'] * 100:.2f}%",
+        f"Duplication (estimate): {qc['duplication_rate'] * 100:.2f}%",
+    ]
+
+
+def _draw_qc(c, qc: Dict[str, Any], top: int) -> int:
+    """Блок контроля качества: сводные метрики и график качества по позициям (p10/медиана/p90)"""
+    c.drawString(72, top, "Quality control")
+    y = top - 20
+    for line in _qc_lines(qc):
+        c.drawString(90, y, line)
+        y -= 18
+
+    quantiles = qc.get("position_quality_quantiles") or {}
+    median = quantiles.get("0.5") or []
+    if not median:
+        return y - 10
+
+    left, bottom, width, height = 90, y - 170, 430, 150
+    max_q = max(41, max(quantiles.get("0.9") or median))
+    c.setFont("Helvetica", 8)
+    c.rect(left, bottom, width, height)
+    for q in range(0, max_q + 1, 10):
+        qy = bottom + height * q / max_q
+        c.drawString(left - 18, qy - 3, str(q))
+    c.drawString(left, bottom - 12, "1")
+    c.drawRightString(left + width, bottom - 12, str(len(median)))
+    c.drawString(left + width / 2 - 40, bottom - 12, "Position in read")
+
+    step = width / max(len(median) - 1, 1)
+    for key, gray in (("0.1", 0.7), ("0.9", 0.7), ("0.5", 0.0)):
+        values = quantiles.get(key) or []
+        points = [(left + i * step, bottom + height * v / max_q) for i, v in enumerate(values)]
+        c.setStrokeGray(gray)
+        c.lines([(x1, y1, x2, y2) for (x1, y1), (x2, y2) in zip(points, points[1:])])
+    c.setStrokeGray(0)
+    c.setFont("Helvetica", 12)
+    return bottom - 30
+
+
+def _sample_lines(samples: Dict[str, Dict[str, Any]]) -> List[str]:
+    return [
+        f"{name[:40]:<40} {qc['reads']:>12,} {qc['mean_length']:>7.1f} {qc['gc_content'] * 100:>6.1f}% "
+        f"{qc['q30_rate'] * 100:>6.1f}% {qc['duplication_rate'] * 100:>6.1f}%"
+        for name, qc in samples.items()
+    ]
+
+
+def _draw_samples(c, samples: Dict[str, Dict[str, Any]]):
+    """Таблица метрик по образцам архива, при необходимости на нескольких страницах"""
+    header = f"{'Sample':<40} {'Reads':>12} {'Length':>7} {'GC':>7} {'Q30':>7} {'Dup':>7}"
+    lines = _sample_lines(samples)
+    per_page = 50
+    for start in range(0, len(lines), per_page):
+        c.setFont("Helvetica", 12)
+        c.drawString(72, 740, f"Per-sample quality control ({len(samples)} samples)")
+        c.setFont("Courier", 8)
+        y = 715
+        for line in [header] + lines[start:start + per_page]:
+            c.drawString(50, y, line)
+            y -= 13
+        c.showPage()
+
+
+def _taxonomy_lines(taxonomy: Dict[str, Any]) -> List[str]:
+    total = taxonomy["reads"] or 1
+    return [f"{reads:>12,} {reads / total * 100:>6.2f}%  {lineage}" for lineage, reads in taxonomy["table"]]
+
+
+def _draw_taxonomy(c, taxonomy: Dict[str, Any]):
+    """Самые многочисленные таксоны: число ридов, доля и линия до достоверного уровня"""
+    c.setFont("Helvetica", 12)
+    c.drawString(72, 740, f"Taxonomy table ({taxonomy['reference']}, top {len(taxonomy['table'])} of {taxonomy['taxa']})")
+    c.setFont("Courier", 8)
+    y = 715
+    for line in [f"{'Reads':>12} {'Share':>7}  Lineage"] + _taxonomy_lines(taxonomy):
+        c.drawString(50, y, line[:120])
+        y -= 13
+    c.showPage()
+
+
+def render_cohort_report(specs: List[Dict[str, Any]], path: str) -> Dict[str, int]:
+    """
+    Когортный отчёт: альфа- и бета-разнообразие по таблицам признаков задач, записывается в файл path.
+    specs: task_id, filename, params, features_digest и features_path (None - у задачи нет таблицы признаков).
+    Векторы задач и уже посчитанные попарные расстояния берутся из кэша когорт; страницы пишутся
+    в файл по мере готовности (StreamingCanvas), поэтому память не растёт с числом страниц.
+    Возвращает число страниц и размер файла
+    """
+    from .pdf_stream import StreamingCanvas
+    from ..pipeline.cohort_cache import get_cohort_cache
+
+    with_features = [spec for spec in specs if spec.get("features_path")]
+    missing = [spec["task_id"] for spec in specs if not spec.get("features_path")]
+    diversity = get_cohort_cache().diversity(
+        [(spec["task_id"], spec["features_digest"], spec["features_path"]) for spec in with_features]
+    )
+    table = diversity["table"]
+
+    c = StreamingCanvas(path)
+    try:
+        c.setFont("Helvetica", 12)
+        c.drawString(72, 720, f"Cohort report: {len(specs)} tasks")
+        y = 690
+        for line in _cohort_summary_lines(table, diversity, missing):
+            c.drawString(72, y, line)
+            y -= 20
+        c.showPage()
+        _draw_cohort_samples(c, table.samples, diversity)
+        c.save()
+    except BaseException:
+        c.close()
+        raise
+    return {"pages": c.page_count, "size": os.path.getsize(path)}
+
+
+def _upper_triangle(matrix: np.ndarray) -> np.ndarray:
+    """Значения над диагональю построчно, в float32: без массивов индексов triu_indices размером n²"""
+    n = len(matrix)
+    values = np.empty(n * (n - 1) // 2, dtype=np.float32)
+    position = 0
+    for i in range(n - 1):
+        values[position:position + n - 1 - i] = matrix[i, i + 1:]
+        position += n - 1 - i
+    return values
+
+
+def _cohort_summary_lines(table, diversity: Dict[str, Any], missing: List[str]) -> List[str]:
+    n, features = table.shape
+    lines = [f"Samples with feature tables: {n:,}   Features: {features:,}"]
+    if missing:
+        shown = ", ".join(missing[:5]) + (" ..." if len(missing) > 5 else "")
+        lines.append(f"Excluded (no feature table): {len(missing)} - {shown}")
+    if n > 1:
+        for name, key in (("Bray-Curtis", "bray_curtis"), ("Jaccard", "jaccard")):
+            values = _upper_triangle(diversity[key])
+            mean, low, high = values.mean(dtype=np.float64), values.min(), values.max()
+            # Медиана - np.partition на месте, без копии
+            middle = len(values) // 2
+            values.partition(middle)
+            median = values[middle] if len(values) % 2 else (values[:middle].max() + values[middle]) / 2
+            del values
+            lines.append(f"{name}: mean {mean:.3f}, median {median:.3f}, min {low:.3f}, max {high:.3f}")
+    cache = diversity.get("cache")
+    if cache and cache["total_pairs"]:
+        lines.append(f"Pairwise distances reused from cache: {cache['cached_pairs']:,} of {cache['total_pairs']:,} "
+                     f"(recomputed rows: {cache['computed_rows']:,})")
+    alpha = diversity["alpha"]
+    if n:
+        lines.append(f"Shannon: mean {alpha['shannon'].mean():.3f}   Observed features: mean {alpha['observed'].mean():.1f}")
+    return lines
+
+
+def _nearest(bray_curtis: np.ndarray, block: int = 256) -> Tuple[np.ndarray, np.ndarray]:
+    """Ближайший по Брэю-Кёртису образец (без самого образца) и среднее расстояние, блоками строк"""
+    n = len(bray_curtis)
+    nearest = np.empty(n, dtype=np.int64)
+    for start in range(0, n, block):
+        rows = bray_curtis[start:start + block].copy()
+        rows[np.arange(len(rows)), np.arange(start, start + len(rows))] = np.inf
+        nearest[start:start + block] = rows.argmin(axis=1)
+    return nearest, bray_curtis.sum(axis=1, dtype=np.float64) / (n - 1)
+
+
+def _draw_cohort_samples(c, samples: List[str], diversity: Dict[str, Any]):
+    """Альфа-разнообразие по образцам и ближайший по Брэю-Кёртису образец, по 50 строк на страницу"""
+    alpha = diversity["alpha"]
+    bray_curtis = diversity["bray_curtis"]
+    n = len(samples)
+    if n > 1:
+        nearest, mean_bc = _nearest(bray_curtis)
+    header = f"{'Task':<20} {'Reads':>10} {'Observed':>9} {'Chao1':>9} {'Shannon':>8} {'Simpson':>8} " \
+             f"{'Mean BC':>8}  Nearest (BC)"
+    per_page = 50
+    # Строки собираются по странице: на тысячах образцов весь список строк не держится в памяти
+    for start in range(0, n, per_page):
+        c.setFont("Helvetica", 12)
+        c.drawString(72, 740, f"Alpha diversity and nearest samples ({n} samples)")
+        c.setFont("Courier", 7)
+        c.drawString(40, 715, header)
+        y = 702
+        for i in range(start, min(start + per_page, n)):
+            name = samples[i]
+            line = (f"{name[:20]:<20} {alpha['reads'][i]:>10,} {alpha['observed'][i]:>9,} {alpha['chao1'][i]:>9.1f} "
+                    f"{alpha['shannon'][i]:>8.3f} {alpha['simpson'][i]:>8.3f}")
+            if n > 1:
+                line += f" {mean_bc[i]:>8.3f}  {samples[nearest[i]][:20]} ({bray_curtis[i, nearest[i]]:.3f})"
+            c.drawString(40, y, line)
+            y -= 13
+        c.showPage()
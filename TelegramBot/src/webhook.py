@@ -0,0 +1,118 @@
+import asyncio
+import hmac
+import logging
+from typing import Dict, List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+
+from TelegramBot.config import (
+    WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_QUEUE_SIZE, WEBHOOK_WORKERS,
+)
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """
+    Приём апдейтов по webhook. Запрос с верным секретом сразу получает 200, апдейт кладётся
+    в ограниченную очередь и обрабатывается одним из workers обработчиков через dp.feed_update.
+    Когда очередь заполнена, Telegram получает 503 и повторит доставку позже - очередь
+    не растёт без ограничений, а обработка идёт не больше чем в workers задачах
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, secret: str = WEBHOOK_SECRET, path: str = WEBHOOK_PATH,
+                 host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT,
+                 queue_size: int = WEBHOOK_QUEUE_SIZE, workers: int = WEBHOOK_WORKERS):
+        if not secret:
+            raise ValueError("Webhook mode requires WEBHOOK_SECRET")
+        self.dp = dp
+        self.bot = bot
+        self.secret = secret
+        self.path = path
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._worker_tasks: List[asyncio.Task] = []
+        self._runner: Optional[web.AppRunner] = None
+        self.received = 0
+        self.rejected = 0
+        self.unauthorized = 0
+        self.processed = 0
+        self.failed = 0
+        self.max_depth = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        token = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token.encode(), self.secret.encode()):
+            self.unauthorized += 1
+            return web.Response(status=401)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception as e:
+            logger.warning(f"Некорректный апдейт в webhook: {e}")
+            return web.Response(status=400)
+        try:
+            self._queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return web.Response(status=503)
+        self.received += 1
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+        return web.Response()
+
+    async def _work(self):
+        while True:
+            update = await self._queue.get()
+            try:
+                await self.dp.feed_update(self.bot, update)
+                self.processed += 1
+            except Exception:
+                self.failed += 1
+                logger.exception(f"Ошибка обработки апдейта {update.update_id}")
+            finally:
+                self._queue.task_done()
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    async def start(self):
+        self._worker_tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Webhook server listening on {self.host}:{self.port}{self.path}")
+
+    async def stop(self, timeout: float = 10.0):
+        """Перестаёт принимать запросы, дорабатывает очередь (не дольше timeout) и останавливает обработчики"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Необработанных апдейтов при остановке: {self._queue.qsize()}")
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "received": self.received,
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "unauthorized": self.unauthorized,
+            "max_depth": self.max_depth,
+        }
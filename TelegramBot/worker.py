@@ -0,0 +1,51 @@
+"""
+Отдельный процесс-воркер анализов: берёт задания из общей очереди (JOB_QUEUE_PATH) и выполняет их,
+не обращаясь к Telegram - уведомления отправляет процесс бота. Воркеров можно запускать несколько,
+но только на той же машине, что и бот: очередь и хранилище задач - SQLite в режиме WAL, которому нужна
+общая память процессов; на сетевой файловой системе (NFS, SMB) базы могут быть повреждены.
+Чтобы анализы выполняли только отдельные воркеры, боту задаётся JOB_EMBEDDED_WORKER=0.
+
+Запуск:
+    python worker.py
+"""
+import asyncio
+import logging
+import signal
+
+from TelegramBot.config import REFERENCE_PRELOAD
+from src.analysis_worker import AnalysisWorker
+from src.task_manage import TaskManager
+from src.pipeline.references import get_reference_registry
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+async def main():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    # Индексы референсов читаются в страничный кэш один раз для всех процессов пайплайна этого воркера
+    registry = get_reference_registry()
+    await asyncio.to_thread(registry.preload, REFERENCE_PRELOAD)
+    registry.start_watching()
+
+    task_manager = TaskManager()
+    worker = AnalysisWorker()
+    worker.start()
+    await stop.wait()
+
+    logger.info("Получен сигнал завершения")
+    # Выполняющиеся анализы возвращаются в очередь
+    await worker.stop()
+    await registry.stop_watching()
+    task_manager.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())